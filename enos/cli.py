@@ -22,12 +22,16 @@ COMMANDS:
   os             Install OpenStack.
   init           Initialise OpenStack with the bare necessities.
   deploy         Alias for enos up, then enos os and finally enos init.
+  scale          Add nodes to the deployment without redeploying it.
   bench          Run Rally/Shaker on this OpenStack.
   backup         Backup OpenStack/bench logs.
   tc             Enforce network constraints
   info           Show information of the actual deployment.
   destroy        Destroy the deployment and optionally the related resources.
   build          Build a reference image for later deployment.
+  cache          Show or purge the cache of testbed API lookups.
+  facts          Show or refresh the cached Ansible facts of hosts.
+  serve          Run a daemon that keeps enos loaded between commands.
   help           Show this help message.
 
 See 'enos help <command>' for more information on a specific command.
@@ -39,29 +43,44 @@ import sys
 import textwrap
 from contextlib import contextmanager
 from pathlib import Path
-from typing import Any, Callable, Dict, Optional
+from typing import Any, Callable, Dict, List, Optional
 
 import enos.utils.constants as C
 import yaml
 from docopt import docopt
+from enos.utils import daemon
 from enos.utils.cli import CLI
-from enos.utils.errors import (EnosFilePathError, EnosUnknownProvider,
-    MissingEnvState)
+from enos.utils.errors import (EnosCannotScale, EnosFilePathError,
+    EnosUnknownProvider, EnosUnknownStep, MissingEnvState)
 
 
 def up(**kwargs):
     """\
     USAGE:
-      enos up [-f CONFIG_FILE] [--force-deploy] [-t TAGS] [--pull] [-e ENV]
+      enos up [-f CONFIG_FILE] [--force-deploy] [-t TAGS] [--pull]
+              [--seed-registry BUNDLE] [-e ENV]
+      enos up (--resume | --only STEP) [--force-deploy] [-t TAGS] [--pull]
+              [--seed-registry BUNDLE] [-e ENV]
 
       Get and setup resources on the testbed.
 
+      The setup is made of the following steps: provider, sync_info,
+      inventory, docker, kolla, bootstrap, openrc, baremetal and monitoring.
+      Each completed step is recorded in the environment, so that a failed
+      setup can be resumed with `--resume`.
+
     OPTIONS:
       -f CONFIG_FILE   Path to the configuration file describing the
                        deployment [default: ./reservation.yaml].
       --force-deploy   Force deployment.
       -t, --tags TAGS  Only run ansible tasks tagged with these values.
       --pull           Only preinstall software (e.g pull docker images).
+      --resume         Continue a former setup from its first incomplete step.
+      --only STEP      Only run the step STEP of a former setup.
+      --seed-registry BUNDLE
+                       Restore the kolla images of BUNDLE in the internal
+                       registry before it starts (see `enos backup
+                       --export-registry`).
       -e, --env ENV    Path to the environment directory (Advanced option). Enos
                        creates a directory to track the state of the
                        experiment. Use this option to link enos with a different
@@ -70,6 +89,7 @@ def up(**kwargs):
 
     logging.debug('phase[up]: args=%s' % kwargs)
     from enos import tasks
+    from enos.tasks.up import CARRIED_KEYS
     from enos.utils.errors import EnosFilePathError
 
     # Get parameters
@@ -77,12 +97,25 @@ def up(**kwargs):
     is_force_deploy = kwargs.get('--force-deploy', False)
     is_pull_only = kwargs.get('--pull', False)
     tags = kwargs.get('--tags', None)
+    is_resume = kwargs.get('--resume', False)
+    only_step = kwargs.get('--only', None)
+    is_new = not (is_resume or only_step)
+    seed_registry = kwargs.get('--seed-registry', None)
+    if seed_registry is not None:
+        seed_registry = pathlib.Path(seed_registry).resolve()
+        if not seed_registry.is_file():
+            CLI.error(f'The registry bundle "{seed_registry}" does not exist')
+            sys.exit(1)
 
     # Launch the *up* task
     try:
-        with _elib_open(kwargs.get('--env'), new=True) as env:
-            config = _load_config(config_file)
-            tasks.up(env, config, is_force_deploy, is_pull_only, tags)
+        with _elib_open(kwargs.get('--env'), new=is_new,
+                        carry=CARRIED_KEYS) as env:
+            # Resuming reuses the configuration recorded in the env
+            config = _load_config(config_file) if is_new else None
+            tasks.up(env, config, is_force_deploy, is_pull_only, tags,
+                     resume=is_resume, only=only_step,
+                     seed_registry=seed_registry)
 
             CLI.print("""\
             The setup of your testbed completed successfully.  You may proceed
@@ -102,9 +135,17 @@ def up(**kwargs):
             error_loc = f"at {loc.line+1}:{loc.column+1}"
         CLI.error(f'Syntax error in the file "{config_file}" ' + error_loc)
         sys.exit(1)
-    except EnosUnknownProvider as err:
+    except (EnosUnknownProvider, EnosUnknownStep) as err:
         CLI.error(str(err))
         sys.exit(1)
+    except MissingEnvState as err:
+        if err.key == 'up-steps':
+            CLI.error("""\
+            No former setup could be found in your enos environment.  Run
+            `enos up` without `--resume` or `--only` first.""")
+        else:
+            CLI.critical(err)
+        sys.exit(1)
     except Exception as e:
         CLI.critical(str(e))
         sys.exit(1)
@@ -113,7 +154,8 @@ def up(**kwargs):
 def os(**kwargs):
     """\
     USAGE:
-      enos os [--reconfigure] [-t TAGS] [--pull] [-e ENV]
+      enos os [--reconfigure] [-t TAGS | --changed-only | --parallel N]
+              [--pull] [-e ENV]
       enos os [-e ENV] -- <kolla-cmd> ...
 
       Install OpenStack with kolla-ansible.
@@ -126,6 +168,12 @@ def os(**kwargs):
       --reconfigure    Only reconfigure the services (after a first deployment).
       --pull           Only preinstall software (e.g pull docker images).
       -t, --tags TAGS  Only run ansible tasks tagged with these values.
+      --changed-only   Only run kolla-ansible on the services (and their hosts)
+                       affected by changes of the globals, the inventory or the
+                       config overrides since the last `enos os`.
+      --parallel N     Deploy independent services with up to N concurrent
+                       kolla-ansible, once the infrastructure services
+                       (e.g., mariadb, rabbitmq, keystone) are up.
       -e, --env ENV    Path to the environment directory (Advanced option). Enos
                        creates a directory to track the state of the experiment.
                        Use this option to link enos with a different environment
@@ -135,6 +183,12 @@ def os(**kwargs):
     logging.debug('phase[os]: args=%s' % kwargs)
     from enos import tasks
 
+    concurrency = kwargs.get('--parallel')
+    if concurrency is not None and (not concurrency.isdigit()
+                                    or int(concurrency) < 1):
+        CLI.error(f'--parallel expects a positive number, got "{concurrency}"')
+        sys.exit(1)
+
     try:
         with _elib_open(kwargs.get('--env')) as env:
             if kwargs.get('--'):
@@ -146,8 +200,11 @@ def os(**kwargs):
                 is_reconfigure = kwargs.get('--reconfigure', False)
                 is_pull_only = kwargs.get('--pull', False)
                 tags = kwargs.get('--tags', None)
+                changed_only = kwargs.get('--changed-only', False)
 
-                tasks.install_os(env, is_reconfigure, is_pull_only, tags)
+                tasks.install_os(env, is_reconfigure, is_pull_only, tags,
+                                 changed_only,
+                                 int(concurrency) if concurrency else None)
 
                 CLI.print("""\
                 The installation of OpenStack completed successfully.  You may
@@ -221,15 +278,20 @@ def init(**kwargs):
 def deploy(**kwargs):
     """\
     USAGE:
-      enos deploy [-f CONFIG_FILE] [--force-deploy] [--pull] [-e ENV]
+      enos deploy [-f CONFIG_FILE] [--force-deploy] [--pull] [--plan] [-e ENV]
 
       Alias for enos up, then enos os, and finally enos init.
 
+      A phase that already completed in the environment with the same inputs
+      is skipped, e.g., changing the `kolla` key of the configuration file
+      only runs `enos os` and `enos init` again.
+
     OPTIONS:
       -f CONFIG_FILE  Path to the configuration file describing the
                       deployment [default: ./reservation.yaml].
-      --force-deploy  Force deployment.
+      --force-deploy  Force deployment (run all phases).
       --pull          Only preinstall software (e.g pull docker images).
+      --plan          Only show which phases would run.
       -e, --env ENV   Path to the environment directory (Advanced option). Enos
                       creates a directory to track the state of the
                       experiment. Use this option to link enos with a different
@@ -237,6 +299,7 @@ def deploy(**kwargs):
     """
 
     logging.debug('phase[deploy]: args=%s' % kwargs)
+    from enos import tasks
 
     # --tags cannot be provided in 'deploy' but is mandatory for
     # 'up'. Similarly, --reconfigure cannot be provided in 'deploy' but is
@@ -244,15 +307,94 @@ def deploy(**kwargs):
     kwargs['--tags'] = None
     kwargs['--reconfigure'] = False
 
-    up(**kwargs)
+    # Find phases that have to run
+    todo = _deploy_plan(kwargs)
+    if kwargs.get('--plan'):
+        for phase, is_todo in todo.items():
+            CLI.print(f"enos {phase}: "
+                      + ("run" if is_todo else "skip (already done)"))
+        return
+
+    if todo['up']:
+        up(**kwargs)
+    else:
+        CLI.print("Skip `enos up`, the testbed is already set up.")
 
     # If the user doesn't specify an experiment, then set the ENV directory to
     # the default one.
     if not kwargs['--env']:
         kwargs['--env'] = C.SYMLINK_NAME
 
-    os(**kwargs)
-    init(**kwargs)
+    if todo['os']:
+        if not todo['up']:
+            # Only the kolla globals changed since `enos up`
+            try:
+                with _elib_open(kwargs['--env']) as env:
+                    config = _load_config(pathlib.Path(kwargs['-f']))
+                    tasks.update_globals(env, config)
+            except Exception as e:
+                CLI.critical(str(e))
+                sys.exit(1)
+        os(**kwargs)
+    else:
+        CLI.print("Skip `enos os`, OpenStack is already installed.")
+
+    if todo['init']:
+        init(**kwargs)
+    else:
+        CLI.print("Skip `enos init`, OpenStack is already initialized.")
+
+
+def scale(**kwargs):
+    """\
+    USAGE:
+      enos scale [--role ROLE] --add N [-e ENV]
+
+      Add N nodes to the deployment without redeploying it.
+
+      Enos asks the provider for N more nodes of ROLE, sets up the new nodes
+      only (network information, Docker, kolla-ansible bootstrap-servers),
+      and deploys the OpenStack services of ROLE on them with
+      `kolla-ansible deploy --limit`.  This requires a provider that can
+      extend its reservation (e.g., vagrant) and the `resources` key in the
+      configuration.
+
+    OPTIONS:
+      --role ROLE    Role of the new nodes [default: compute].
+      --add N        Number of nodes to add.
+      -e, --env ENV  Path to the environment directory (Advanced option). Enos
+                     creates a directory to track the state of the
+                     experiment. Use this option to link enos with a different
+                     environment [default: ./current].
+    """
+
+    logging.debug('phase[scale]: args=%s' % kwargs)
+    from enos import tasks
+
+    count = kwargs.get('--add', '')
+    if not count.isdigit() or int(count) < 1:
+        CLI.error(f'--add expects a positive number, got "{count}"')
+        sys.exit(1)
+
+    try:
+        with _elib_open(kwargs.get('--env')) as env:
+            tasks.scale(env, kwargs['--role'], int(count))
+
+            CLI.print(f"""\
+            {count} {kwargs['--role']} nodes have been added to the
+            deployment.""")
+
+    except EnosCannotScale as err:
+        CLI.error(str(err))
+        sys.exit(1)
+    except MissingEnvState as err:
+        CLI.error(f"""\
+        {err.key} could not be found in your enos environment.  Did you
+        successfully run `enos deploy` first?""")
+        sys.exit(1)
+    except Exception as e:
+        CLI.critical(str(e))
+        sys.exit(1)
 
 
 def bench(**kwargs):
@@ -324,12 +466,15 @@ def bench(**kwargs):
 def backup(**kwargs):
     """\
     USAGE:
-      enos backup [--backup_dir=BACKUP_DIR] [-e ENV]
+      enos backup [--backup_dir=BACKUP_DIR] [--export-registry] [-e ENV]
 
       Backup the environment.
 
     OPTIONS:
       --backup_dir=BACKUP_DIR  Backup directory.
+      --export-registry        Also export the kolla images of the internal
+                               registry into a bundle for `enos up
+                               --seed-registry`.
       -e, --env ENV            Path to the environment directory (Advanced
                                option). Enos creates a directory to track the
                                state of the experiment. Use this option to
@@ -348,7 +493,8 @@ def backup(**kwargs):
             CLI.debug(f"Store backups at directory {backup_dir}")
 
             # Launch the *bench* task
-            tasks.backup(env, backup_dir)
+            tasks.backup(env, backup_dir,
+                         kwargs.get('--export-registry', False))
 
             CLI.print(f"""\
             The backup of the environment completed successfully.  Files has
@@ -606,6 +752,103 @@ def build(**kwargs):
     tasks.build(provider, arguments)
 
 
+def serve(**kwargs):
+    """\
+    USAGE:
+      enos serve
+
+      Run a daemon that keeps enoslib and Ansible loaded between commands.
+
+      The daemon listens on a Unix socket (see the ENOS_SOCKET environment
+      variable).  As long as it runs, other enos commands are executed by the
+      daemon and thus skip the import of enoslib/Ansible as well as the loading
+      of their environment.  Stop the daemon with Ctrl-C.  Set ENOS_SOCKET to
+      an empty value to execute a command without the daemon.
+    """
+
+    logging.debug('phase[serve]: args=%s' % kwargs)
+
+    # Load everything once and for all
+    import enoslib  # noqa: F401
+    from enos import tasks  # noqa: F401
+
+    CLI.print(f"""\
+    The enos daemon listens on {C.DAEMON_SOCKET}.  Other enos commands now
+    run through it.  Press Ctrl-C to stop it.""")
+
+    try:
+        daemon.serve(C.DAEMON_SOCKET, run=_serve_run, preload=_serve_preload)
+
+    # Nicely handle errors for the user
+    except FileExistsError:
+        CLI.error(f"""\
+        An enos daemon already listens on {C.DAEMON_SOCKET}.""")
+        sys.exit(1)
+    except KeyboardInterrupt:
+        CLI.print("The enos daemon stopped.")
+
+
+def cache(**kwargs):
+    """\
+    USAGE:
+      enos cache [--purge]
+
+      Show or purge the cache of testbed API lookups (e.g., Grid'5000 cluster
+      descriptions).  See the ENOS_API_CACHE_TTL environment variable and the
+      `api_cache_ttl` key of the provider to change the time to live of
+      cached entries.  Entries are listed with their age, since whether
+      they expired depends on the provider that looks them up.
+
+    OPTIONS:
+      --purge  Remove all the entries of the cache.
+    """
+
+    logging.debug('phase[cache]: args=%s' % kwargs)
+    from enos.utils import cache as api_cache
+
+    if kwargs.get('--purge', False):
+        api_cache.purge()
+        CLI.print(f"The cache {api_cache.cache_dir()} has been purged.")
+        return
+
+    _print_cache_entries(api_cache.entries(),
+                         f"The cache {api_cache.cache_dir()} is empty.")
+
+
+def facts(**kwargs):
+    """\
+    USAGE:
+      enos facts [--refresh] [-e ENV]
+
+      Show or refresh the Ansible facts of hosts cached in the environment.
+      Plays only gather facts of hosts that are not in the cache.  See the
+      ENOS_FACTS_CACHE_TTL environment variable to change the time to live
+      of cached facts (zero disables the cache).
+
+    OPTIONS:
+      --refresh      Forget cached facts, so that the next plays gather them
+                     again (e.g., after a change of the network of hosts).
+      -e, --env ENV  Path to the environment directory (Advanced option). Enos
+                     creates a directory to track the state of the
+                     experiment. Use this option to link enos with a different
+                     environment [default: ./current].
+    """
+
+    logging.debug('phase[facts]: args=%s' % kwargs)
+    from enos.utils import facts as fact_cache
+
+    with _elib_open(kwargs.get('--env')) as env:
+        env_dir = pathlib.Path(env.env_name)
+        if kwargs.get('--refresh', False):
+            fact_cache.refresh(env_dir)
+            CLI.print("The cached facts of hosts have been forgotten.")
+            return
+
+        _print_cache_entries(fact_cache.entries(env_dir),
+                             "No facts of hosts in the cache.",
+                             ttl=C.FACTS_CACHE_TTL)
+
+
 def enos_help(**kwargs):
     """\
     USAGE:
@@ -630,12 +873,16 @@ _COMMANDS = {
     "os": os,
     "init": init,
     "deploy": deploy,
+    "scale": scale,
     "bench": bench,
     "backup": backup,
     "tc": tc,
     "info": info,
     "destroy": destroy,
     "build": build,
+    "cache": cache,
+    "facts": facts,
+    "serve": serve,
     "help": enos_help,
 }
 
@@ -643,20 +890,37 @@ _COMMANDS = {
 # utils
 
 @contextmanager
-def _elib_open(path: Optional[pathlib.Path], new: bool = False):
-    "Open and dump enoslib env"
-    from enoslib.task import get_or_create_env
+def _elib_open(path: Optional[pathlib.Path], new: bool = False,
+               carry: List[str] = []):
+    "Open and dump enoslib env (see `enos.utils.store.open_env`)"
+    from enos.utils.store import open_env
     from enoslib.errors import EnosFilePathError
 
     try:
-        # Get the environment from the file system
-        env = get_or_create_env(new, path)
+        # Get the environment from the file system (or the memory of the enos
+        # daemon)
+        if new:
+            env = open_env(new, path, carry)
+        else:
+            env = daemon.load_env(Path(path or C.SYMLINK_NAME))
+
+        # Cache Ansible facts of hosts in the environment (forget them on
+        # a new environment, hosts may have changed)
+        from enos.utils import facts as fact_cache
+        if new:
+            fact_cache.refresh(Path(env.env_name))
+        fact_cache.enable_fact_cache(Path(env.env_name))
+
+        # Use the Ansible configuration tuned for this deployment
+        from enos.utils import ansible_config
+        ansible_config.apply(Path(env.env_name))
 
         # Let the user update it
         try:
             yield env
 
-        # Save its changes on the file system
+        # Save its changes on the file system.  Only changed keys are
+        # written, so this is cheap for read-only commands.
         finally:
             env.dump()
 
@@ -669,6 +933,76 @@ def _elib_open(path: Optional[pathlib.Path], new: bool = False):
         sys.exit(1)
 
 
+def _print_cache_entries(entries: List[Any], empty: str,
+                         ttl: Optional[int] = None):
+    '''Print one line per cache entry (`NamedTuple` whose last field is its
+    age), or `empty` if there is none
+
+    With the `ttl` that applies to entries, lines tell whether the entry
+    expired.
+    '''
+    if not entries:
+        CLI.print(empty)
+        return
+
+    for *fields, age in entries:
+        line = fields + [f"{int(age)}s"]
+        if ttl is not None:
+            line.append('expired' if age >= ttl else 'valid')
+        print('\t'.join(line))
+
+
+def _serve_preload(request: Dict[str, Any]):
+    "Load the environment of an `enos <command>` in the enos daemon"
+    try:
+        global_args = docopt(__doc__ or "", argv=request['argv'],
+                             options_first=True)
+        cmd = global_args['<command>']
+        if cmd in ['new', 'up', 'deploy', 'build', 'cache', 'serve', 'help']:
+            # These commands do not read an existing environment
+            return
+
+        cmd_args = docopt(
+            doc=textwrap.dedent(_get_cmd_func(cmd).__doc__ or ""),
+            argv=[cmd] + global_args['<args>'])
+
+    # Wrong arguments, the child will report it to the user
+    except SystemExit:
+        return
+
+    daemon.load_env(Path(request['cwd']) / (cmd_args.get('--env') or 'current'))
+
+
+def _serve_run(argv: List[str]):
+    "Execute `enos <argv>` in a child of the enos daemon"
+    # The child starts with the logging configuration and working directory
+    # of the daemon.  Reset them for the client.
+    logging.root.handlers.clear()
+    logging.root.setLevel(logging.WARNING)
+    CLI.setLevel(logging.getLevelName('CLI'))
+    C.SYMLINK_NAME = str(Path.cwd() / 'current')
+
+    _run(argv)
+
+
+def _deploy_plan(kwargs: Dict[str, Any]) -> Dict[str, bool]:
+    "Phases of `enos deploy` that have to run (all of them in case of doubt)"
+    from enos import tasks
+    from enoslib.errors import EnosFilePathError as EnvPathError
+
+    all_phases = {'up': True, 'os': True, 'init': True}
+    if kwargs.get('--force-deploy'):
+        return all_phases
+
+    try:
+        config = _load_config(pathlib.Path(kwargs['-f']))
+        env = daemon.load_env(Path(kwargs.get('--env') or C.SYMLINK_NAME))
+        return tasks.plan(env, config, kwargs.get('--pull', False))
+    except (EnosFilePathError, EnvPathError, yaml.YAMLError) as err:
+        logging.debug(f'Cannot plan the deployment: {err}')
+        return all_phases
+
+
 def _get_cmd_func(name: str) -> Callable[..., Any]:
     """Returns the function of an enos <command> or panic gracefully
 
@@ -729,11 +1063,28 @@ def _set_logging_level(is_quiet: bool, verbose_level: int):
 
 
 def main():
+    argv = sys.argv[1:]
+
+    # Delegate the command to the enos daemon if it runs.  This skips the
+    # costly imports of enoslib and Ansible.
+    if daemon.is_running(C.DAEMON_SOCKET):
+        enos_global_args = docopt(__doc__ or "", argv=argv,
+                                  version=C.VERSION,
+                                  options_first=True,)
+        if enos_global_args['<command>'] != 'serve':
+            sys.exit(daemon.call(C.DAEMON_SOCKET, argv))
+
+    _run(argv)
+
+
+def _run(argv: List[str]):
+    "Execute `enos <argv>`"
     # Parse command arguments: `enos -vv help new`
     # cli_args =
     #  {'--help': False, '--quiet': False, '--verbose': 2, '--version': False,
     #   '<command>': 'help','<args>': ['new'], }
     enos_global_args = docopt(__doc__ or "",
+                              argv=argv,
                               version=C.VERSION,
                               options_first=True,)
     # Set global enoslib options
@@ -2,6 +2,7 @@ import copy
 import logging
 
 from enos.provider.provider import Provider
+from enos.utils.errors import EnosCannotScale
 from enos.utils.extra import expand_groups, gen_enoslib_roles
 
 import enoslib.infra.enos_vagrant.provider as enoslib_vagrant
@@ -66,6 +67,24 @@ class Enos_vagrant(Provider):
         vagrant = enoslib_vagrant.Enos_vagrant(enoslib_conf)
         vagrant.destroy()
 
+    def scale_config(self, config, resources, role, count):
+        # Enoslib names the machines of a group after the index of the group
+        # and its number of machines (`enos-<i>` or `enos-<i>-<n>`), and
+        # gives them IPs in order.  New machines thus go in a new group at
+        # the end, so that former ones keep their names and IPs.  The
+        # machines are recorded in the provider configuration.
+        enoslib_conf = _build_enoslib_conf(config)
+        machines = enoslib_conf['resources']['machines']
+        groups = [m for m in machines if role in m['roles']]
+        if not groups:
+            raise EnosCannotScale(f"no machines with the role '{role}'")
+
+        machine = {k: v for k, v in groups[-1].items()
+                   if k not in ['number', 'name_prefix']}
+        machines.append(dict(machine, number=count))
+        return dict(config, resources=resources, provider=dict(
+            config['provider'], resources=enoslib_conf['resources']))
+
     def default_config(self):
         return DEFAULT_CONFIG
 
@@ -7,6 +7,7 @@ from enoslib.infra.enos_g5k import (provider, g5k_api_utils)
 from enoslib.infra.enos_g5k.configuration import Configuration
 
 from enos.provider.provider import Provider
+from enos.utils.cache import cached_lookup
 from enos.utils.extra import expand_groups, gen_enoslib_roles
 from enos.utils.constants import (NETWORK_INTERFACE,
                                   NEUTRON_EXTERNAL_INTERFACE)
@@ -41,13 +42,16 @@ SECONDARY_NETWORK = {
     "roles": [NEUTRON_EXTERNAL_INTERFACE]}
 
 
-def _count_common_interfaces(clusters):
-    interfaces = g5k_api_utils.get_clusters_interfaces(clusters)
+def _count_common_interfaces(clusters, ttl=None):
+    interfaces = cached_lookup(
+        'g5k-interfaces', clusters,
+        g5k_api_utils.get_clusters_interfaces, ttl)
     return min([len(x) for x in interfaces.values()])
 
 
-def _get_sites(clusters):
-    clusters_sites = g5k_api_utils.get_clusters_sites(clusters)
+def _get_sites(clusters, ttl=None):
+    clusters_sites = cached_lookup(
+        'g5k-sites', clusters, g5k_api_utils.get_clusters_sites, ttl)
     return set(clusters_sites.values())
 
 
@@ -55,6 +59,8 @@ def _build_enoslib_conf(config):
     conf = copy.deepcopy(config)
     enoslib_conf = conf.get("provider", {})
     enoslib_conf.pop("type", None)
+    # TTL of the cache of reference API lookups (enos specific)
+    api_cache_ttl = enoslib_conf.pop("api_cache_ttl", None)
     # NOTE(msimonin): Force some enoslib/g5k parameters here.
     # * dhcp: True means that network card will be brought up and the dhcp
     #   client will be called. As for now (2018-08-16) this is disabled by
@@ -94,7 +100,7 @@ def _build_enoslib_conf(config):
             machines.append(machine)
 
     # check the location of the clusters
-    sites = _get_sites(clusters)
+    sites = _get_sites(clusters, api_cache_ttl)
     if len(sites) > 1:
         raise Exception("Multisite deployment isn't supported yet")
 
@@ -104,7 +110,7 @@ def _build_enoslib_conf(config):
     networks = [PRIMARY_NETWORK]
 
     # check minimum available number of interfaces in each cluster
-    network_count = _count_common_interfaces(clusters)
+    network_count = _count_common_interfaces(clusters, api_cache_ttl)
     if network_count > 1:
         networks.append(SECONDARY_NETWORK)
 
@@ -119,35 +125,39 @@ def _build_enoslib_conf(config):
     return enoslib_conf
 
 
-def _provision(roles):
-    # Provision nodes so we can run Ansible on it
-    run_command(
-        'apt-get update && apt-get -y --force-yes install python',
-        task_name='Installing python...',
-        roles=roles)
+# Marker of a node provisioned by enos.  /run is emptied on reboot, just as
+# bind mounts are lost, so the marker lives as long as the provisioning.
+PROVISION_MARKER = '/run/enos-provisioned'
 
-    # Bind volumes of docker in /tmp (free storage location on G5k)
-    run_command(
-        ('mkdir -p /tmp/docker/volumes; '
-         'mkdir -p /var/lib/docker/volumes'),
-        task_name='Creating docker volumes directory in /tmp',
-        roles=roles)
-    run_command(
-        ('(mount | grep /tmp/docker/volumes) || '
-         'mount --bind /tmp/docker/volumes /var/lib/docker/volumes'),
-        task_name='Bind mount',
-        roles=roles)
+# Provisioning of a node, as a single shell script so that it only costs one
+# round-trip (with the raw module, as python may not be there yet).
+PROVISION_SCRIPT = f"""\
+set -e
+if [ -e {PROVISION_MARKER} ]; then echo 'Already provisioned'; exit 0; fi
 
-    # Bind nova local storage in /tmp
-    run_command(
-        'mkdir -p /tmp/nova ; mkdir -p /var/lib/nova',
-        task_name='Creating nova directory in /tmp',
-        roles=roles)
+# Python is required to run Ansible modules
+if ! command -v python3 > /dev/null; then
+  apt-get update && apt-get -y install python3
+fi
+
+# Bind volumes of docker and nova local storage in /tmp (free storage
+# location on G5k)
+mkdir -p /tmp/docker/volumes /var/lib/docker/volumes /tmp/nova /var/lib/nova
+mountpoint -q /var/lib/docker/volumes \\
+  || mount --bind /tmp/docker/volumes /var/lib/docker/volumes
+mountpoint -q /var/lib/nova || mount --bind /tmp/nova /var/lib/nova
+
+touch {PROVISION_MARKER}
+"""
+
+
+def _provision(roles):
+    "Provision nodes so we can run Ansible on it"
     run_command(
-        ('(mount | grep /tmp/nova) || '
-         'mount --bind /tmp/nova /var/lib/nova'),
-        task_name='Bind mount',
-        roles=roles)
+        PROVISION_SCRIPT,
+        task_name='Provisioning nodes (python, /tmp bind mounts)...',
+        roles=roles,
+        raw=True)
 
 
 class G5k(Provider):
@@ -36,6 +36,26 @@ class Provider:
         "Destroy the resources used for the deployment."
         pass
 
+    def scale_config(self,
+                     config: Dict[str, Any],
+                     resources: Dict[str, Any],
+                     role: str,
+                     count: int) -> Dict[str, Any]:
+        """The configuration with `count` more hosts of `role`.
+
+        `resources` are the resources of `config` with these hosts.
+        Former hosts must keep their names and addresses with the new
+        configuration: providers that cannot ensure it raise
+        `EnosCannotScale` (before creating anything).  By default, the
+        configuration gets `resources`.
+
+        """
+        from enos.utils.errors import EnosCannotScale
+
+        if config['provider'].get('resources'):
+            raise EnosCannotScale('only the `resources` key can be scaled')
+        return dict(config, resources=resources)
+
     @abstractmethod
     def default_config(self) -> Dict[str, Any]:
         """The default provider configuration.
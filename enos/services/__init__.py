@@ -1,6 +1,9 @@
 from enos.services.kolla import KollaAnsible
+from enos.services.mirror import PackageMirror
 from enos.services.rally import RallyOpenStack
+from enos.services.registry import RegistryMirrors
 from enos.services.shaker import Shaker
 
 
-__all__ = ['KollaAnsible', 'RallyOpenStack', 'Shaker']
+__all__ = ['KollaAnsible', 'PackageMirror', 'RallyOpenStack',
+           'RegistryMirrors', 'Shaker']
@@ -1,19 +1,33 @@
 # -*- coding: utf-8 -*-
 "Installs kolla-ansible locally in a dedicated virtual environment"
+import copy
+import fcntl
 import hashlib
 import json
 import logging
 import os
+import shlex
 import subprocess
 import sys
 import tempfile
+import threading
+import time
+from concurrent.futures import Future
+from contextlib import contextmanager
 from pathlib import Path
 from typing import Any, Dict, List, Optional
 
 import enoslib as elib
+import jinja2
+import jinja2.meta
 import yaml
+from ansible.errors import AnsibleError
+from ansible.parsing.dataloader import DataLoader
 from ansible.plugins.loader import filter_loader as ansible_filter_loader
+from ansible.template import Templar
 from enos.utils import constants as C
+from enos.utils import playlog
+from enos.utils.fingerprint import fingerprint
 
 # Default kolla-ansible package to install (OpenStack Wallaby)
 KOLLA_PKG = 'kolla-ansible~=12.0'
@@ -27,6 +41,28 @@ ANSIBLE_PKG = 'ansible>=2.9,<2.10'
 # specific version because the Docker API changes between major versions.
 DOCKER_VERSION = '20.10'
 
+# Default profile of the Docker daemon (see `docker_daemon` in the
+# configuration file).  Debug logs cost CPU and disk on every node for the
+# whole experiment, and parallel downloads speed up the pull of kolla
+# images.  `data-root` is applied as a bind mount of /var/lib/docker.
+DOCKER_DAEMON = {
+    'debug': False,
+    'max-concurrent-downloads': 10,
+    'max-concurrent-uploads': 10,
+    'log-driver': 'json-file',
+    'log-opts': {'max-size': '50m', 'max-file': '3'},
+    'live-restore': True,
+}
+
+# Directory (in the config dir) of the logs and timings of kolla-ansible runs
+LOG_DIR = 'kolla-logs'
+
+# File (in the config dir) that memoizes the value of `openstack_auth`
+OPENSTACK_AUTH_MEMO = 'openstack_auth.json'
+
+# File that marks a complete virtual environment in the shared cache
+VENV_COMPLETE_MARKER = '.enos-complete'
+
 # Current python version
 PY_VERSION = f'python{sys.version_info.major}.{sys.version_info.minor}'
 
@@ -100,7 +136,7 @@ class KollaAnsible(object):
         the `pip_package`.  If a virtual environment already exists with the
         same name it is not recreated/installed.  The `globals.yml` is created
         during the deployment.  Authentication variables are resolved with
-        an extra call to a local Ansible.  They are available under
+        the Ansible templating engine.  They are available under
         `self.globals_values.get('openstack_auth')`.
 
         Args:
@@ -152,8 +188,19 @@ class KollaAnsible(object):
         self.kolla_args = self._mk_kolla_args(
             config_dir, PASSWORDS_PATH)
 
-    def execute(self, operation: List[str]) -> None:
-        'Executes an operation on kolla-ansible'
+    def execute(self, operation: List[str],
+                log_dir: Optional[Path] = None,
+                log_name: Optional[str] = None,
+                progress: bool = True) -> None:
+        """Executes an operation on kolla-ansible
+
+        With a `log_dir`, the output goes to a log file in it instead of the
+        terminal, and the duration of each task on each host to a timings
+        file next to it (see `_execute_and_log`).  Files are named after
+        `log_name`, or the operation.  Concurrent executions should disable
+        the `progress` line, each one would overwrite the line of others.
+
+        """
         # Call kolla-ansible executable ...
         cmd = [f'{self.venv_path}/bin/kolla-ansible']
         # ... with proper arguments ...
@@ -161,7 +208,11 @@ class KollaAnsible(object):
         # ... and the specific `operation`
         cmd += operation
 
-        self._execute_in_venv(cmd)
+        if log_dir is None:
+            self._execute_in_venv(cmd)
+        else:
+            self._execute_and_log(cmd, Path(log_dir),
+                                  log_name or operation[0], progress)
 
     def _execute_in_venv(self, cmd: List[str]):
         'Executes a command into the virtual environment of this kolla-ansible'
@@ -169,6 +220,55 @@ class KollaAnsible(object):
         logging.debug(f'Executing {venv_cmd} ...')
         subprocess.run(' '.join(venv_cmd), shell=True, check=True)
 
+    def _execute_and_log(self, cmd: List[str], log_dir: Path, name: str,
+                         progress: bool = True):
+        """Executes a command into the virtual environment with its output
+        in `log_dir`
+
+        The output goes to `<log_dir>/<date>-<name>.log`, and the timing of
+        tasks to `<log_dir>/<date>-<name>.json` (see `enos.utils.playlog`).
+        The terminal gets a live progress line (unless `progress` is false),
+        the output that precedes the first play
+        (e.g., `--help`), and the output of failed tasks.  The whole output
+        is echoed in debug mode.
+
+        """
+        venv_cmd = [f'. {self.venv_path}/bin/activate &&'] + cmd
+        logging.debug(f'Executing {venv_cmd} ...')
+        log_dir.mkdir(parents=True, exist_ok=True)
+        stem = time.strftime('%Y%m%d-%H%M%S') + f'-{name}'
+        log_path = log_dir / f'{stem}.log'
+        echo = logging.root.level <= logging.DEBUG
+        progress = progress and not echo
+        plays = playlog.PlayLog(playlog.Progress() if progress else None)
+
+        logging.info(f'Logging kolla-ansible output in {log_path}')
+        with open(log_path, 'w') as log:
+            proc = subprocess.Popen(
+                ' '.join(venv_cmd), shell=True, text=True, bufsize=1,
+                stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                # Unbuffered ansible output for live timings
+                env=dict(os.environ, PYTHONUNBUFFERED='1'))
+            try:
+                for line in proc.stdout:
+                    log.write(line)
+                    plays.feed(line)
+                    if echo or not plays.started:
+                        sys.stdout.write(line)
+            finally:
+                returncode = proc.wait()
+                plays.close()
+                playlog.write_timings(log_dir / f'{stem}.json',
+                                      plays.timings)
+
+        for role, duration in playlog.role_durations(plays.timings)[:5]:
+            logging.info(f'{role}: {duration:.0f}s')
+        for failure in plays.failures:
+            logging.error(failure)
+        if returncode != 0:
+            logging.error(f'kolla-ansible failed (see {log_path})')
+            raise subprocess.CalledProcessError(returncode, venv_cmd)
+
     def _mk_kolla_args(self, config_dir: Path,
                        password_path: Path) -> List[str]:
         'Computes the list of arguments to run kolla-ansible'
@@ -183,9 +283,9 @@ class KollaAnsible(object):
         """Generates and writes the globals in the `config_dir`.
 
         This generates all globals values.  It includes kolla-ansible default
-        ones overrided by Enos ones (e.g., `kolla_internal_vip_address`).  A
-        local Ansible call also resolves the `openstack_auth` variable that
-        contains OpenStack connection information.
+        ones overrided by Enos ones (e.g., `kolla_internal_vip_address`).  It
+        also resolves the `openstack_auth` variable that contains OpenStack
+        connection information.
 
         """
         all_values = {}
@@ -208,7 +308,8 @@ class KollaAnsible(object):
 
         # Compute `openstack_auth` values.
         all_values.update(
-            openstack_auth=self._resolve_openstack_auth(all_values))
+            openstack_auth=self._resolve_openstack_auth(
+                config_dir, all_values))
 
         # Put the final result into the `globals.yml`
         with open(config_dir / 'globals.yml', 'w') as f:
@@ -217,17 +318,55 @@ class KollaAnsible(object):
         return all_values
 
     def _resolve_openstack_auth(
-            self, globals_values: Dict[str, Any]) -> Dict[str, Any]:
-        "Compute and returns the value of `globals_values['openstack_auth']`"
+            self, config_dir: Path,
+            globals_values: Dict[str, Any]) -> Dict[str, Any]:
+        """Compute and returns the value of `globals_values['openstack_auth']`
 
+        The value is rendered in-process with the Ansible templating engine
+        and memoized by the digest of the globals, in memory and in
+        `config_dir/OPENSTACK_AUTH_MEMO`.  Rendering falls back on a local
+        Ansible play if the in-process one fails.
+
+        """
+        digest = fingerprint(str(self.venv_path), globals_values)
+        memo_path = Path(config_dir) / OPENSTACK_AUTH_MEMO
+
+        # Get a memoized value
+        if digest not in _OPENSTACK_AUTHS:
+            try:
+                with open(memo_path) as memo_file:
+                    memo = json.load(memo_file)
+                if memo.get('digest') == digest:
+                    _OPENSTACK_AUTHS[digest] = memo['value']
+            except (OSError, ValueError):
+                pass
+
+        if digest in _OPENSTACK_AUTHS:
+            logging.debug('Reuse the memoized value of `openstack_auth`')
+            return copy.deepcopy(_OPENSTACK_AUTHS[digest])
+
+        # Render it
+        with self._kolla_filters():
+            try:
+                openstack_auth = self._render_openstack_auth(globals_values)
+            except AnsibleError as err:
+                logging.debug('In-process rendering of `openstack_auth` '
+                              f'failed ({err}), fall back on Ansible')
+                openstack_auth = self._play_openstack_auth(globals_values)
+
+        _OPENSTACK_AUTHS[digest] = openstack_auth
+        with open(memo_path, 'w') as memo_file:
+            json.dump({'digest': digest, 'value': openstack_auth}, memo_file)
+
+        return copy.deepcopy(openstack_auth)
+
+    @contextmanager
+    def _kolla_filters(self):
+        "Make kolla-ansible specific filters `KOLLA_FILTERS` available"
         # Get the former system paths.  We latter load kolla (required by the
         # `put_address_in_context` filter) and change that path.
         old_sys_paths = sys.path.copy()
 
-        # Temporary file to later store the result of the rendered
-        # `openstack_auth` variable by Ansible.
-        _, osauth_path = tempfile.mkstemp()
-
         try:
             # Load kolla-ansible specific filters `KOLLA_FILTERS` since the
             # `{{openstack_auth}}` variable relies on the
@@ -247,6 +386,29 @@ class KollaAnsible(object):
                 str(self.venv_path / 'lib' / PY_VERSION / 'site-packages'))
             os.environ['PBR_VERSION'] = '1.2.3'
 
+            yield
+
+        finally:
+            # Reset system paths
+            sys.path = old_sys_paths
+
+    def _render_openstack_auth(
+            self, globals_values: Dict[str, Any]) -> Dict[str, Any]:
+        "Render `openstack_auth` with the Ansible templating engine"
+        templar = Templar(loader=DataLoader(), variables=globals_values)
+        openstack_auth = templar.template(globals_values['openstack_auth'])
+
+        # Same value as the one that Ansible outputs (i.e., in JSON)
+        return json.loads(json.dumps(openstack_auth))
+
+    def _play_openstack_auth(
+            self, globals_values: Dict[str, Any]) -> Dict[str, Any]:
+        "Render `openstack_auth` with a local Ansible play"
+        # Temporary file to later store the result of the rendered
+        # `openstack_auth` variable by Ansible.
+        _, osauth_path = tempfile.mkstemp()
+
+        try:
             # Render `openstack_auth` into `osauth_path`
             with elib.play_on(roles={}, pattern_hosts="localhost",
                               extra_vars=globals_values) as yaml:
@@ -263,8 +425,66 @@ class KollaAnsible(object):
         finally:
             # Delete temporary `osauth_path` file
             os.unlink(osauth_path)
-            # Reset system paths
-            sys.path = old_sys_paths
+
+    @contextmanager
+    def play_on(self, **kwargs):
+        '''`elib.play_on` with the globals as variables.
+
+        Instead of the whole globals (all of kolla-ansible defaults and
+        passwords) that Ansible would merge and template for every host,
+        the play only gets the globals that its tasks (and the `extra_vars`
+        of the caller) reference.  The `extra_vars` of the caller win over
+        globals.
+
+        '''
+        caller_vars = kwargs.get('extra_vars') or {}
+        with elib.play_on(**kwargs) as yml:
+            yield yml
+
+            # Tasks are only known once the body of the play ran.  Enoslib
+            # offers no public getter for them: read its private list, and
+            # fall back on all the globals if it is gone (`vars` since
+            # getting an unknown attribute of `yml` makes a task).
+            tasks = vars(yml).get('_tasks')
+            if isinstance(tasks, list):
+                extra_vars = self.referenced_globals([tasks, caller_vars])
+            else:
+                extra_vars = dict(self.globals_values)
+            extra_vars.update(caller_vars)
+            yml.kwargs.update(extra_vars=extra_vars)
+
+    def referenced_globals(self, templates: Any) -> Dict[str, Any]:
+        '''Returns the globals referenced by `templates`.
+
+        Args:
+            templates: Strings, or lists and dicts of them (e.g., Ansible
+              tasks), that may reference globals.  Values of Ansible
+              conditionals (e.g., `when`) are expressions.
+
+        The result includes globals referenced by the value of referenced
+        globals, as well as Ansible connection variables (`ansible_*`).  It
+        is all the globals if a template cannot be parsed.
+
+        '''
+        jinja = jinja2.Environment()
+        names = {name for name in self.globals_values
+                 if name.startswith('ansible_')}
+        todo = list(_template_strings(templates))
+        while todo:
+            template = todo.pop()
+            if '{' not in template:
+                continue
+            try:
+                ast = jinja.parse(template)
+            except jinja2.TemplateSyntaxError:
+                return dict(self.globals_values)
+
+            for name in jinja2.meta.find_undeclared_variables(ast) - names:
+                if name in self.globals_values:
+                    names.add(name)
+                    todo.extend(_template_strings(self.globals_values[name]))
+
+        return {name: self.globals_values[name] for name in names}
 
     def get_admin_openrc_env_values(self) -> Dict[str, str]:
         '''Returns environment variables to authenticate on OpenStack.
@@ -289,8 +509,7 @@ class KollaAnsible(object):
     def backup(self, destination: Path):
         'Backup kolla-ansible logs and conf'
         logging.info('Backup kolla-ansible logs and conf')
-        with elib.play_on(inventory_path=str(self._inventory),
-                          extra_vars=self.globals_values) as yaml:
+        with self.play_on(inventory_path=str(self._inventory)) as yaml:
             yaml.archive(
                 **title('Archive kolla-ansible logs and conf'),
                 format='gz',
@@ -324,7 +543,9 @@ class KollaAnsible(object):
 
         The name of the virtual environment is computed based on the
         `pip_package`, so calling that method with two different `pip_package`
-        values results in two different installations.
+        values results in two different installations.  If the installation
+        has been started in the background with `pull_in_background`, this
+        waits for its completion.
 
         Args:
             pip_package: The kolla-ansible pip package to install.  Package
@@ -334,30 +555,167 @@ class KollaAnsible(object):
               or a local editable directory '-e ~/path/to/loca/kolla-ansible'.
             config_dir:  Directory to install kolla-ansible in.
         '''
+        venv = _venv_path(pip_package, config_dir)
+
+        pending = _PULLS.pop(venv, None)
+        if pending is not None:
+            if not pending.done():
+                logging.info("Waiting for the installation of kolla-ansible "
+                             "started in the background...")
+            return pending.result()
+
         logging.info("Installing kolla-ansible and dependencies...")
+        return _install_venv(pip_package, venv)
+
+    @staticmethod
+    def pull_in_background(pip_package: str, config_dir: Path):
+        '''Start `pull` in the background.
 
-        # Generates a path for the virtual environment computing a
-        # deterministic hash, See https://stackoverflow.com/a/42089311
-        pip_ref_hash = int(hashlib.sha256(pip_package.encode('utf-8'))
-                           .hexdigest(), 16) % 10**8
-        venv = (config_dir / f'kolla-ansible-venv-{pip_ref_hash}').resolve()
-
-        # Install kolla-ansible and its dependencies
-        with elib.play_on(roles={}, pattern_hosts="localhost") as yaml:
-            yaml.local_action(
-                **title(f'Install {pip_package} in {venv}'),
-                module="pip",
-                # Pin Jinja2 version to fix the renaming of `contextfilter`
-                # into `pass_context.evalcontextfilter`.
-                # See https://github.com/BeyondTheClouds/enos/pull/346#issuecomment-1080851796  # noqa
-                # requests/urllib3 bug: https://github.com/docker/docker-py/issues/3113  # noqa
-                name=[ANSIBLE_PKG, 'Jinja2==3.0.3', 'requests<2.29', 'urllib3<2',
-                      'influxdb', pip_package],
-                virtualenv=str(venv),
-                virtualenv_python=PY_VERSION)
+        The installation only runs local commands, so it can overlap with the
+        reservation of the testbed.  A later `pull` (e.g., by the
+        constructor) with the same arguments waits for it.
 
+        '''
+        venv = _venv_path(pip_package, config_dir)
+        if venv in _PULLS:
+            return
+
+        logging.info("Installing kolla-ansible and dependencies in the "
+                     "background...")
+        future: Future = Future()
+
+        def _pull():
+            try:
+                future.set_result(_install_venv(pip_package, venv))
+            except BaseException as err:
+                future.set_exception(err)
+
+        _PULLS[venv] = future
+        # A daemon thread does not prevent enos from exiting (e.g., on a
+        # reservation error).  An interrupted installation is completed by
+        # the next pull.
+        threading.Thread(target=_pull, name=f'pull-{venv.name}',
+                         daemon=True).start()
+
+
+# Keys of Ansible tasks whose value is a Jinja expression (without braces)
+ANSIBLE_CONDITIONALS = ['when', 'changed_when', 'failed_when', 'until']
+
+
+def _template_strings(value: Any, is_expression: bool = False) -> List[str]:
+    'All strings of `value` (recursively), as Jinja templates'
+    if isinstance(value, str):
+        return ['{{ %s }}' % value if is_expression else value]
+    if isinstance(value, dict):
+        return [template
+                for key, item in value.items()
+                for template in _template_strings(
+                    item, key in ANSIBLE_CONDITIONALS)]
+    if isinstance(value, (list, tuple)):
+        return [template
+                for item in value
+                for template in _template_strings(item, is_expression)]
+    return []
+
+
+# Memoized values of `openstack_auth`, by digest of the globals
+_OPENSTACK_AUTHS: Dict[str, Dict[str, Any]] = {}
+
+# Installations of kolla-ansible started in the background, by path of their
+# virtual environment
+_PULLS: Dict[Path, Future] = {}
+
+
+def _venv_path(pip_package: str, config_dir: Path) -> Path:
+    'Path of the virtual environment of `pip_package` in `config_dir`'
+    # Generates a path for the virtual environment computing a
+    # deterministic hash, See https://stackoverflow.com/a/42089311
+    pip_ref_hash = int(hashlib.sha256(pip_package.encode('utf-8'))
+                       .hexdigest(), 16) % 10**8
+    # Do not resolve the venv itself, it may be a link to the shared cache
+    return Path(config_dir).resolve() / f'kolla-ansible-venv-{pip_ref_hash}'
+
+
+def _install_venv(pip_package: str, venv: Path) -> Path:
+    '''Install kolla-ansible and its dependencies in `venv`.
+
+    The virtual environment is built once in the user cache
+    (`C.CACHE_DIR/venvs/<digest of the requirements>`) and `venv` links to
+    it, so that environments with the same requirements share it.  Editable
+    and local packages are not shared, and neither are former virtual
+    environments that are not links.
+
+    This only relies on local subprocesses (no Ansible), so that it safely
+    runs in a thread while enos uses Ansible.  The output of the installation
+    goes to `<venv>.log`.
+
+    '''
+    # Pin Jinja2 version to fix the renaming of `contextfilter`
+    # into `pass_context.evalcontextfilter`.
+    # See https://github.com/BeyondTheClouds/enos/pull/346#issuecomment-1080851796  # noqa
+    # requests/urllib3 bug: https://github.com/docker/docker-py/issues/3113  # noqa
+    requirements = [ANSIBLE_PKG, 'Jinja2==3.0.3', 'requests<2.29', 'urllib3<2',
+                    'influxdb']
+    # The package may come with pip options (e.g., '-e ~/path/to/kolla')
+    requirements += [os.path.expanduser(arg)
+                     for arg in shlex.split(pip_package)]
+
+    log_path = venv.with_suffix('.log')
+    is_local = (venv.exists() and not venv.is_symlink()) or any(
+        arg.startswith('-e') or arg == '--editable'
+        or (os.sep in arg and os.path.exists(arg))
+        for arg in requirements)
+    if is_local:
+        _pip_install(requirements, venv, log_path)
+        logging.info(f'Installed {pip_package} in {venv}')
         return venv
 
+    digest = hashlib.sha256(json.dumps([PY_VERSION, requirements])
+                            .encode('utf-8')).hexdigest()[:16]
+    shared_venv = Path(C.CACHE_DIR) / 'venvs' / digest
+    shared_venv.parent.mkdir(parents=True, exist_ok=True)
+
+    # Concurrent commands build the shared venv only once
+    with open(shared_venv.with_suffix('.lock'), 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        if (shared_venv / VENV_COMPLETE_MARKER).exists():
+            logging.info(f'Reuse {pip_package} from {shared_venv}')
+        else:
+            _pip_install(requirements, shared_venv, log_path)
+            (shared_venv / VENV_COMPLETE_MARKER).touch()
+            logging.info(f'Installed {pip_package} in {shared_venv}')
+
+    # Link the environment to the shared venv
+    tmp_link = venv.with_suffix(f'.{os.getpid()}.tmp')
+    tmp_link.unlink(missing_ok=True)
+    tmp_link.symlink_to(shared_venv, target_is_directory=True)
+    os.replace(tmp_link, venv)
+
+    return venv
+
+
+def _pip_install(requirements: List[str], venv: Path, log_path: Path):
+    '''Create `venv` if need be, and pip install `requirements` in it.
+
+    Packages come from `C.WHEELHOUSE` without network access, if set.
+    '''
+    pip_opts = []
+    if C.WHEELHOUSE:
+        pip_opts = ['--no-index', '--find-links', C.WHEELHOUSE]
+
+    with open(log_path, 'w') as log:
+        try:
+            if not (venv / 'bin' / 'pip').exists():
+                subprocess.run([sys.executable, '-m', 'venv', str(venv)],
+                               stdout=log, stderr=subprocess.STDOUT,
+                               check=True)
+            subprocess.run([str(venv / 'bin' / 'pip'), 'install']
+                           + pip_opts + requirements,
+                           stdout=log, stderr=subprocess.STDOUT, check=True)
+        except subprocess.CalledProcessError as err:
+            raise Exception(f'Installation of {requirements} in {venv} failed '
+                            f'(see {log_path})') from err
+
 
 def title(title: str) -> Dict[str, str]:
     "A title for an ansible yaml commands"
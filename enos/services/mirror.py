@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+'''Apt proxy and pip cache of the deployment.
+
+Hundreds of nodes installing the same apt and pip packages at once are slow
+and get rate-limited by upstream mirrors.  `PackageMirror` runs an apt proxy
+(apt-cacher-ng) and a caching PyPI mirror (devpi) on one node, e.g., the
+registry node, and points apt and pip of all nodes at it.  Pip reads the
+global `/etc/pip.conf`, so virtualenvs (e.g., Rally on bench agents) use the
+mirror as well.
+
+'''
+import logging
+import textwrap
+from typing import Dict, List
+
+import enoslib as elib
+
+LOGGER = logging.getLogger(__name__)
+
+APT_PORT = 3142
+PIP_PORT = 3141
+
+# Virtual environment and storage of devpi on the mirror node
+DEVPI_VENV = '/opt/devpi'
+DEVPI_DIR = '/var/lib/devpi'
+
+
+class PackageMirror(object):
+
+    def __init__(self, host: elib.Host):
+        '''Deploy an apt proxy and a pip cache on `host`'''
+        self.host = host
+
+    @property
+    def apt_proxy(self) -> str:
+        return f'http://{self.host.address}:{APT_PORT}'
+
+    @property
+    def pip_index(self) -> str:
+        return f'http://{self.host.address}:{PIP_PORT}/root/pypi/+simple/'
+
+    def deploy(self):
+        'Start apt-cacher-ng and devpi on the mirror node'
+        LOGGER.info(f'Deploying the package mirror on {self.host.alias}')
+        with elib.play_on(roles=[self.host], gather_facts=False) as yml:
+            yml.apt(
+                **title('Install apt-cacher-ng'),
+                name=['apt-cacher-ng', 'python3-venv'],
+                update_cache=True)
+            yml.systemd(
+                **title('Start apt-cacher-ng'),
+                name='apt-cacher-ng',
+                state='started',
+                enabled=True)
+
+            yml.pip(
+                **title('Install devpi'),
+                name='devpi-server',
+                virtualenv=DEVPI_VENV,
+                virtualenv_command='python3 -m venv')
+            yml.command(
+                f'{DEVPI_VENV}/bin/devpi-init --serverdir {DEVPI_DIR}',
+                **title('Initialize devpi'),
+                creates=f'{DEVPI_DIR}/.serverversion')
+            yml.copy(
+                **title('Install the devpi service'),
+                dest='/etc/systemd/system/devpi.service',
+                content=DEVPI_SERVICE)
+            yml.systemd(
+                **title('Start devpi'),
+                name='devpi',
+                state='started',
+                enabled=True,
+                daemon_reload=True)
+
+            for port in [APT_PORT, PIP_PORT]:
+                yml.wait_for(
+                    **title(f'Wait for the package mirror on port {port}'),
+                    host='{{ ansible_host }}',
+                    port=port,
+                    state='started',
+                    timeout=120)
+
+    def configure(self, hosts: List[elib.Host]):
+        'Point apt and pip of `hosts` at the mirror'
+        with elib.play_on(roles=hosts, gather_facts=False) as yml:
+            yml.copy(
+                **title('Use the apt proxy'),
+                dest='/etc/apt/apt.conf.d/01enos-proxy',
+                content=f'Acquire::http::Proxy "{self.apt_proxy}";\n')
+            yml.copy(
+                **title('Use the pip cache'),
+                dest='/etc/pip.conf',
+                content=textwrap.dedent(f'''\
+                    [global]
+                    index-url = {self.pip_index}
+                    trusted-host = {self.host.address}
+                    '''))
+
+
+DEVPI_SERVICE = f'''\
+[Unit]
+Description=Caching PyPI mirror (devpi)
+After=network.target
+
+[Service]
+ExecStart={DEVPI_VENV}/bin/devpi-server --host 0.0.0.0 --port {PIP_PORT} \\
+  --serverdir {DEVPI_DIR}
+Restart=always
+
+[Install]
+WantedBy=multi-user.target
+'''
+
+
+# Utils
+
+def title(title: str) -> Dict[str, str]:
+    "A title for an ansible yaml commands"
+    return {"task_name": "Package mirror : " + title}
@@ -0,0 +1,231 @@
+# -*- coding: utf-8 -*-
+'''Tree of pull-through Docker registry mirrors.
+
+With a single registry, all nodes pull kolla images from one machine whose
+NIC saturates on large deployments.  `RegistryMirrors` splits hosts into
+groups (per cluster or per N nodes) and deploys a pull-through mirror on the
+first host of each group.  The mirror pulls from the root registry (the
+internal registry of enos or an external one) and hosts of the group pull
+from their mirror.
+
+The mirror of each host is given to kolla-ansible through the
+`enos_registry_mirror` host variable (see `write_host_vars`), so that a
+single `docker_custom_config` in globals reflects the mirror of each host.
+
+The storage of the internal registry can also be exported into a bundle
+(see `export_registry`) and seeded from it on the next deployment (see
+`seed_registry`), so that repeated experiments on the same OpenStack
+release do not download kolla images again.
+
+'''
+import logging
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Union
+
+import enoslib as elib
+import yaml
+
+LOGGER = logging.getLogger(__name__)
+
+# Docker image of the mirrors
+IMAGE = 'registry:2'
+
+# Host variable with the URL of the mirror of a host
+MIRROR_VAR = 'enos_registry_mirror'
+
+# File of host variables with the mirror of a host
+HOST_VARS_FILE = 'enos-registry.yml'
+
+# Storage of the internal registry deployed by enoslib
+REGISTRY_DIR = '/mnt/registry'
+
+
+class RegistryMirrors(object):
+    # Hosts of each group
+    groups: Dict[str, List[elib.Host]]
+
+    # Mirror host of each group
+    mirrors: Dict[str, elib.Host]
+
+    def __init__(self,
+                 hosts: List[elib.Host],
+                 root_ip: str,
+                 root_port: int,
+                 mirror_per: Union[str, int] = 'cluster'):
+        '''Deploy pull-through mirrors of a root registry.
+
+        Args:
+          hosts: Hosts that pull images.
+          root_ip: Address of the root registry.
+          root_port: Port of the root registry (mirrors listen on it too).
+          mirror_per: 'cluster' for a mirror per cluster (the cluster of a
+            host is the prefix of its name, e.g., 'paravance' for
+            'paravance-12.rennes.grid5000.fr'), or a number N for a mirror
+            per N hosts.
+        '''
+        self.root_ip = root_ip
+        self.port = root_port
+        self.mirror_per = mirror_per
+        self.groups = group_hosts(hosts, mirror_per)
+
+        # The first host of a group is its mirror, unless the group holds
+        # the root registry that already acts as a mirror.
+        self.mirrors = {}
+        for group, group_hosts_ in self.groups.items():
+            roots = [h for h in group_hosts_ if h.address == root_ip]
+            self.mirrors[group] = (roots or group_hosts_)[0]
+
+    @property
+    def root_url(self) -> str:
+        return f'http://{self.root_ip}:{self.port}'
+
+    def mirror_urls(self) -> Dict[str, str]:
+        'URL of the mirror of each host (by host alias)'
+        return {host.alias: f'http://{self.mirrors[group].address}:{self.port}'
+                for group, hosts in self.groups.items()
+                for host in hosts}
+
+    def add_hosts(self, hosts: List[elib.Host]) -> List[str]:
+        '''Assigns `hosts` to mirrors, without regrouping former hosts
+
+        A host goes to the group of its cluster, or to the last group with
+        less than N hosts.  Others make new groups, whose names are
+        returned (see `deploy`).
+        '''
+        known = {h.alias for group in self.groups.values() for h in group}
+        new_groups: List[str] = []
+        for host in sorted(set(hosts), key=lambda h: h.alias):
+            if host.alias in known:
+                continue
+            if self.mirror_per == 'cluster':
+                group = host.alias.split('-')[0]
+            else:
+                group = next((g for g, g_hosts in self.groups.items()
+                              if len(g_hosts) < self.mirror_per),
+                             f'group-{len(self.groups)}')
+            if group not in self.groups:
+                self.groups[group] = []
+                self.mirrors[group] = host
+                new_groups.append(group)
+            self.groups[group].append(host)
+        return new_groups
+
+    def deploy(self, groups: Optional[List[str]] = None):
+        'Start the mirrors of `groups` (all by default), but the root registry'
+        mirror_hosts = [h for g, h in self.mirrors.items()
+                        if (groups is None or g in groups)
+                        and h.address != self.root_ip]
+        if not mirror_hosts:
+            return
+
+        LOGGER.info(f'Deploying registry mirrors of {self.root_url} on '
+                    f'{[h.alias for h in mirror_hosts]}')
+        with elib.play_on(roles=mirror_hosts, gather_facts=False) as yml:
+            yml.docker_container(
+                **title('Start the registry mirror'),
+                name='registry-mirror',
+                image=IMAGE,
+                state='started',
+                restart_policy='always',
+                ports=[f'0.0.0.0:{self.port}:5000'],
+                env={
+                    'REGISTRY_PROXY_REMOTEURL': self.root_url,
+                    'REGISTRY_STORAGE_FILESYSTEM_ROOTDIRECTORY':
+                    '/mnt/registry-mirror',
+                },
+                volumes=['/mnt/registry-mirror:/mnt/registry-mirror'])
+            yml.wait_for(
+                **title('Wait for the registry mirror'),
+                host='{{ ansible_host }}',
+                port=self.port,
+                state='started',
+                delay=2,
+                timeout=120)
+
+    def write_host_vars(self, inventory_dir: Union[str, Path]):
+        '''Writes the mirror of each host in `inventory_dir/host_vars`
+
+        Ansible reads host_vars next to the inventory.
+        '''
+        for alias, url in self.mirror_urls().items():
+            host_vars = Path(inventory_dir) / 'host_vars' / alias
+            host_vars.mkdir(parents=True, exist_ok=True)
+            with open(host_vars / HOST_VARS_FILE, 'w') as host_file:
+                yaml.dump({MIRROR_VAR: url}, host_file)
+
+    @staticmethod
+    def remove_host_vars(inventory_dir: Union[str, Path]):
+        'Removes the mirrors written by `write_host_vars` (if any)'
+        for path in Path(inventory_dir).glob(f'host_vars/*/{HOST_VARS_FILE}'):
+            path.unlink()
+
+
+def bundle_name(globals_values: Dict[str, Any]) -> str:
+    'Name of the bundle of the kolla images of `globals_values`'
+    distro = globals_values.get('kolla_base_distro', 'unknown')
+    release = globals_values.get('openstack_release', 'unknown')
+    return f'registry-{distro}-{release}.tar.gz'
+
+
+def export_registry(registry_host: elib.Host, bundle: Path):
+    'Archives the storage of the registry on `registry_host` into `bundle`'
+    LOGGER.info(f'Export the registry of {registry_host.alias} to {bundle}')
+    remote_bundle = f'/tmp/{bundle.name}'
+    with elib.play_on(roles=[registry_host], gather_facts=False) as yml:
+        yml.archive(
+            **title('Archive the registry storage'),
+            format='gz',
+            path=f'{REGISTRY_DIR}/*',
+            dest=remote_bundle)
+        yml.fetch(
+            **title('Fetch the registry bundle'),
+            flat=True,
+            src=remote_bundle,
+            dest=str(bundle))
+        yml.file(
+            **title('Remove the remote registry bundle'),
+            path=remote_bundle,
+            state='absent')
+
+
+def seed_registry(registry_host: elib.Host, bundle: Path):
+    '''Restores the storage of the registry on `registry_host` from `bundle`
+
+    The registry is only seeded if its storage is empty (i.e., it has no
+    `docker` directory yet).
+    '''
+    LOGGER.info(f'Seed the registry of {registry_host.alias} with {bundle}')
+    with elib.play_on(roles=[registry_host], gather_facts=False) as yml:
+        yml.file(
+            **title('Create the registry storage'),
+            path=REGISTRY_DIR,
+            state='directory')
+        yml.unarchive(
+            **title('Restore the registry bundle'),
+            src=str(bundle),
+            dest=REGISTRY_DIR,
+            creates=f'{REGISTRY_DIR}/docker')
+
+
+# Utils
+
+def group_hosts(hosts: List[elib.Host],
+                mirror_per: Union[str, int]) -> Dict[str, List[elib.Host]]:
+    'Groups hosts per cluster or per N hosts (in the order of host names)'
+    hosts = sorted(set(hosts), key=lambda h: h.alias)
+    groups: Dict[str, List[elib.Host]] = {}
+    if mirror_per == 'cluster':
+        for host in hosts:
+            groups.setdefault(host.alias.split('-')[0], []).append(host)
+    elif isinstance(mirror_per, int) and mirror_per > 0:
+        for index, host in enumerate(hosts):
+            groups.setdefault(f'group-{index // mirror_per}', []).append(host)
+    else:
+        raise ValueError(f'registry.mirror_per should be "cluster" or a '
+                         f'positive number, not {mirror_per!r}')
+    return groups
+
+
+def title(title: str) -> Dict[str, str]:
+    "A title for an ansible yaml commands"
+    return {"task_name": "Registry : " + title}
@@ -7,23 +7,65 @@ from pathlib import Path
 import enoslib as elib
 from enoslib.task import get_or_create_env
 import yaml
-from enos.services import RallyOpenStack, Shaker
+from enos.services import kolla, registry, RallyOpenStack, Shaker
 from enos.utils.build import create_configuration
 from enos.utils.constants import (ANSIBLE_DIR, NETWORK_INTERFACE,
                                   NEUTRON_EXTERNAL_INTERFACE)
-from enos.utils.extra import (lookup_network, make_provider, setdefault_lazy,
-                              eget)
+from enos.utils.errors import EnosCannotScale
+from enos.utils.extra import (add_resources, lookup_network, make_provider,
+                              setdefault_lazy, eget)
 
 from typing import List, Optional, Dict, Any
 
 # Huge tasks are split in separate files
+from enos.tasks import changes, parallel, phases
 from enos.tasks.new import new
-from enos.tasks.up import up
+from enos.tasks.up import (up, mk_kolla_ansible, tune_ansible, UP_STEPS,
+                           UpArgs)
 
 
-__all__ = ['new', 'up', 'kolla_ansible', 'install_os',
+__all__ = ['new', 'up', 'update_globals', 'kolla_ansible', 'install_os',
            'init_os', 'bench', 'backup', 'tc', 'destroy_infra',
-           'destroy_os', 'build']
+           'destroy_os', 'build', 'plan', 'scale']
+
+
+def update_globals(env: elib.Environment, config: Dict[str, Any]):
+    """Update kolla-ansible globals with the `kolla` key of `config`
+
+    This lets one apply new kolla-ansible globals without running `up` again.
+
+    Args:
+        env: State for the current experiment
+        config: A dict with the `kolla` key (as in reservation.yaml)
+
+    Put into the env:
+        kolla-ansible: The kolla-ansible service
+
+    Read from the env:
+        config: Configuration (as a dict)
+        docker: The Docker service
+    """
+    eget(env, 'config').update(kolla=config.get('kolla', {}))
+    env['kolla-ansible'] = mk_kolla_ansible(
+        env, eget(env, 'docker'), env.get('registry-mirrors'))
+
+
+def plan(env: Optional[elib.Environment],
+         config: Dict[str, Any],
+         is_pull_only: bool) -> Dict[str, bool]:
+    """Tells which phases of `enos deploy` have to run
+
+    Args:
+        env: State of the former experiment, if any
+        config: A dict with information such as the provider, resources, etc,
+          as provided by the configuration file (reservation.yaml).
+        is_pull_only: Only pull dependencies. Do not install them.
+
+    Read from the env:
+        phases: Fingerprints of the completed phases
+        inventory: Path to the inventory file
+    """
+    return phases.plan(env, config, is_pull_only)
 
 
 def kolla_ansible(env: elib.Environment, kolla_cmd: List[str]):
@@ -33,6 +75,9 @@ def kolla_ansible(env: elib.Environment, kolla_cmd: List[str]):
         env: State for the current experiment
         kolla_cmd: kolla-ansible command and arguments
 
+    The output and the timing of tasks go to the `kolla-logs` directory of
+    the environment.
+
     Read from the env:
         kolla-ansible: The kolla-ansible service.
     """
@@ -41,13 +86,16 @@ def kolla_ansible(env: elib.Environment, kolla_cmd: List[str]):
         kolla_cmd.append('--verbose')
 
     logging.info(f"Calling Kolla with args {kolla_cmd} ...")
-    eget(env, 'kolla-ansible').execute(kolla_cmd)
+    eget(env, 'kolla-ansible').execute(
+        kolla_cmd, Path(env.env_name) / kolla.LOG_DIR)
 
 
 def install_os(env: elib.Environment,
                is_reconfigure: bool,
                is_pull_only: bool,
-               tags: Optional[str]):
+               tags: Optional[str],
+               changed_only: bool = False,
+               concurrency: Optional[int] = None):
     """Install OpenStack with kolla-ansible
 
     Args:
@@ -56,10 +104,30 @@ def install_os(env: elib.Environment,
            deployment).
         is_pull_only: Only pull dependencies. Do not install them.
         tags: Only run ansible tasks tagged with these values.
+        changed_only: Only run kolla-ansible on the services (and their
+           hosts) affected by changes of the globals, inventory or config
+           overrides since the last run (see `enos.tasks.changes`).
+        concurrency: Deploy independent services with up to `concurrency`
+           kolla-ansible at once (see `enos.tasks.parallel`).
+
+    Put into the env:
+        phases: Fingerprint of the os phase (if no tags)
+        os-applied: Snapshot of the applied globals, inventory and config
+           overrides (if no tags and not pull only)
 
     Read from the env:
+        config: Configuration (as a dict)
+        inventory: Path to the inventory file
         kolla-ansible: The kolla-ansible service
+
+    Raises:
+        ValueError: if `changed_only` comes with `tags` or `concurrency`.
     """
+    if changed_only and (tags or concurrency):
+        # Ansible runs the union of repeated `--tags`, and the stages of a
+        # parallel run deploy whole groups of services
+        raise ValueError('Running changed services only does not go with '
+                         'tags or a parallel deployment')
 
     kolla_cmd = []
 
@@ -73,7 +141,100 @@ def install_os(env: elib.Environment,
     if tags:
         kolla_cmd.append(f'--tags "\'{tags}\'"')
 
-    kolla_ansible(env, kolla_cmd)
+    globals_values = eget(env, 'kolla-ansible').globals_values
+    current = changes.snapshot(globals_values, eget(env, 'inventory'),
+                               _overrides_dir(env, globals_values))
+    applied = env.get('os-applied')
+    if changed_only and applied is not None:
+        diff = changes.diff(applied, current)
+        if diff is not None and not diff.services:
+            logging.info('Nothing changed since the last run')
+            kolla_cmd = []
+        elif diff is not None:
+            logging.info(f'Only run {diff.services} on {diff.hosts}')
+            kolla_cmd += [f'--tags {",".join(diff.services)}',
+                          f'--limit {",".join(diff.hosts)}']
+
+    if kolla_cmd and concurrency:
+        if logging.root.level <= logging.DEBUG:
+            kolla_cmd.append('--verbose')
+        parallel.run(eget(env, 'kolla-ansible'), kolla_cmd,
+                     Path(env.env_name) / kolla.LOG_DIR, concurrency,
+                     parallel.plan(globals_values))
+    elif kolla_cmd:
+        kolla_ansible(env, kolla_cmd)
+
+    # A partial run (with tags) does not complete the phase, and a pull
+    # does not apply anything
+    if not tags and not is_pull_only:
+        env['os-applied'] = current
+    if not tags:
+        phases.mark_done(env, 'os', phases.os_fingerprint(
+            eget(env, 'config'), eget(env, 'inventory'), is_pull_only))
+
+
+def scale(env: elib.Environment, role: str, count: int):
+    """Add `count` hosts of `role` to a deployment without redeploying it
+
+    The resources of the configuration get `count` more hosts of `role`
+    (see `Provider.scale_config`), and the provider is asked for them
+    again.  Then, only the new hosts
+    are set up (network information, Docker, bootstrap-servers, baremetal
+    steps of `up`) and get OpenStack services with `kolla-ansible deploy
+    --limit`.  Other hosts are left untouched.
+
+    Only works with the `resources` key of the configuration (not
+    `topology`) and with providers that can extend a reservation (e.g.,
+    vagrant).
+
+    Put into the env:
+        config: Configuration with the new resources
+        rsc/networks: Enoslib rscs and networks (with the new hosts)
+        inventory: Path to the inventory file (with the new hosts)
+        bootstrapped: Fingerprint of the bootstrap of each host
+        phases/os-applied: Updated to the new inventory
+
+    Raises:
+        EnosCannotScale: if the configuration or the provider does not
+          support it.
+    """
+    config = eget(env, 'config')
+    if 'topology' in config:
+        raise EnosCannotScale('only the `resources` key can be scaled')
+    provider = make_provider(config['provider']['type'])
+    config = provider.scale_config(config, add_resources(
+        config.get('resources', {}), role, count), role, count)
+    rsc, networks = provider.init(config, False)
+
+    # Keep the synced description of former hosts
+    former = {h.alias: h for h in eget(env, 'rsc').all()}
+    new_hosts = sorted(h.alias for h in rsc.all() if h.alias not in former)
+    if len(new_hosts) != count:
+        raise EnosCannotScale(
+            f'the provider returned {len(new_hosts)} new hosts instead of '
+            f'{count} (it may not extend a reservation)')
+    logging.info(f'Add hosts {new_hosts} as {role}')
+
+    env['config'] = config
+    env['rsc'] = elib.Roles({r: [former.get(h.alias, h) for h in hosts]
+                             for r, hosts in rsc.items()})
+    env['networks'] = networks
+    tune_ansible(env, len(rsc.all()))
+
+    args = UpArgs(False, False, None, None, new_hosts)
+    for step in ['sync_info', 'inventory', 'docker', 'bootstrap',
+                 'baremetal']:
+        logging.info(f'Run step {step} on new hosts')
+        UP_STEPS[step](env, args)
+        env.dump()
+
+    kolla_ansible(env, ['deploy', f'--limit {",".join(new_hosts)}'])
+
+    globals_values = eget(env, 'kolla-ansible').globals_values
+    env['os-applied'] = changes.snapshot(
+        globals_values, eget(env, 'inventory'),
+        _overrides_dir(env, globals_values))
+    phases.refresh(env, config)
 
 
 def init_os(env: elib.Environment, is_pull_only: bool):
@@ -83,6 +244,9 @@ def init_os(env: elib.Environment, is_pull_only: bool):
         env: State for the current experiment
         is_pull_only: Only pull dependencies. Do not install them.
 
+    Put into the env:
+        phases: Fingerprint of the init phase
+
     Read from the env:
         inventory: Path to the inventory file
         networks: Enoslib networks
@@ -113,6 +277,9 @@ def init_os(env: elib.Environment, is_pull_only: bool):
     }
     elib.run_ansible([playbook_path], inventory_path, extra_vars=options)
 
+    phases.mark_done(env, 'init', phases.init_fingerprint(
+        env.get('phases', {}).get('os'), is_pull_only))
+
 
 def bench(env: elib.Environment,
           workload_dir: Path,
@@ -209,12 +376,16 @@ def bench(env: elib.Environment,
                         shaker.run_scenario(scenario['file'])
 
 
-def backup(env: elib.Environment, backup_dir: Path):
+def backup(env: elib.Environment, backup_dir: Path,
+           export_registry: bool = False):
     """Backups OpenStack logs and rally, shaker, ... if exist
 
     Args:
         env: State for the current experiment.
         backup_dir: Path to the backup directory.
+        export_registry: Also export the storage of the internal registry
+          into a bundle named after the kolla images (e.g.,
+          `registry-centos-wallaby.tar.gz`).
 
     Put into the env:
         backup_dir: Path to the backup directory.
@@ -245,6 +416,15 @@ def backup(env: elib.Environment, backup_dir: Path):
     if 'docker' in env:
         eget(env, 'docker').backup()
 
+    if export_registry:
+        docker = eget(env, 'docker')
+        if not docker.registry:
+            raise Exception('Exporting the registry requires an internal '
+                            'registry')
+        bundle = registry.bundle_name(
+            eget(env, 'kolla-ansible').globals_values)
+        registry.export_registry(docker.registry[0], backup_dir / bundle)
+
     # Backup enos monitoring
     eget(env, 'config').update(backup_dir=str(backup_dir))
     options = {}
@@ -310,6 +490,7 @@ def destroy_infra(env: elib.Environment):
 
     logging.info(f'Destroying resources acquired on {provider}...')
     provider.destroy(env)
+    phases.forget(env, 'up')
 
 
 def destroy_os(env: elib.Environment, include_images: bool):
@@ -335,6 +516,7 @@ def destroy_os(env: elib.Environment, include_images: bool):
     eget(env, 'kolla-ansible').destroy(
         include_images,
         logging.root.level <= logging.DEBUG)
+    phases.forget(env, 'os')
 
     if 'rally' in env:
         eget(env, 'rally').destroy()
@@ -371,3 +553,18 @@ def build(provider: str, config_options: Dict[str, Any]):
     up(env, config, is_force_deploy, is_pull_only, None)
     install_os(env, False, is_pull_only, None)
     init_os(env, is_pull_only)
+
+
+# Utils
+
+def _overrides_dir(env: elib.Environment,
+                   globals_values: Dict[str, Any]) -> Path:
+    """Directory of kolla config overrides (`node_custom_config`)
+
+    Kolla defaults to `{{ node_config }}/config`, i.e., the `config`
+    directory of the kolla config dir, which is the env directory.
+    """
+    custom_config = globals_values.get('node_custom_config', '')
+    if custom_config and '{{' not in custom_config:
+        return Path(custom_config)
+    return Path(env.env_name) / 'config'
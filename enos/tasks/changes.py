@@ -0,0 +1,125 @@
+"""Kolla services affected by changes since the last `enos os`.
+
+`enos os` records in the env (under `os-applied`) a snapshot of what it
+applied: a digest of each kolla global, the hosts of each inventory group
+and a digest of each config override (files in the `node_custom_config`
+directory).  With `--changed-only`, the next `enos os` compares the current
+state with this snapshot and only runs kolla-ansible on the affected
+services (`--tags`) and their hosts (`--limit`).
+
+A change is mapped to a kolla service by its name:
+- a global `enable_<service>` or `<service>_<option>` (e.g.,
+  `nova_compute_virt_type`);
+- an inventory group `<service>` or `<service>-<component>` (e.g.,
+  `nova-compute`);
+- a config override `<service>.conf` or `<service>/...`.
+
+Any other change (e.g., `kolla_internal_vip_address`, `global.conf`) may
+affect all services and leads to a full run.
+
+Hosts of the load balancer are always part of the run: kolla applies the
+haproxy configuration of a service in the loadbalancer play, under the tag
+of the service (e.g., when the service gets enabled or changes its port).
+
+"""
+import logging
+from pathlib import Path
+from typing import Any, Dict, List, NamedTuple, Optional, Set
+
+from enos.utils.fingerprint import fingerprint
+from enos.utils.inventory import Inventory
+
+LOGGER = logging.getLogger(__name__)
+
+# Globals set by enos that do not configure services
+IGNORED_GLOBALS = ['cwd', 'resultdir', 'openstack_auth']
+
+# Groups of hosts by role (not services).  A change in these groups is
+# reflected by the groups of services that include them.  Groups of enos
+# services (e.g., `enos/registry`) are not deployed by kolla-ansible.
+ROLE_GROUPS = ['all', 'ungrouped', 'control', 'compute', 'network',
+               'storage', 'monitoring', 'deployment', 'baremetal']
+
+# Groups of the load balancer hosts (`haproxy` before kolla-ansible 10)
+LOADBALANCER_GROUPS = ['loadbalancer', 'haproxy']
+
+Snapshot = Dict[str, Dict[str, Any]]
+
+Changes = NamedTuple('Changes', [('services', List[str]),
+                                 ('hosts', List[str])])
+
+
+def snapshot(globals_values: Dict[str, Any],
+             inventory_path: str,
+             overrides_dir: Path) -> Snapshot:
+    'Snapshot of the globals, inventory and config overrides'
+    inventory = Inventory({}, inventory_path)
+    overrides_dir = Path(overrides_dir)
+    return {
+        'globals': {k: fingerprint(v) for k, v in globals_values.items()
+                    if k not in IGNORED_GLOBALS},
+        'inventory': {g: sorted(hosts)
+                      for g, hosts in inventory.group_hosts.items()
+                      if g != 'all'},
+        'overrides': {
+            str(p.relative_to(overrides_dir)): fingerprint(p)
+            for p in sorted(overrides_dir.rglob('*')) if p.is_file()},
+    }
+
+
+def diff(applied: Snapshot, current: Snapshot) -> Optional[Changes]:
+    '''Returns the services and hosts affected by the changes between
+    `applied` and `current`, or None if all services may be affected'''
+    groups = {g: hosts for g, hosts in current['inventory'].items()
+              if g not in ROLE_GROUPS and '/' not in g}
+    old_groups = {g: hosts for g, hosts in applied['inventory'].items()
+                  if g not in ROLE_GROUPS and '/' not in g}
+    services = {g.split('-')[0] for g in groups}
+    affected: Set[str] = set()
+    hosts: Set[str] = set()
+
+    for key in _changed_keys(applied['globals'], current['globals']):
+        name = key[len('enable_'):] if key.startswith('enable_') else key
+        service = _service_of(name, '_', services)
+        if service is None:
+            LOGGER.info(f'Global {key} changed, run all services')
+            return None
+        affected.add(service)
+
+    for group in _changed_keys(old_groups, groups):
+        service = _service_of(group, '-', services)
+        if service is None:
+            LOGGER.info(f'Group {group} changed, run all services')
+            return None
+        affected.add(service)
+
+    for path in _changed_keys(applied['overrides'], current['overrides']):
+        name = Path(path).parts[0]
+        service = _service_of(name[:-len('.conf')]
+                              if name.endswith('.conf') else name,
+                              '-', services)
+        if service is None:
+            LOGGER.info(f'Config override {path} changed, run all services')
+            return None
+        affected.add(service)
+
+    # Hosts of the affected services, and of the load balancer that holds
+    # their haproxy configuration
+    for group, group_hosts in groups.items():
+        if group.split('-')[0] in affected or (
+                affected and group in LOADBALANCER_GROUPS):
+            hosts.update(group_hosts)
+
+    return Changes(sorted(affected), sorted(hosts))
+
+
+# Utils
+
+def _changed_keys(old: Dict[str, Any], new: Dict[str, Any]) -> List[str]:
+    return sorted(k for k in set(old) | set(new) if old.get(k) != new.get(k))
+
+
+def _service_of(name: str, sep: str, services: Set[str]) -> Optional[str]:
+    'The service `name` belongs to (`<service>` or `<service><sep>...`)'
+    service = name.split(sep)[0]
+    return service if service in services else None
@@ -0,0 +1,135 @@
+"""Deployment of kolla services by concurrent kolla-ansible processes.
+
+kolla-ansible applies the roles of its `site.yml` one play after the other,
+although many services do not depend on each other once the infrastructure
+services are up.  `enos os --parallel N` runs:
+
+1. the infrastructure services (`INFRA_TAGS`), with one kolla-ansible;
+2. the independent groups of services (`SERVICE_GROUPS`), with up to N
+   concurrent kolla-ansible (`--tags` of the group, in order);
+3. all other services, with one kolla-ansible that skips the tags of the
+   former stages (`--skip-tags`), so that every play of `site.yml` runs
+   once.
+
+Groups only include enabled services (`enable_<service>` global, rendered
+with the Ansible templating engine since kolla defaults are templates,
+e.g., `"{{ enable_openstack_core | bool }}"`).  Each
+kolla-ansible logs in its own file (see `KollaAnsible.execute`), and the
+logs of a run are then merged into `<date>-<action>-parallel.log`.  The
+concurrent kolla-ansible do not draw a progress line (they would overwrite
+each other's line), they report when they complete instead.
+
+"""
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, List, NamedTuple
+
+from ansible.errors import AnsibleError
+from ansible.parsing.dataloader import DataLoader
+from ansible.template import Templar
+from enos.services import KollaAnsible
+
+LOGGER = logging.getLogger(__name__)
+
+# Services every other service depends on (e.g., keystone endpoints, the
+# database and the message queue), and the services that neutron, nova and
+# cinder expect on their hosts (openvswitch, ovn and iscsid).  In the order
+# of `site.yml`.
+INFRA_TAGS = ['common', 'loadbalancer', 'memcached', 'mariadb', 'iscsid',
+              'rabbitmq', 'keystone', 'openvswitch', 'ovn']
+
+# Groups of services with no ordering dependency between groups.  Services
+# of a group are deployed in order.
+SERVICE_GROUPS = [
+    ['glance', 'placement', 'nova', 'neutron'],
+    ['cinder'],
+    ['heat'],
+    ['horizon'],
+    ['influxdb', 'grafana'],
+]
+
+Plan = NamedTuple('Plan', [('infra', List[str]),
+                           ('groups', List[List[str]])])
+
+
+def plan(globals_values: Dict[str, Any]) -> Plan:
+    'The stages of a parallel deployment of the enabled services'
+    templar = Templar(loader=DataLoader(), variables=globals_values)
+    groups = [[tag for tag in group if _is_enabled(templar, tag)]
+              for group in SERVICE_GROUPS]
+    return Plan(INFRA_TAGS, [group for group in groups if group])
+
+
+def run(kolla: KollaAnsible, kolla_cmd: List[str], log_dir: Path,
+        concurrency: int, stages: Plan):
+    '''Runs `kolla_cmd` (e.g., `['deploy']`) in `stages` with up to
+    `concurrency` kolla-ansible at once
+
+    Raises the error of the first failed kolla-ansible, once all of them
+    complete.
+    '''
+    action = kolla_cmd[0]
+    stamp = time.strftime('%Y%m%d-%H%M%S')
+    log_dir.mkdir(parents=True, exist_ok=True)
+
+    def execute(tags: List[str], skip: bool = False, progress: bool = True):
+        option = '--skip-tags' if skip else '--tags'
+        name = f'{action}-{"rest" if skip else tags[0]}'
+        LOGGER.info(f'Run kolla-ansible {action} {option} {tags}')
+        start = time.time()
+        kolla.execute(kolla_cmd + [f'{option} {",".join(tags)}'],
+                      log_dir, name, progress=progress)
+        LOGGER.info(f'kolla-ansible {action} {option} {tags} done in '
+                    f'{time.time() - start:.0f}s')
+
+    try:
+        execute(stages.infra)
+
+        errors = []
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            futures = [pool.submit(execute, group, progress=False)
+                       for group in stages.groups]
+            for group, future in zip(stages.groups, futures):
+                try:
+                    future.result()
+                except Exception as err:
+                    LOGGER.error(f'kolla-ansible {action} of {group} failed')
+                    errors.append(err)
+        if errors:
+            raise errors[0]
+
+        run_tags = stages.infra + [t for group in stages.groups
+                                   for t in group]
+        execute(run_tags, skip=True)
+    finally:
+        _merge_logs(log_dir / f'{stamp}-{action}-parallel.log', log_dir,
+                    stamp)
+
+
+# Utils
+
+def _is_enabled(templar: Templar, service: str) -> bool:
+    '''Value of the `enable_<service>` global, rendered by `templar`
+
+    A service whose flag does not render is taken as enabled: its play
+    then runs in a group rather than with the rest, and kolla skips it if
+    it is disabled.
+    '''
+    flag = f'enable_{service}'
+    try:
+        value = templar.template(templar.available_variables.get(flag, False))
+    except AnsibleError as err:
+        LOGGER.debug(f'Cannot render `{flag}` ({err}), take it as enabled')
+        return True
+    return str(value).lower() in ['yes', 'true', '1']
+
+
+def _merge_logs(path: Path, log_dir: Path, stamp: str):
+    'Concatenates the logs of `log_dir` since `stamp` into `path`'
+    with open(path, 'w') as merged:
+        for log in sorted(log_dir.glob('*.log')):
+            if log.name >= stamp and log != path:
+                merged.write(f'==> {log.name} <==\n')
+                merged.write(log.read_text())
@@ -0,0 +1,152 @@
+"""Fingerprints of the deployment phases (up, os and init).
+
+Each phase records in the env (under `phases`) a fingerprint of its inputs
+when it completes successfully.  `enos deploy` computes the fingerprints of
+the phases for the current configuration and only runs the phases whose
+fingerprint changed, as well as the phases that follow a phase that runs.
+
+Inputs of the phases are:
+- up: The configuration without the `kolla` key (globals are applied by the
+  os phase), the base inventory and the kolla-ansible package.
+- os: The `kolla` key of the configuration, the kolla-ansible package and the
+  generated inventory.
+- init: The init playbook and the fingerprint of the os phase it follows.
+
+The bootstrap step of `up` (kolla-ansible bootstrap-servers) also records a
+fingerprint for each host (under `bootstrapped`), so that it only bootstraps
+new hosts and hosts whose inputs changed.
+
+"""
+import logging
+import os
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+import enos.utils.constants as C
+from enos.services import kolla
+from enos.utils.extra import seekpath
+from enos.utils.fingerprint import fingerprint
+from enos.utils.inventory import Inventory
+
+LOGGER = logging.getLogger(__name__)
+
+# Ordered list of phases of `enos deploy`
+PHASES = ['up', 'os', 'init']
+
+# Prefixes of the kolla globals used by bootstrap-servers (baremetal role)
+BOOTSTRAP_GLOBALS = ('docker_', 'enable_docker_repo', 'kolla_user',
+                     'kolla_group', 'create_kolla_user', 'customize_etc_hosts',
+                     'change_selinux', 'selinux_', 'disable_firewall',
+                     'enable_host_ntp', 'virtualenv', 'host_python')
+
+
+def up_fingerprint(config: Dict[str, Any], is_pull_only: bool) -> str:
+    'Fingerprint of the inputs of the up phase'
+    up_config = {k: v for k, v in config.items() if k != 'kolla'}
+    base_inventory = seekpath(config.get('inventory')
+                              or os.path.join(C.RSCS_DIR, 'inventory.sample'))
+
+    return fingerprint(
+        'up', up_config, Path(base_inventory),
+        config.get('kolla-ansible') or kolla.KOLLA_PKG, is_pull_only)
+
+
+def os_fingerprint(config: Dict[str, Any],
+                   inventory_path: Optional[str],
+                   is_pull_only: bool) -> str:
+    'Fingerprint of the inputs of the os phase'
+    return fingerprint(
+        'os', config.get('kolla', {}),
+        config.get('kolla-ansible') or kolla.KOLLA_PKG,
+        Path(inventory_path or ''), is_pull_only)
+
+
+def init_fingerprint(os_fp: Optional[str], is_pull_only: bool) -> str:
+    'Fingerprint of the inputs of the init phase'
+    return fingerprint(
+        'init', Path(C.ANSIBLE_DIR) / 'init_os.yml', os_fp, is_pull_only)
+
+
+def bootstrap_fingerprints(config: Dict[str, Any],
+                           globals_values: Dict[str, Any],
+                           inventory_path: str,
+                           boot_ids: Dict[str, str]) -> Dict[str, str]:
+    '''Fingerprint of the inputs of bootstrap-servers for each host
+
+    Inputs are the kolla-ansible package, the Docker version, the globals
+    used by bootstrap-servers, the groups of the host and its boot id (in
+    `boot_ids`), so that a host redeployed under the same name (e.g., a
+    new reservation) is bootstrapped again.  Other hosts are not part of
+    it, so that adding hosts does not bootstrap former ones again.
+    '''
+    bootstrap_globals = {k: v for k, v in globals_values.items()
+                         if k.startswith(BOOTSTRAP_GLOBALS)}
+    common = fingerprint(
+        'bootstrap', config.get('kolla-ansible') or kolla.KOLLA_PKG,
+        config.get('docker_version', kolla.DOCKER_VERSION), bootstrap_globals)
+
+    inventory = Inventory({}, inventory_path)
+    return {host: fingerprint(common, sorted(inventory.host_groups[host]),
+                              boot_ids.get(host))
+            for host in inventory.group_hosts.get('baremetal', [])}
+
+
+def plan(env: Optional[Dict[str, Any]],
+         config: Dict[str, Any],
+         is_pull_only: bool) -> Dict[str, bool]:
+    '''Tells which phases have to run to deploy `config`.
+
+    Args:
+        env: State of a former experiment (if any).
+        config: The configuration to deploy.
+        is_pull_only: Only pull dependencies.
+
+    Returns:
+        A dict {phase name: True if the phase has to run} ordered as PHASES.
+    '''
+    done = (env or {}).get('phases', {})
+    inventory = (env or {}).get('inventory')
+
+    todo = {}
+    todo['up'] = done.get('up') != up_fingerprint(config, is_pull_only)
+    todo['os'] = (todo['up'] or done.get('os') != os_fingerprint(
+        config, inventory, is_pull_only))
+    todo['init'] = (todo['os'] or done.get('init') != init_fingerprint(
+        done.get('os'), is_pull_only))
+
+    LOGGER.debug(f'Plan with recorded phases {done}: {todo}')
+    return todo
+
+
+def mark_done(env: Dict[str, Any], phase: str, phase_fp: str):
+    '''Record the successful run of `phase` with fingerprint `phase_fp`.
+
+    Phases after `phase` have to run again and thus are forgotten.
+    '''
+    done = env.get('phases', {})
+    following = PHASES[PHASES.index(phase):]
+    env['phases'] = dict({p: fp for p, fp in done.items()
+                          if p not in following},
+                         **{phase: phase_fp})
+
+
+def refresh(env: Dict[str, Any], config: Dict[str, Any]):
+    '''Recompute the fingerprints of the os and init phases that ran, e.g.,
+    after `enos scale` changed the inventory and deployed the change itself.
+
+    The up phase keeps the fingerprint of the configuration it ran with.
+    '''
+    done = dict(env.get('phases', {}))
+    if 'os' in done:
+        mark_done(env, 'os', os_fingerprint(config, env.get('inventory'),
+                                            False))
+    if 'init' in done:
+        mark_done(env, 'init', init_fingerprint(env['phases'].get('os'),
+                                                False))
+
+
+def forget(env: Dict[str, Any], phase: str):
+    'Forget that `phase` and the following ones ran (e.g., on destroy)'
+    done = env.get('phases', {})
+    following = PHASES[PHASES.index(phase):]
+    env['phases'] = {p: fp for p, fp in done.items() if p not in following}
@@ -3,63 +3,180 @@
 Get resources on the testbed and install dependencies.
 """
 
+import copy
+import json
 import logging
 import os
 from pathlib import Path
-from operator import methodcaller
 
 import enoslib as elib
-import enoslib.api as elib_api
-from enoslib.enos_inventory import EnosInventory
+import yaml
 
-from enos.services import kolla, KollaAnsible
+from enos.services import (kolla, registry, KollaAnsible, PackageMirror,
+                           RegistryMirrors)
+from enos.tasks import phases
 import enos.utils.constants as C
-from enos.utils.extra import (generate_inventory, get_vip_pool,
-                              make_provider, ip_generator, seekpath)
+from enos.utils.errors import EnosUnknownStep
+from enos.utils.extra import (eget, generate_inventory, get_vip_pool,
+                              make_provider, seekpath,
+                              set_network_interfaces)
+from enos.utils import ansible_config, facts, tuning
+from enos.utils.ipam import IPAllocator, addresses_in_use
 
-from typing import Optional, Dict, Any
+from typing import Callable, NamedTuple, Optional, Dict, Any, List
 
 LOGGER = logging.getLogger(__name__)
 
 
+# Keys of the former env that a new `up` takes over: state of the testbed
+# that outlives an env, i.e., the reserved IPs (so that VIPs remain the same)
+# and the bootstrapped hosts
+CARRIED_KEYS = ['ipam', 'bootstrapped']
+
+# Block of /etc/hosts with the API address of all hosts, as generated by
+# bootstrap-servers (same marker).  See
+# https://github.com/openstack/kolla-ansible/blob/stable/ussuri/ansible/roles/baremetal/tasks/pre-install.yml
+ETC_HOSTS_MARKER = '# {mark} ANSIBLE GENERATED HOSTS'
+ETC_HOSTS_BLOCK = '''\
+{% for host in groups['baremetal'] %}
+{% set api_interface = hostvars[host]['api_interface']
+     | default(hostvars[host]['network_interface']) %}
+{{ hostvars[host]['ansible_' + api_interface | replace('-', '_')]
+   ['ipv4']['address'] }} {{ hostvars[host]['ansible_hostname'] }}
+{% endfor %}'''
+
+
+# Options of `up` given to each of its steps (see `UP_STEPS` below)
+UpArgs = NamedTuple('UpArgs', [('is_force_deploy', bool),
+                               ('is_pull_only', bool),
+                               ('tags', Optional[str]),
+                               ('seed_registry', Optional[Path]),
+                               # Only set up these new hosts (`enos scale`)
+                               ('limit', Optional[List[str]])])
+
+
 def up(env: elib.Environment,
-       config: Dict[str, Any],
+       config: Optional[Dict[str, Any]],
        is_force_deploy: bool,
        is_pull_only: bool,
-       tags: Optional[str]):
+       tags: Optional[str],
+       resume: bool = False,
+       only: Optional[str] = None,
+       seed_registry: Optional[Path] = None):
     """Get resources on the testbed and install dependencies.
 
+    `up` is made of named steps (see `UP_STEPS`).  The env records the steps
+    that completed and is saved after each of them, so that a failed `up` can
+    be resumed from its first incomplete step.
+
     Args:
         config: A dict with information such as the provider, resources, etc,
-          as provided by the configuration file (reservation.yaml).
+          as provided by the configuration file (reservation.yaml).  None to
+          reuse the configuration of the env (on `resume` or `only`).
         is_force_deploy: If true, start from a fresh environment.
         is_pull_only: Only pull dependencies. Do not install them.
         tags: Only run ansible tasks tagged with these values.
         env: State for the current experiment
+        resume: Only run the steps that did not complete yet.
+        only: Only run the step with this name.
+        seed_registry: Bundle to restore in the internal registry before
+          it starts (see `enos backup --export-registry`).
 
     Put into the env:
         config: Configuration (as a dict)
         inventory: Path to the inventory file
         rsc/networks: Enoslib rscs and networks
+        ipam: Allocator of IP addresses (e.g., VIPs)
         docker: The Docker service
+        registry-mirrors: Tree of registry mirrors (or None)
         kolla-ansible: The kolla-ansible service
+        bootstrapped: Fingerprint of the bootstrap of each host
+        tuning: Tuning profile of each host
+        ansible-config: Ansible settings (see ansible.cfg in the env)
+        up-steps: Fingerprint of the inputs and names of completed steps
+        phases: Fingerprint of the up phase (if no tags)
 
     Raises:
         EnosUnknownProvider: if the provider name in the configuration file
           does not match to a known provider.
+        EnosUnknownStep: if `only` is not the name of a step.
+        MissingEnvState: if `resume` or `only` is used on an env that does
+          not come from a former `up`.
 
     """
+    if only is not None and only not in UP_STEPS:
+        raise EnosUnknownStep(only, list(UP_STEPS))
+
+    if config is not None and not (resume or only):
+        # Start over.  Fingerprint of the inputs is recorded once up
+        # completes.
+        env['config'] = config
+        env['up-steps'] = {
+            'fingerprint': phases.up_fingerprint(config, is_pull_only),
+            'done': []}
+
+    up_steps = eget(env, 'up-steps')
+    args = UpArgs(is_force_deploy, is_pull_only, tags, seed_registry, None)
+
+    # Installing kolla-ansible only runs local commands, let it overlap with
+    # the reservation of the testbed.  The kolla step waits for it.
+    if only in [None, 'kolla'] and 'kolla' not in up_steps['done']:
+        KollaAnsible.pull_in_background(
+            env['config'].get('kolla-ansible') or kolla.KOLLA_PKG,
+            env.env_name)
+    for name, step in UP_STEPS.items():
+        if only is not None and name != only:
+            continue
+        if only is None and name in up_steps['done']:
+            LOGGER.info(f'Skip step {name} (already done)')
+            continue
+
+        LOGGER.info(f'Run step {name}')
+        step(env, args)
+
+        # Checkpoint
+        if name not in up_steps['done']:
+            up_steps['done'].append(name)
+        env['up-steps'] = up_steps
+        env.dump()
+
+    # A partial run (with tags) does not complete the phase
+    if not tags and all(name in up_steps['done'] for name in UP_STEPS):
+        phases.mark_done(env, 'up', up_steps['fingerprint'])
+
+
+def _step_provider(env: elib.Environment, args: UpArgs):
+    "Get resources from the provider"
+    config = eget(env, 'config')
 
     # Get the provider and update config with provider default values
-    provider_type = config['provider']['type']
-    provider = make_provider(provider_type)
+    provider = make_provider(config['provider']['type'])
     provider_conf = dict(provider.default_config(), **config['provider'])
     config.update(provider=provider_conf)
     LOGGER.debug(f"Loaded config {config}")
     env['config'] = config
 
     # Call the provider to initialize resources
-    rsc, networks = provider.init(config, is_force_deploy)
+    rsc, networks = provider.init(config, args.is_force_deploy)
+    env['rsc'] = rsc
+    env['networks'] = networks
+
+    tune_ansible(env, len(rsc.all()))
+
+
+def tune_ansible(env: elib.Environment, host_count: int):
+    "Tune Ansible to the number of hosts (for enoslib and kolla-ansible)"
+    ansible_settings = ansible_config.tune(
+        host_count, eget(env, 'config').get('ansible'))
+    ansible_config.write(env.env_name, ansible_settings)
+    ansible_config.apply(env.env_name)
+    env['ansible-config'] = ansible_settings
+
+
+def _step_sync_info(env: elib.Environment, args: UpArgs):
+    "Get network information of the hosts"
+    networks = eget(env, 'networks')
+
     # Note(rcherrueau): I keep track of this extra information for a
     # futur migration to enoslib-v6:
     # > enos-0 ansible_host=192.168.121.128 ansible_port='22'
@@ -72,20 +189,35 @@ def up(env: elib.Environment,
     # > neutron_external_interface='eth2'
     # > neutron_external_interface_dev='eth2'
     # > neutron_external_interface_ip='192.168.43.245'
-    rsc = elib.sync_info(rsc, networks)
+    rsc = eget(env, 'rsc')
+    # Other hosts than the limited ones are already synced.  Sync hosts with
+    # cached facts from the cache, `sync_info` always gathers facts.
+    hosts = _limit(rsc.all(), args)
+    cached = facts.cached_facts(env.env_name, [h.alias for h in hosts])
+    synced = {
+        h.alias: copy.deepcopy(h).sync_from_ansible(networks, cached[h.alias])
+        for h in hosts if h.alias in cached}
+    uncached = [h for h in hosts if h.alias not in cached]
+    if uncached:
+        synced.update(
+            {h.alias: h for h in elib.sync_info(uncached, networks)})
+    rsc = elib.Roles({role: [synced.get(h.alias, h) for h in role_hosts]
+                      for role, role_hosts in rsc.items()})
     LOGGER.debug(f"Provider resources: {rsc}")
     LOGGER.debug(f"Provider network information: {networks}")
 
     # Configure node-specific variables such as "network_interface".
     # Enoslib will then include these variables in the inventory so that
     # Kolla will be able to use them.
-    for host in rsc.all():
-        for network_name in [C.NETWORK_INTERFACE, C.API_INTERFACE,
-                             C.NEUTRON_EXTERNAL_INTERFACE]:
-            if networks[network_name]:
-                physical_interfaces = host.filter_interfaces(networks[network_name]) # noqa
-                if physical_interfaces:
-                    host.set_extra(**{network_name: physical_interfaces[0]})
+    set_network_interfaces(rsc, networks, [
+        C.NETWORK_INTERFACE, C.API_INTERFACE, C.NEUTRON_EXTERNAL_INTERFACE])
+
+    env['rsc'] = rsc
+
+
+def _step_inventory(env: elib.Environment, args: UpArgs):
+    "Generate the inventory and variables required by the application"
+    rsc, networks = eget(env, 'rsc'), eget(env, 'networks')
 
     # Generates inventory for ansible/kolla
     inventory = os.path.join(str(env.env_name), 'multinode')
@@ -95,117 +227,246 @@ def up(env: elib.Environment,
         base_inventory = os.path.join(C.RSCS_DIR, 'inventory.sample')
     else:
         base_inventory = seekpath(inventory_conf)
-    generate_inventory(rsc, networks, base_inventory, inventory)
+    kolla_inventory = generate_inventory(
+        rsc, networks, base_inventory, inventory)
     LOGGER.info('Generates inventory %s' % inventory)
     env['inventory'] = inventory
 
     # Ensures rsc contains all groups defined by the inventory (e.g.,
     # 'enos/registry', 'enos/influx', 'haproxy', ...).
     #
-    rsc = build_rsc_with_inventory(rsc, env['inventory'])
-    env['rsc'] = rsc
-    env['networks'] = networks
+    env['rsc'] = kolla_inventory.to_roles()
 
-    # Get variables required by the application
-    vip_pool = get_vip_pool(networks)
-    ips = ip_generator(vip_pool)
+    # Get variables required by the application.  VIPs are reserved in the
+    # allocator of the env so that they remain the same across runs.
+    ipam = get_ipam(env, networks)
     env['config'].update({
-        'vip':               next(ips),
-        'influx_vip':        next(ips),
-        'grafana_vip':       next(ips),
+        'vip':               ipam.allocate('vip'),
+        'influx_vip':        ipam.allocate('influx_vip'),
+        'grafana_vip':       ipam.allocate('grafana_vip'),
         'resultdir':         str(env.env_name),
         'rabbitmq_password': "demo",
         'database_password': "demo",
         'cwd':               str(Path.cwd()),
     })
 
+
+def get_ipam(env: elib.Environment, networks) -> IPAllocator:
+    '''Returns the IP allocator of the env (see `enos.utils.ipam`).
+
+    The allocator is created on the pool of VIPs the first time (or if the
+    pool changed) and stored in `env['ipam']`.  A new `up` takes it over
+    from the former env (see `CARRIED_KEYS`), so that addresses in use by
+    the former deployment (e.g., the VIP held by keepalived) remain
+    reserved to it rather than excluded.  Addresses in use on the
+    testbed are excluded from it, as well as the neighbours of hosts if the
+    configuration sets `check_arp: true`.
+    '''
+    vip_pool = get_vip_pool(networks)
+    ipam = env.get('ipam')
+    if ipam is None or ipam.network != str(vip_pool.network):
+        ipam = IPAllocator.from_network(vip_pool)
+
+    arp = env['config'].get('check_arp', False)
+    ipam.exclude(addresses_in_use(eget(env, 'rsc'), arp=arp))
+    env['ipam'] = ipam
+    return ipam
+
+
+def _step_docker(env: elib.Environment, args: UpArgs):
+    "Install Docker and its registry"
+    rsc = eget(env, 'rsc')
+    hosts = _limit(rsc['all'], args)
+
     # Ensure python3 is on remote targets (kolla requirement)
-    elib.ensure_python3(make_default=True, roles=rsc)
+    elib.ensure_python3(make_default=True, roles=hosts)
 
     # Install the Docker registry
     docker_type = env['config']['registry'].get('type', "internal")
     docker_port = env['config']['registry'].get('port', 5000)
-    docker = None
 
     docker_version = env['config'].get('docker_version', kolla.DOCKER_VERSION)
+    daemon = docker_daemon_profile(env['config'])
+    docker_opts: Dict[str, Any] = {
+        'docker_version': docker_version,
+        'nvidia_toolkit': False,
+        'bind_var_docker': daemon.get('data-root'),
+    }
 
     if docker_type == 'none':
-        docker = elib.Docker(agent=rsc['all'],
-                             docker_version=docker_version,
-                             nvidia_toolkit=False,
-                             registry_opts={'type': 'none'})
+        docker_opts.update(registry_opts={'type': 'none'})
     elif docker_type == 'external':
-        docker = elib.Docker(agent=rsc['all'],
-                             docker_version=docker_version,
-                             nvidia_toolkit=False,
-                             registry_opts={
-                                 'type': 'external',
-                                 'ip': env['config']['registry']['ip'],
-                                 'port': docker_port})
+        docker_opts.update(registry_opts={
+            'type': 'external',
+            'ip': env['config']['registry']['ip'],
+            'port': docker_port})
     elif docker_type == 'internal':
-        docker = elib.Docker(agent=rsc['all'],
-                             docker_version=docker_version,
-                             nvidia_toolkit=False,
-                             registry=rsc['enos/registry'],
-                             registry_opts={
-                                 'type': 'internal',
-                                 'port': docker_port})
+        docker_opts.update(registry=rsc['enos/registry'],
+                           registry_opts={
+                               'type': 'internal',
+                               'port': docker_port})
     else:
         error_msg = (f"Docker registry mirror of type \"{docker_type}\" "
                      "is not supported")
         raise Exception(error_msg)
 
+    # The recorded Docker spans all hosts (e.g., for `enos backup`), even
+    # though only the limited ones are set up
+    docker = elib.Docker(agent=rsc['all'], **docker_opts)
+    deployed = (docker if args.limit is None
+                else elib.Docker(agent=hosts, **docker_opts))
+
+    # Restore kolla images of a former deployment in the registry
+    if args.seed_registry is not None:
+        if docker.registry:
+            registry.seed_registry(docker.registry[0], args.seed_registry)
+        else:
+            LOGGER.warning('Seeding the registry requires an internal '
+                           'registry, ignore it')
+
     LOGGER.info(f'Deploying docker service as {docker.registry_opts}')
-    docker.deploy()
+    deployed.deploy()
     env['docker'] = docker
 
-    # Install kolla-ansible and run bootstrap-servers
-    kolla_globals_values = {
-        'kolla_internal_vip_address': env['config']['vip'],
-        'influx_vip': env['config']['influx_vip'],
-        'resultdir': str(env.env_name),
-        'docker_custom_config': mk_kolla_docker_custom_config(docker),
-        'docker_disable_default_iptables_rules': False,
-        'docker_disable_default_network': False,
-        'cwd': os.getcwd()
-    }
-    kolla_globals_values.update(env['config'].get('kolla', {}))
-    kolla_ansible = KollaAnsible(
-        config_dir=env.env_name,
-        inventory_path=inventory,
-        pip_package=env['config'].get('kolla-ansible'),
-        globals_values=kolla_globals_values)
+    # Enoslib only sets the registry in the Docker daemon configuration,
+    # apply the whole profile (as kolla-ansible does later on)
+    daemon_json = json.dumps(
+        mk_kolla_docker_custom_config(docker, daemon=daemon), indent=2)
+    with elib.play_on(roles=hosts, gather_facts=False) as yml:
+        yml.copy(
+            **title('Configure the Docker daemon'),
+            dest='/etc/docker/daemon.json',
+            content=daemon_json,
+            register='daemon_json')
+        yml.systemd(
+            **title('Restart the Docker daemon'),
+            name='docker',
+            state='restarted',
+            when='daemon_json.changed')
+
+    # Deploy a tree of mirrors of the registry (on large deployments)
+    inventory_dir = Path(eget(env, 'inventory')).parent
+    mirror_per = env['config']['registry'].get('mirror_per')
+    mirrors = env.get('registry-mirrors')
+    if args.limit is not None and mirrors is not None:
+        # Keep former hosts on their mirror, only assign the new ones
+        mirrors.deploy(mirrors.add_hosts(hosts))
+        mirrors.write_host_vars(inventory_dir)
+    elif mirror_per is not None and 'ip' in docker.registry_opts:
+        RegistryMirrors.remove_host_vars(inventory_dir)
+        mirrors = RegistryMirrors(rsc['all'],
+                                  docker.registry_opts['ip'],
+                                  docker.registry_opts['port'],
+                                  mirror_per)
+        mirrors.deploy()
+        mirrors.write_host_vars(inventory_dir)
+    else:
+        RegistryMirrors.remove_host_vars(inventory_dir)
+        mirrors = None
+        if mirror_per is not None:
+            LOGGER.warning('registry.mirror_per is ignored without a '
+                           'registry')
+    env['registry-mirrors'] = mirrors
+
+    # Serve apt and pip packages from the registry node
+    if env['config'].get('package_mirror', False):
+        if docker.registry:
+            package_mirror = PackageMirror(docker.registry[0])
+            package_mirror.deploy()
+            package_mirror.configure(hosts)
+        else:
+            LOGGER.warning('package_mirror requires an internal registry, '
+                           'ignore it')
+
+
+def _step_kolla(env: elib.Environment, args: UpArgs):
+    "Install kolla-ansible"
+    env['kolla-ansible'] = mk_kolla_ansible(
+        env, eget(env, 'docker'), env.get('registry-mirrors'))
+
+
+def _step_bootstrap(env: elib.Environment, args: UpArgs):
+    "Run kolla-ansible bootstrap-servers"
+    # Only bootstrap new hosts and hosts whose inputs changed, unless forced
+    boot_ids = {r.host: r.stdout.strip() for r in elib.run_command(
+        'cat /proc/sys/kernel/random/boot_id',
+        pattern_hosts='baremetal', inventory_path=eget(env, 'inventory'),
+        **title('Get the boot id of hosts'))}
+    fingerprints = phases.bootstrap_fingerprints(
+        eget(env, 'config'), eget(env, 'kolla-ansible').globals_values,
+        eget(env, 'inventory'), boot_ids)
+    done = {} if args.is_force_deploy else env.get('bootstrapped', {})
+    hosts = sorted(h for h, fp in fingerprints.items() if done.get(h) != fp)
+    if not hosts:
+        LOGGER.info('Skip bootstrap-servers (all hosts are bootstrapped)')
+        return
+    limit = ([] if len(hosts) == len(fingerprints)
+             else [f'--limit {",".join(hosts)}'])
+    LOGGER.info(f'Bootstrap {len(hosts)} of {len(fingerprints)} hosts')
 
     # Do not rely on kolla-ansible for docker, we already managed it with
     # enoslib previously.
     # https://github.com/openstack/kolla-ansible/blob/stable/ussuri/ansible/roles/baremetal/defaults/main.yml
     # https://docs.openstack.org/kolla-ansible/ussuri/reference/deployment-and-bootstrapping/bootstrap-servers.html
-    kolla_ansible.execute([
+    eget(env, 'kolla-ansible').execute([
         'bootstrap-servers',
         '--extra enable_docker_repo=false',
         ('--verbose' if logging.root.level <= logging.DEBUG else '')
-    ])
-    env['kolla-ansible'] = kolla_ansible
+    ] + limit, Path(env.env_name) / kolla.LOG_DIR)
+
+    # bootstrap-servers only writes /etc/hosts on the limited hosts, other
+    # hosts would not resolve the new ones (e.g., RabbitMQ, nova live
+    # migration).  Write the same block on all hosts.
+    if limit:
+        with eget(env, 'kolla-ansible').play_on(
+                inventory_path=eget(env, 'inventory'),
+                pattern_hosts='baremetal',
+                gather_facts=False) as yml:
+            yml.setup(**title('Gather facts (unless cached)'),
+                      when=facts.NOT_CACHED)
+            yml.blockinfile(
+                **title('Generate /etc/hosts for all of the nodes'),
+                dest='/etc/hosts',
+                marker=ETC_HOSTS_MARKER,
+                block=ETC_HOSTS_BLOCK,
+                when='customize_etc_hosts | default(true) | bool')
 
-    # Generates the admin-openrc, see
+    env['bootstrapped'] = fingerprints
+
+
+def _step_openrc(env: elib.Environment, args: UpArgs):
+    "Generate the admin-openrc"
+    # See
     # https://github.com/openstack/kolla-ansible/blob/stable/ussuri/ansible/roles/common/templates/admin-openrc.sh.j2
     admin_openrc_path = env['resultdir'] / 'admin-openrc'
-    os_auth_rc = kolla_ansible.get_admin_openrc_env_values()
+    os_auth_rc = eget(env, 'kolla-ansible').get_admin_openrc_env_values()
     with open(admin_openrc_path, mode='w') as admin_openrc:
         for k, v in os_auth_rc.items():
             admin_openrc.write(f'export {k}="{v}"\n')
 
     LOGGER.debug(f"{admin_openrc_path} generated with {os_auth_rc}")
 
-    # Set up machines with bare dependencies
-    with elib.play_on(inventory_path=inventory, pattern_hosts='baremetal',
-                      gather_facts=True,
-                      extra_vars=kolla_ansible.globals_values) as yml:
-        # Remove IP on the external interface if any
+
+def _step_baremetal(env: elib.Environment, args: UpArgs):
+    "Set up machines with bare dependencies"
+    provider = make_provider(env['config']['provider']['type'])
+    with eget(env, 'kolla-ansible').play_on(
+            inventory_path=eget(env, 'inventory'),
+            pattern_hosts=(':'.join(args.limit) if args.limit is not None
+                           else 'baremetal'),
+            gather_facts=False) as yml:
+        yml.setup(**title('Gather facts (unless cached)'),
+                  when=facts.NOT_CACHED)
+
+        # Remove IP on the external interface if any, and gather facts
+        # again so that the cache does not keep the flushed address
         yml.shell(
             "ip addr flush {{ neutron_external_interface }}",
             **title('Remove IP on the external interface (if any)'),
             when="neutron_external_interface is defined")
+        yml.setup(
+            **title('Gather facts again after the flush'),
+            when="neutron_external_interface is defined")
 
         # sudo required by `kolla-ansible destroy`.  See
         # https://github.com/openstack/kolla-ansible/blob/stable/ussuri/tools/validate-docker-execute.sh#L7
@@ -244,36 +505,124 @@ def up(env: elib.Environment,
                 value=0,
                 state='present')
 
-    # Runs playbook that install monitoring tools (eg, Influx, Monitoring,
-    # Grafana)
+    # Tune nodes, and record their profile to tie bench results to it
+    rsc = eget(env, 'rsc')
+    profiles = tuning.host_profiles(
+        env['config'].get('tuning', 'default'), rsc)
+    for name in sorted({name for name, _ in profiles.values()}):
+        hosts = [h for h in _limit(rsc['all'], args)
+                 if profiles[h.alias][0] == name]
+        if name != 'default' and hosts:
+            tuning.apply_profile(hosts, name, profiles[hosts[0].alias][1])
+
+    env['tuning'] = {alias: dict(settings, profile=name)
+                     for alias, (name, settings) in profiles.items()}
+    with open(Path(env.env_name) / 'tuning.yml', 'w') as tuning_file:
+        yaml.dump(env['tuning'], tuning_file, default_flow_style=False)
+
+
+def _step_monitoring(env: elib.Environment, args: UpArgs):
+    "Install monitoring tools (eg, Influx, Monitoring, Grafana)"
     options = env['config'].copy()
-    options.update(enos_action="pull" if is_pull_only else "deploy")
+    options.update(enos_action="pull" if args.is_pull_only else "deploy")
     up_playbook = os.path.join(C.ANSIBLE_DIR, 'enos.yml')
     elib.run_ansible(
-        [up_playbook], env['inventory'], extra_vars=options, tags=tags)
+        [up_playbook], eget(env, 'inventory'), extra_vars=options,
+        tags=args.tags)
+
+
+UP_STEPS: Dict[str, Callable[[elib.Environment, UpArgs], None]] = {
+    'provider':   _step_provider,
+    'sync_info':  _step_sync_info,
+    'inventory':  _step_inventory,
+    'docker':     _step_docker,
+    'kolla':      _step_kolla,
+    'bootstrap':  _step_bootstrap,
+    'openrc':     _step_openrc,
+    'baremetal':  _step_baremetal,
+    'monitoring': _step_monitoring,
+}
+
 
-
 # Utils
 
+def _limit(hosts: List[elib.Host], args: UpArgs) -> List[elib.Host]:
+    'The `hosts` a step sets up (see `UpArgs.limit`)'
+    if args.limit is None:
+        return hosts
+    return [h for h in hosts if h.alias in args.limit]
+
+
 def title(title: str) -> Dict[str, str]:
     "A title for an ansible yaml commands"
 
     return {"task_name": "enos up : " + title}
 
 
-def mk_kolla_docker_custom_config(docker: elib.Docker) -> Dict[str, Any]:
+def mk_kolla_ansible(env: elib.Environment,
+                     docker: elib.Docker,
+                     mirrors: Optional[RegistryMirrors] = None
+                     ) -> KollaAnsible:
+    """Install kolla-ansible and generate its globals from the env
+
+    Read from the env:
+        config: Configuration (as a dict)
+        inventory: Path to the inventory file
+    """
+    kolla_globals_values = {
+        'kolla_internal_vip_address': env['config']['vip'],
+        'influx_vip': env['config']['influx_vip'],
+        'resultdir': str(env.env_name),
+        'docker_custom_config': mk_kolla_docker_custom_config(
+            docker, mirrors, docker_daemon_profile(env['config'])),
+        'docker_disable_default_iptables_rules': False,
+        'docker_disable_default_network': False,
+        'cwd': os.getcwd()
+    }
+    kolla_globals_values.update(env['config'].get('kolla', {}))
+
+    return KollaAnsible(
+        config_dir=env.env_name,
+        inventory_path=env['inventory'],
+        pip_package=env['config'].get('kolla-ansible'),
+        globals_values=kolla_globals_values)
+
+
+def docker_daemon_profile(config: Dict[str, Any]) -> Dict[str, Any]:
+    '''Profile of the Docker daemon: `kolla.DOCKER_DAEMON` overridden by the
+    `docker_daemon` key of the configuration'''
+    return dict(kolla.DOCKER_DAEMON, **config.get('docker_daemon', {}))
+
+
+def mk_kolla_docker_custom_config(
+        docker: elib.Docker,
+        mirrors: Optional[RegistryMirrors] = None,
+        daemon: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
     '''Docker daemon conf for kolla-ansible that reflects elib.Docker
 
     Kolla-ansible overwrites the Docker daemon configuration that is setup by
     enoslib.  This function makes a specific Docker custom config for
-    kolla-ansible that reflects enoslib setup.
+    kolla-ansible that reflects enoslib setup and the profile of the daemon
+    (see `docker_daemon_profile`).
+
+    With `mirrors`, each host pulls from its own mirror, which ansible
+    resolves from the host variables written by `RegistryMirrors`.
 
     See https://github.com/BeyondTheClouds/enos/issues/345
 
     '''
-    docker_custom_config: Dict[str, Any] = {'debug': True}
+    # `data-root` is a bind mount of /var/lib/docker (see `_step_docker`)
+    docker_custom_config: Dict[str, Any] = {
+        k: v for k, v in (daemon or kolla.DOCKER_DAEMON).items()
+        if k != 'data-root'}
 
-    if 'ip' in docker.registry_opts:
+    if mirrors is not None:
+        mirror = '{{ %s }}' % registry.MIRROR_VAR
+        docker_custom_config.update({
+            'registry-mirrors': [mirror],
+            'insecure-registries': [mirror],
+        })
+    elif 'ip' in docker.registry_opts:
         ip = docker.registry_opts["ip"]
         port = docker.registry_opts["port"]
         mirror = f"http://{ip}:{port}"
@@ -284,29 +633,3 @@ def mk_kolla_docker_custom_config(docker: elib.Docker) -> Dict[str, Any]:
         })
 
     return docker_custom_config
-
-
-def build_rsc_with_inventory(
-        rsc: elib.Roles, inventory_path: str) -> elib.Roles:
-    '''Return a new `rsc` with roles from the inventory.
-
-    In enos, we have a strong binding between enoslib roles and kolla-ansible
-    groups.  We need for instance to know hosts of the 'enos/registry' group.
-    This method takes an enoslib Roles object and an inventory_path and returns
-    a new Roles object that contains all groups (as in the inventory file) with
-    their hosts (as in enoslib).
-
-    '''
-
-    inv = EnosInventory(sources=inventory_path)
-    rsc_by_name = {h.alias: h for h in elib_api.get_hosts(rsc, 'all')}
-
-    # Build a new rsc with all groups in it
-    new_rsc = rsc.copy()
-    for grp in inv.list_groups():
-        hostnames_in_grp = map(methodcaller('get_name'), inv.get_hosts(grp))
-        rsc_in_grp = [rsc_by_name[h_name] for h_name in hostnames_in_grp
-                      if h_name in rsc_by_name]
-        new_rsc.update({grp: rsc_in_grp})
-
-    return new_rsc
@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+'''Ansible configuration tuned to the size of the deployment.
+
+With the default of 5 forks, kolla-ansible plays on hundreds of hosts run in
+dozens of waves, and each task opens new SSH connections.  `tune` computes
+forks from the number of hosts and local CPUs, and enables pipelining.  The
+settings are written in `<env dir>/ansible.cfg` (which records them along
+with the results of the experiment), and exported as ANSIBLE_* environment
+variables so that they apply to enoslib plays and kolla-ansible subprocesses
+alike.  Other settings still come from the ansible.cfg of the user.
+
+The `ansible` key of the configuration file overrides computed values, and
+may set the SSH arguments (`ssh_args`) and the directory of SSH control
+sockets (`control_path_dir`):
+
+.. code-block:: yaml
+
+  ansible:
+    forks: 50
+    strategy: free
+    ssh_args: -o ControlMaster=auto -o ControlPersist=300s
+
+'''
+import configparser
+import logging
+import os
+from pathlib import Path
+from typing import Any, Dict, Mapping, Optional
+
+from ansible import constants as ansible_constants
+
+LOGGER = logging.getLogger(__name__)
+
+# Name of the configuration file (in the environment directory)
+ANSIBLE_CFG = 'ansible.cfg'
+
+# Ansible default of forks
+MIN_FORKS = 5
+
+# Forks per local CPU (forks mostly wait for SSH)
+FORKS_PER_CPU = 10
+
+# Environment variable of each setting
+_ENV_VARS = {
+    ('defaults', 'forks'): 'ANSIBLE_FORKS',
+    ('defaults', 'strategy'): 'ANSIBLE_STRATEGY',
+    ('ssh_connection', 'pipelining'): 'ANSIBLE_PIPELINING',
+    ('ssh_connection', 'ssh_args'): 'ANSIBLE_SSH_ARGS',
+    ('ssh_connection', 'control_path_dir'): 'ANSIBLE_SSH_CONTROL_PATH_DIR',
+}
+
+Settings = Dict[str, Dict[str, Any]]
+
+
+def tune(host_count: int,
+         overrides: Optional[Mapping[str, Any]] = None,
+         cpu_count: Optional[int] = None) -> Settings:
+    '''Returns Ansible settings for `host_count` hosts
+
+    Args:
+        host_count: Number of hosts of the deployment.
+        overrides: The `ansible` key of the configuration (`forks`,
+          `strategy`, `pipelining`, `ssh_args`, `control_path_dir`).
+        cpu_count: Number of local CPUs.  Defaults to `os.cpu_count()`.
+    '''
+    overrides = overrides or {}
+    cpu_count = cpu_count or os.cpu_count() or 1
+    forks = max(MIN_FORKS, min(host_count, FORKS_PER_CPU * cpu_count))
+
+    # SSH arguments are only set if configured, so that they do not
+    # override those of the user
+    ssh_connection = {k: overrides[k] for k in ['ssh_args', 'control_path_dir']
+                      if k in overrides}
+
+    return {
+        'defaults': {
+            'forks': overrides.get('forks', forks),
+            'strategy': overrides.get('strategy', 'linear'),
+        },
+        'ssh_connection': dict(
+            pipelining=overrides.get('pipelining', True), **ssh_connection),
+    }
+
+
+def write(env_dir: Path, settings: Settings) -> Path:
+    'Writes `settings` in the ansible.cfg of `env_dir`'
+    parser = configparser.ConfigParser()
+    parser.read_dict({section: {k: str(v) for k, v in values.items()}
+                      for section, values in settings.items()})
+    path = Path(env_dir) / ANSIBLE_CFG
+    with open(path, 'w') as cfg:
+        parser.write(cfg)
+    return path
+
+
+def apply(env_dir: Path):
+    '''Uses the settings of the ansible.cfg of `env_dir` (if any) in this
+    process and its subprocesses
+
+    Only the settings of the file are exported, not the file itself
+    (`ANSIBLE_CONFIG`), so that the ansible.cfg of the user still applies.
+    '''
+    path = Path(env_dir) / ANSIBLE_CFG
+    if not path.is_file():
+        return
+
+    parser = configparser.ConfigParser()
+    parser.read(path)
+    for (section, key), var in _ENV_VARS.items():
+        if parser.has_option(section, key):
+            os.environ[var] = parser.get(section, key)
+
+    # Ansible reads its constants at import time
+    if parser.has_option('defaults', 'strategy'):
+        ansible_constants.DEFAULT_STRATEGY = parser.get('defaults', 'strategy')
+    if parser.has_option('defaults', 'forks'):
+        ansible_constants.DEFAULT_FORKS = parser.getint('defaults', 'forks')
+    LOGGER.debug(f'Use the Ansible configuration {path}')
@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+'''On-disk cache of testbed API lookups.
+
+Lookups such as the network interfaces of a Grid'5000 cluster almost never
+change, but querying the API costs a few seconds on each `enos up` or `enos
+destroy`.  This module caches them in `C.CACHE_DIR/api/<namespace>/<key>.json`
+for a time to live (see `C.API_CACHE_TTL`).  Use `enos cache` to inspect or
+purge the cache.
+
+'''
+import json
+import logging
+import os
+import shutil
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, NamedTuple, Optional
+
+import enos.utils.constants as C
+
+LOGGER = logging.getLogger(__name__)
+
+CacheEntry = NamedTuple('CacheEntry', [('namespace', str),
+                                       ('key', str),
+                                       ('age', float)])
+
+
+def cache_dir() -> Path:
+    'Directory of the cache'
+    return Path(C.CACHE_DIR) / 'api'
+
+
+def cached_lookup(namespace: str,
+                  keys: Iterable[str],
+                  fetch: Callable[[List[str]], Dict[str, Any]],
+                  ttl: Optional[int] = None) -> Dict[str, Any]:
+    '''Returns the value of each key of `keys`, from the cache if possible.
+
+    Args:
+        namespace: Name of the lookup (e.g., 'g5k-sites').
+        keys: Keys to look up (e.g., cluster names).
+        fetch: Function that queries the API for a list of keys missing in
+          the cache and returns a dict {key: JSON serializable value}.
+        ttl: Time to live of the cached values, in seconds.  Defaults to
+          `C.API_CACHE_TTL`.  Zero disables the cache.
+
+    '''
+    ttl = C.API_CACHE_TTL if ttl is None else ttl
+    values, missing = {}, []
+    for key in keys:
+        value = _read(namespace, key, ttl)
+        if value is None:
+            missing.append(key)
+        else:
+            values[key] = value
+
+    if missing:
+        LOGGER.debug(f'Fetch {namespace} of {missing} (not in the cache)')
+        fetched = fetch(missing)
+        for key, value in fetched.items():
+            _write(namespace, key, value)
+        values.update(fetched)
+
+    return values
+
+
+def entries() -> List[CacheEntry]:
+    'Lists the entries of the cache'
+    now = time.time()
+    return [CacheEntry(path.parent.name, path.stem, now - path.stat().st_mtime)
+            for path in sorted(cache_dir().glob('*/*.json'))]
+
+
+def purge():
+    'Removes all the entries of the cache'
+    shutil.rmtree(cache_dir(), ignore_errors=True)
+
+
+# Utils
+
+def _path(namespace: str, key: str) -> Path:
+    return cache_dir() / namespace / f'{key}.json'
+
+
+def _read(namespace: str, key: str, ttl: int) -> Optional[Any]:
+    'Value of the entry or None if it is missing, expired or unreadable'
+    path = _path(namespace, key)
+    try:
+        if time.time() - path.stat().st_mtime >= ttl:
+            return None
+        with open(path) as entry:
+            return json.load(entry)
+    except (OSError, ValueError):
+        return None
+
+
+def _write(namespace: str, key: str, value: Any):
+    'Atomically write the entry (concurrent commands may read it)'
+    path = _path(namespace, key)
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_suffix(f'.{os.getpid()}.tmp')
+        with open(tmp_path, 'w') as entry:
+            json.dump(value, entry)
+        os.replace(tmp_path, path)
+    except OSError as err:
+        # The cache is an optimization, never fail because of it
+        LOGGER.warning(f'Cannot cache {namespace} of {key}: {err}')
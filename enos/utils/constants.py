@@ -16,6 +16,28 @@ SYMLINK_NAME = os.path.abspath(os.path.join(os.getcwd(), 'current'))
 TEMPLATE_DIR = os.path.join(ENOS_PATH, 'templates')
 ANSIBLE_DIR = os.path.join(ENOS_PATH, 'ansible')
 
+# User-level directory for data that enos shares between environments (e.g.,
+# the socket of `enos serve`).  Honor `ENOS_CACHE_DIR` and then the XDG spec.
+CACHE_DIR = os.environ.get('ENOS_CACHE_DIR') or os.path.join(
+  os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache'), 'enos')
+
+# Unix socket of the `enos serve` daemon.  Set `ENOS_SOCKET` to an empty value
+# to never delegate commands to the daemon.
+DAEMON_SOCKET = os.environ.get('ENOS_SOCKET',
+                               os.path.join(CACHE_DIR, 'enos.sock'))
+
+# Directory of wheels to install kolla-ansible and its dependencies from,
+# without network access (e.g., filled with `pip wheel -w <dir> ...`)
+WHEELHOUSE = os.environ.get('ENOS_WHEELHOUSE')
+
+# Time to live (in seconds) of cached testbed API lookups, e.g., Grid'5000
+# cluster descriptions.  Defaults to one week.
+API_CACHE_TTL = int(os.environ.get('ENOS_API_CACHE_TTL', 7 * 24 * 3600))
+
+# Time to live (in seconds) of cached Ansible facts of hosts.  Defaults to
+# one day, zero disables the cache.
+FACTS_CACHE_TTL = int(os.environ.get('ENOS_FACTS_CACHE_TTL', 24 * 3600))
+
 # KOLLA_NETWORKS (some of them)
 #
 # See,
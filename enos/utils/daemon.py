@@ -0,0 +1,324 @@
+# -*- coding: utf-8 -*-
+'''Run enos commands from a long-lived local daemon.
+
+`enos serve` starts a daemon that imports enoslib, Ansible and the enos tasks
+once, and then listens on a Unix socket.  Any other `enos <command>` that finds
+the socket acts as a thin client: it sends its arguments, working directory and
+environment variables together with its stdin/stdout/stderr file descriptors,
+and waits for the exit code of the command.
+
+The daemon forks a child per request.  Hence, commands run isolated from each
+other (working directory, logging configuration, `sys.exit` ...) but start with
+all heavy modules already in memory.  The daemon also keeps the last enos
+environments it has seen loaded: before forking, it (re)loads the environment
+targeted by the command if it changed on disk, so that the child inherits it
+instead of unpickling it again.
+
+This module only relies on the standard library, so that the client side does
+not pay for any import.
+
+'''
+import array
+import json
+import logging
+import os
+import signal
+import socket
+import struct
+import sys
+import traceback
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+LOGGER = logging.getLogger(__name__)
+
+# Messages are JSON documents prefixed with their length
+_HEADER = struct.Struct('!I')
+
+# The client sends its stdin, stdout and stderr
+_NB_FDS = 3
+
+# Loaded environments indexed by their directory, least recently used first.
+# Entries also store the identity of the environment files to detect stale
+# environments.
+_ENVS: 'OrderedDict[Path, Tuple[Any, Any]]' = OrderedDict()
+
+# Number of loaded environments to keep (`enos up` opens a new environment
+# directory each time, former ones are rarely used again)
+_MAX_ENVS = 3
+
+
+# Client
+
+def is_running(socket_path: str) -> bool:
+    'Test whether a daemon listens on `socket_path`'
+    if not socket_path or not os.path.exists(socket_path):
+        return False
+
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        try:
+            sock.connect(socket_path)
+        except OSError:
+            return False
+        else:
+            return True
+
+
+def call(socket_path: str, argv: List[str]) -> int:
+    '''Execute `enos <argv>` through the daemon and return its exit code.
+
+    The command runs in the current working directory, with the current
+    environment variables, and outputs on the current stdout/stderr.  A Ctrl-C
+    on the client interrupts the command on the daemon side.
+
+    '''
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(socket_path)
+        _send_msg(sock, {'argv': argv,
+                         'cwd': os.getcwd(),
+                         'environ': dict(os.environ)},
+                  fds=[sys.stdin.fileno(),
+                       sys.stdout.fileno(),
+                       sys.stderr.fileno()])
+
+        pid = None
+        while True:
+            try:
+                msg, _ = _recv_msg(sock)
+            except KeyboardInterrupt:
+                # Forward the interruption to the command (and its children)
+                if pid is not None:
+                    os.killpg(pid, signal.SIGINT)
+                continue
+
+            if msg is None:
+                LOGGER.error('The enos daemon closed the connection')
+                return 1
+            if 'pid' in msg:
+                pid = msg['pid']
+            if 'exit' in msg:
+                return msg['exit']
+
+
+# Server
+
+def serve(socket_path: str,
+          run: Callable[[List[str]], None],
+          preload: Callable[[Dict[str, Any]], None]):
+    '''Listen on `socket_path` and execute requests of clients.
+
+    Args:
+        socket_path: Path of the Unix socket to listen on.
+        run: Function that executes a command (as a list of arguments) in the
+          child process.  The child exits with the code of `SystemExit` if
+          any, 0 otherwise.
+        preload: Function called by the daemon with the request before it
+          forks.  Anything it loads is inherited by the child.
+
+    Raises:
+        FileExistsError: if a daemon already listens on `socket_path`.
+    '''
+    if is_running(socket_path):
+        raise FileExistsError(socket_path)
+
+    path = Path(socket_path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    if path.exists():
+        # Stale socket of a daemon that did not stop properly
+        path.unlink()
+
+    # Reap children as soon as they end, and stop nicely on SIGTERM
+    signal.signal(signal.SIGCHLD, _reap_children)
+    signal.signal(signal.SIGTERM, _terminate)
+
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as server:
+        server.bind(socket_path)
+        path.chmod(0o600)
+        server.listen()
+        LOGGER.info(f'enos daemon listening on {socket_path}')
+
+        try:
+            while True:
+                conn, _ = server.accept()
+                with conn:
+                    _handle(conn, run, preload)
+        finally:
+            path.unlink()
+            signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+
+
+def load_env(env_dir: Path):
+    '''Returns the enos environment stored at `env_dir`.
+
+    The environment is loaded from the disk only if it is not already in
+    memory or if its files changed since it has been loaded.  Only the last
+    `_MAX_ENVS` environments stay in memory.
+
+    Raises:
+        EnosFilePathError: if there is no environment at `env_dir`.
+    '''
+    from enos.utils import store
+
+    env_dir = Path(env_dir).resolve()
+    env_id = store.env_id(env_dir)
+    if env_dir in _ENVS and _ENVS[env_dir][0] == env_id:
+        LOGGER.debug(f'Reuse loaded environment {env_dir}')
+        _ENVS.move_to_end(env_dir)
+        return _ENVS[env_dir][1]
+
+    # Drop the stale environment before loading the new one
+    _ENVS.pop(env_dir, None)
+    env = store.JournaledEnvironment.load(env_dir)
+    _ENVS[env_dir] = (env_id, env)
+    while len(_ENVS) > _MAX_ENVS:
+        evicted, _ = _ENVS.popitem(last=False)
+        LOGGER.debug(f'Forget loaded environment {evicted}')
+    return env
+
+
+def _handle(conn: socket.socket,
+            run: Callable[[List[str]], None],
+            preload: Callable[[Dict[str, Any]], None]):
+    'Fork a child that executes the request of the client on `conn`'
+    request, fds = _recv_msg(conn)
+
+    try:
+        if request is None:
+            # A client checking whether the daemon runs
+            return
+        if len(fds) != _NB_FDS:
+            LOGGER.error(f'Ignore malformed request {request} (fds={fds})')
+            return
+
+        LOGGER.info(f'Execute `enos {" ".join(request["argv"])}` '
+                    f'in {request["cwd"]}')
+        try:
+            preload(request)
+        except Exception as err:
+            # The child will load whatever it needs by itself
+            LOGGER.debug(f'Preloading failed with {err!r}')
+
+        if os.fork() == 0:
+            os._exit(_run_child(conn, request, fds, run))
+
+    finally:
+        # Only the child keeps the standard streams of the client
+        for fd in fds:
+            os.close(fd)
+
+
+def _run_child(conn: socket.socket,
+               request: Dict[str, Any],
+               fds: List[int],
+               run: Callable[[List[str]], None]) -> int:
+    'Execute the `request` in the child process and return the exit code'
+    signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+
+    # New process group, so that the client can interrupt the command and the
+    # processes it spawned without killing the daemon
+    os.setsid()
+
+    # Takes the standard streams of the client
+    sys.stdout.flush()
+    sys.stderr.flush()
+    for std_fd, client_fd in enumerate(fds):
+        os.dup2(client_fd, std_fd)
+        os.close(client_fd)
+
+    os.chdir(request['cwd'])
+    os.environ.clear()
+    os.environ.update(request['environ'])
+
+    code = 0
+    try:
+        _send_msg(conn, {'pid': os.getpid()})
+        run(request['argv'])
+    except SystemExit as exc:
+        if exc.code is None:
+            code = 0
+        elif isinstance(exc.code, int):
+            code = exc.code
+        else:
+            print(exc.code, file=sys.stderr)
+            code = 1
+    except KeyboardInterrupt:
+        code = 130
+    except BaseException:
+        traceback.print_exc()
+        code = 1
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+
+    try:
+        _send_msg(conn, {'exit': code})
+    except OSError:
+        # The client is gone
+        pass
+
+    return code
+
+
+def _reap_children(signum, frame):
+    'Collect the exit status of ended children (SIGCHLD handler)'
+    try:
+        while os.waitpid(-1, os.WNOHANG)[0] > 0:
+            pass
+    except ChildProcessError:
+        pass
+
+
+def _terminate(signum, frame):
+    'Stop the daemon (SIGTERM handler)'
+    raise KeyboardInterrupt()
+
+
+# Wire protocol
+
+def _send_msg(sock: socket.socket, msg: Dict[str, Any], fds: List[int] = []):
+    'Send `msg` on `sock`, and `fds` along the first bytes'
+    payload = json.dumps(msg).encode('utf-8')
+    data = _HEADER.pack(len(payload)) + payload
+
+    ancdata = []
+    if fds:
+        ancdata = [(socket.SOL_SOCKET, socket.SCM_RIGHTS,
+                    array.array('i', fds).tobytes())]
+
+    sent = sock.sendmsg([data], ancdata)
+    sock.sendall(data[sent:])
+
+
+def _recv_msg(
+        sock: socket.socket) -> Tuple[Optional[Dict[str, Any]], List[int]]:
+    'Receive a message and file descriptors if any.  None on EOF.'
+    fds = array.array('i')
+    data, ancdata, _, _ = sock.recvmsg(
+        _HEADER.size, socket.CMSG_LEN(_NB_FDS * fds.itemsize))
+
+    for level, kind, cdata in ancdata:
+        if level == socket.SOL_SOCKET and kind == socket.SCM_RIGHTS:
+            fds.frombytes(cdata[:len(cdata) - (len(cdata) % fds.itemsize)])
+
+    if not data:
+        return None, list(fds)
+
+    header = data + _recv_exactly(sock, _HEADER.size - len(data))
+    (length,) = _HEADER.unpack(header)
+    payload = _recv_exactly(sock, length)
+    return json.loads(payload.decode('utf-8')), list(fds)
+
+
+def _recv_exactly(sock: socket.socket, size: int) -> bytes:
+    'Receive exactly `size` bytes from `sock`'
+    chunks = []
+    while size > 0:
+        chunk = sock.recv(size)
+        if not chunk:
+            raise ConnectionError('Connection closed in the middle of a message')
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b''.join(chunks)
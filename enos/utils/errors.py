@@ -36,3 +36,20 @@ class MissingEnvState(EnosError):
             f"The key '{key}' does not appears in the enos environment.")
 
         self.key = key
+
+
+class EnosUnknownStep(EnosError):
+    def __init__(self, step_name, step_names):
+        super(EnosUnknownStep, self).__init__(
+            f"The step '{step_name}' could not be found.  "
+            f"Known steps are: {', '.join(step_names)}.")
+
+        self.step_name = step_name
+
+
+class EnosCannotScale(EnosError):
+    def __init__(self, reason):
+        super(EnosCannotScale, self).__init__(
+            f"Cannot scale the deployment: {reason}")
+
+        self.reason = reason
@@ -3,15 +3,16 @@ import importlib
 import logging
 import os
 import re
-from typing import Dict, Union, Any, Callable, Iterable
+from typing import Dict, Union, Any, Callable, Tuple
 
 from enos.provider.provider import Provider
 import enos.utils.constants as C
-from enos.utils.errors import (EnosFilePathError,
+from enos.utils.errors import (EnosCannotScale,
+                               EnosFilePathError,
                                EnosUnknownProvider,
                                MissingEnvState)
+from enos.utils.inventory import Inventory
 import enoslib as elib
-import enoslib.api as elib_api
 
 # These roles are mandatory for the
 # the original inventory to be valid
@@ -26,37 +27,21 @@ KOLLA_MANDATORY_GROUPS = [
 ]
 
 
-def generate_inventory(roles, networks, base_inventory, dest):
+def generate_inventory(roles, networks, base_inventory, dest) -> Inventory:
     """
     Generate the inventory.
     It will generate a group for each role in roles and
-    concatenate them with the base_inventory file.
-    The generated inventory is written in dest
+    merge them with the groups of the base_inventory file.
+    The generated inventory is written in dest and returned
     """
     provider_net = lookup_network(networks, [C.NEUTRON_EXTERNAL_INTERFACE])
     if not provider_net:
         msg = f"The {C.NEUTRON_EXTERNAL_INTERFACE} network is missing"
         raise ValueError(msg)
 
-    elib_api.generate_inventory(
-        roles,
-        networks,
-        dest,
-        check_networks=False)
-
-    with open(dest, 'a') as f:
-        f.write("\n")
-        # generate mandatory groups that are empty
-        mandatory = [group for group in KOLLA_MANDATORY_GROUPS
-                     if group not in roles.keys()]
-        for group in mandatory:
-            f.write("[%s]\n" % group)
-
-        with open(base_inventory, 'r') as a:
-            for line in a:
-                f.write(line)
-
-    logging.info("Inventory file written to " + dest)
+    inventory = Inventory(roles, base_inventory, KOLLA_MANDATORY_GROUPS)
+    inventory.write(dest)
+    return inventory
 
 
 def lookup_network(networks, roles):
@@ -69,6 +54,70 @@ def lookup_network(networks, roles):
     return None
 
 
+def index_interfaces(roles) -> Dict[str, Dict[str, Tuple[int, str]]]:
+    """Index the network interfaces of hosts by network.
+
+    Built once from the facts of hosts (see `elib.sync_info`), the index maps
+    the CIDR of each enoslib network to the hosts attached to it, and for
+    each host, to its interface on that network along with the position of
+    the device on the host (first devices win, as in
+    `Host.filter_interfaces`).
+    """
+    index: Dict[str, Dict[str, Tuple[int, str]]] = {}
+    for host in roles.all():
+        for position, device in enumerate(host.net_devices):
+            if not device.interfaces:
+                continue
+            for address in device.addresses:
+                if address.network is None:
+                    continue
+                by_host = index.setdefault(str(address.network.network), {})
+                known = by_host.get(host.alias)
+                if known is None or known[0] > position:
+                    by_host[host.alias] = (position, device.interfaces[0])
+    return index
+
+
+def set_network_interfaces(roles, networks, network_names):
+    """Set the interface of each host for the given network roles.
+
+    For instance, with the `network_interface` name, each host gets a
+    `network_interface` extra variable with its interface on the network of
+    this role.  Kolla then finds it in the inventory.
+
+    Raises ValueError if a host has no interface on the `network_interface`
+    network (kolla requires it on every host).  Hosts missing another
+    interface are only reported.
+    """
+    index = index_interfaces(roles)
+    hosts = roles.all()
+
+    for network_name in network_names:
+        if not networks.get(network_name):
+            continue
+
+        # Interface of each host on any network of the role
+        interfaces: Dict[str, Tuple[int, str]] = {}
+        for network in networks[network_name]:
+            for alias, itf in index.get(str(network.network), {}).items():
+                if alias not in interfaces or interfaces[alias][0] > itf[0]:
+                    interfaces[alias] = itf
+
+        missing = []
+        for host in hosts:
+            if host.alias in interfaces:
+                host.set_extra(**{network_name: interfaces[host.alias][1]})
+            else:
+                missing.append(host.alias)
+
+        if missing and network_name == C.NETWORK_INTERFACE:
+            raise ValueError(f"Hosts {missing} have no interface on the "
+                             f"{network_name} network")
+        if missing:
+            logging.warning(f"Hosts {missing} have no interface on the "
+                            f"{network_name} network")
+
+
 def get_vip_pool(networks):
     """Get the provider net where vip can be taken.
     In kolla-ansible this is the network with the api_interface role.
@@ -84,14 +133,6 @@ def get_vip_pool(networks):
     raise Exception(msg)
 
 
-def ip_generator(provider_net) -> Iterable[str]:
-    """Iterator that picks successive IP addresses from the provider_net.
-    """
-    # This is an iterator that returns ipaddress.IPv4Address objects
-    for ip in provider_net.free_ips:
-        yield str(ip)
-
-
 def make_provider(provider_conf: Union[str, Dict[str, Any]]) -> Provider:
     """Instantiates the provider.
 
@@ -139,6 +180,22 @@ def gen_enoslib_roles(resources_or_topology):
                        "number": v2}
 
 
+def add_resources(resources: Dict[str, Any],
+                  role: str, count: int) -> Dict[str, Any]:
+    """Returns a copy of `resources` with `count` more hosts of `role`.
+
+    The hosts go to the first flavor (e.g., cluster) that has the role.
+    Raises EnosCannotScale if no flavor has it.
+    """
+    resources = {flavor: dict(roles) for flavor, roles in resources.items()}
+    for roles in resources.values():
+        if isinstance(roles.get(role), int):
+            roles[role] += count
+            return resources
+
+    raise EnosCannotScale(f"no resources with the role '{role}'")
+
+
 def expand_groups(grp):
     """Expand group names.
 
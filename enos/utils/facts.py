@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+'''Ansible fact cache of an environment.
+
+Each play of enos (e.g., `elib.sync_info`, the baremetal play of `enos up`,
+`enos.yml`, `init_os.yml`) gathers facts again, which costs about a minute
+per play on hundreds of hosts.  `enable_fact_cache` makes Ansible store facts
+in `<env dir>/facts` (jsonfile cache plugin) and only gather facts of hosts
+that are not in the cache ("smart" gathering).  Facts expire after
+`C.FACTS_CACHE_TTL`, or on `enos facts --refresh`.
+
+Smart gathering only applies to the implicit gathering of plays.  Enoslib
+plays gather explicitly (`setup` task), so enos plays gather with a `setup`
+task conditioned by `NOT_CACHED` instead, and `elib.sync_info` is skipped for
+hosts with cached facts (see `cached_facts`).
+
+The configuration is set in the process (Ansible constants are read at
+import time) and in the environment variables for kolla-ansible
+subprocesses.
+
+'''
+import json
+import logging
+import os
+import shutil
+import time
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional
+
+from ansible import constants as ansible_constants
+
+import enos.utils.constants as C
+
+LOGGER = logging.getLogger(__name__)
+
+# Directory of the cache (in the environment directory)
+FACTS_DIR = 'facts'
+
+# Condition of a `setup` task that only gathers facts of hosts that are not
+# in the cache (cached facts are loaded in the variables of hosts)
+NOT_CACHED = 'ansible_hostname is not defined'
+
+FactsEntry = NamedTuple('FactsEntry', [('host', str), ('age', float)])
+
+
+def fact_cache_dir(env_dir: Path) -> Path:
+    return Path(env_dir) / FACTS_DIR
+
+
+def enable_fact_cache(env_dir: Path, ttl: Optional[int] = None):
+    '''Caches Ansible facts in `env_dir` for `ttl` seconds
+
+    Args:
+        env_dir: The environment directory.
+        ttl: Time to live of facts, in seconds.  Defaults to
+          `C.FACTS_CACHE_TTL`.  Zero disables the cache.
+    '''
+    ttl = C.FACTS_CACHE_TTL if ttl is None else ttl
+    if ttl <= 0:
+        return
+
+    cache_dir = str(fact_cache_dir(env_dir).resolve())
+    ansible_constants.CACHE_PLUGIN = 'jsonfile'
+    ansible_constants.CACHE_PLUGIN_CONNECTION = cache_dir
+    ansible_constants.CACHE_PLUGIN_TIMEOUT = ttl
+    ansible_constants.DEFAULT_GATHERING = 'smart'
+    os.environ.update({
+        'ANSIBLE_CACHE_PLUGIN': 'jsonfile',
+        'ANSIBLE_CACHE_PLUGIN_CONNECTION': cache_dir,
+        'ANSIBLE_CACHE_PLUGIN_TIMEOUT': str(ttl),
+        'ANSIBLE_GATHERING': 'smart',
+    })
+    LOGGER.debug(f'Cache Ansible facts in {cache_dir} for {ttl} seconds')
+
+
+def entries(env_dir: Path) -> List[FactsEntry]:
+    'Lists the hosts with facts in the cache'
+    now = time.time()
+    return [FactsEntry(path.name, now - path.stat().st_mtime)
+            for path in sorted(fact_cache_dir(env_dir).glob('*'))]
+
+
+def cached_facts(env_dir: Path,
+                 hosts: Iterable[str],
+                 ttl: Optional[int] = None) -> Dict[str, Dict[str, Any]]:
+    '''Returns the facts of `hosts` that are in the cache and not expired
+
+    Facts are the `ansible_*` variables of a host, as `elib.sync_info` reads
+    them.  `ttl` defaults to `C.FACTS_CACHE_TTL`.
+    '''
+    ttl = C.FACTS_CACHE_TTL if ttl is None else ttl
+    ages = {e.host: e.age for e in entries(env_dir)}
+    facts = {}
+    for host in hosts:
+        if ages.get(host, ttl) < ttl:
+            try:
+                with open(fact_cache_dir(env_dir) / host) as facts_file:
+                    facts[host] = json.load(facts_file)
+            except (OSError, ValueError):
+                pass
+    return facts
+
+
+def refresh(env_dir: Path):
+    'Forgets cached facts, so that the next plays gather them again'
+    shutil.rmtree(fact_cache_dir(env_dir), ignore_errors=True)
@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+"Deterministic digests of enos inputs (configuration, files ...)"
+import hashlib
+import json
+from pathlib import Path
+from typing import Any
+
+
+def fingerprint(*values: Any) -> str:
+    '''Returns a digest of `values`.
+
+    Values are anything that can be represented in JSON (dict, list, str ...)
+    and `pathlib.Path`.  A Path contributes with the content of the file it
+    points to (or a marker if the file does not exist), so that the digest
+    changes whenever the file changes.
+
+    '''
+    h = hashlib.sha256()
+    for value in values:
+        if isinstance(value, Path):
+            h.update(b'file:')
+            h.update(value.read_bytes() if value.is_file() else b'<missing>')
+        else:
+            h.update(b'json:')
+            h.update(json.dumps(value, sort_keys=True, default=str)
+                     .encode('utf-8'))
+        h.update(b'\0')
+
+    return h.hexdigest()
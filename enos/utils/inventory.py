@@ -0,0 +1,213 @@
+# -*- coding: utf-8 -*-
+'''In-memory kolla inventory.
+
+The kolla inventory is made of the enoslib roles (a group per role with its
+hosts and their variables) and the kolla group tree of the base inventory
+(e.g., `inventory.sample`).  `Inventory` merges both in memory, indexes
+groups to hosts and hosts to groups, and serializes to the INI format only
+once.  This avoids writing the inventory and then re-parsing it with Ansible
+to find the hosts of each group.
+
+'''
+import logging
+import re
+from typing import Any, Dict, Iterable, List, Mapping, Optional, Set
+
+import enoslib as elib
+
+LOGGER = logging.getLogger(__name__)
+
+# Section header of an INI inventory, e.g., `[name]` or `[name:children]`
+_SECTION_RE = re.compile(r'^\[(?P<name>[^:\]]+)(:(?P<kind>\w+))?\]')
+
+
+class Inventory(object):
+    '''Inventory of enoslib roles merged with a kolla group tree.
+
+    Build it with `Inventory(roles, base_inventory)`, then:
+    - `group_hosts` and `host_groups` are the indexes group -> host names
+      and host name -> groups (including groups of groups);
+    - `to_roles` returns the enoslib Roles of all groups;
+    - `to_ini`/`write` serializes the inventory.
+
+    '''
+
+    # Enoslib hosts by name, in order of appearance in roles
+    hosts: Dict[str, elib.Host]
+
+    # Host names listed in each group (not including children groups)
+    _group_members: Dict[str, List[str]]
+
+    # Children of each group
+    _group_children: Dict[str, List[str]]
+
+    def __init__(self,
+                 roles: Mapping[str, Iterable[elib.Host]],
+                 base_inventory: Optional[str] = None,
+                 mandatory_groups: Iterable[str] = ()):
+        '''
+        Args:
+            roles: Enoslib roles (role -> list of Host).
+            base_inventory: Path to a base inventory in the INI format
+              that defines the group tree (e.g., `inventory.sample`).
+            mandatory_groups: Groups that must be in the inventory, even
+              empty (e.g., kolla expects a `storage` group).
+        '''
+        self._roles = roles
+        self.hosts = {}
+        self._group_members = {}
+        self._group_children = {}
+        self._base_text = ''
+
+        for role, role_hosts in roles.items():
+            members = self._group_members.setdefault(role, [])
+            for host in role_hosts:
+                self.hosts.setdefault(host.alias, host)
+                members.append(host.alias)
+
+        self._mandatory_groups = list(mandatory_groups)
+        for group in self._mandatory_groups:
+            self._group_members.setdefault(group, [])
+
+        if base_inventory is not None:
+            with open(base_inventory) as base:
+                self._base_text = base.read()
+            self._parse(self._base_text)
+
+        self._index()
+
+    def _parse(self, text: str):
+        'Add the groups of an INI inventory to the group tree'
+        section, kind = None, None
+        for line in text.splitlines():
+            line = line.strip()
+            if not line or line.startswith(('#', ';')):
+                continue
+
+            header = _SECTION_RE.match(line)
+            if header:
+                section, kind = header.group('name'), header.group('kind')
+                if kind == 'children':
+                    self._group_children.setdefault(section, [])
+                elif kind is None:
+                    self._group_members.setdefault(section, [])
+                continue
+
+            # First token is a host or a child group, the rest are variables
+            name = line.split()[0]
+            if section is None or kind is None:
+                self._group_members.setdefault(section or 'ungrouped', [])
+                self._group_members[section or 'ungrouped'].append(name)
+            elif kind == 'children':
+                self._group_children[section].append(name)
+                self._group_members.setdefault(name, [])
+
+    def _index(self):
+        'Compute group -> hosts and host -> groups indexes'
+        groups = list(self._group_members) + [
+            g for g in self._group_children if g not in self._group_members]
+
+        self.group_hosts: Dict[str, List[str]] = {}
+        for group in groups:
+            self._resolve(group, set())
+        self.group_hosts['all'] = list(self.hosts)
+
+        self.host_groups: Dict[str, Set[str]] = {h: set() for h in self.hosts}
+        for group, hostnames in self.group_hosts.items():
+            for hostname in hostnames:
+                self.host_groups.setdefault(hostname, set()).add(group)
+
+    def _resolve(self, group: str, visiting: Set[str]) -> List[str]:
+        'Hosts of `group` and of its children (memoized)'
+        if group in self.group_hosts:
+            return self.group_hosts[group]
+        if group in visiting:
+            LOGGER.warning(f'Cycle in the inventory with group {group}')
+            return []
+
+        visiting.add(group)
+        hostnames = dict.fromkeys(self._group_members.get(group, []))
+        for child in self._group_children.get(group, []):
+            hostnames.update(dict.fromkeys(self._resolve(child, visiting)))
+        visiting.discard(group)
+
+        self.group_hosts[group] = list(hostnames)
+        return self.group_hosts[group]
+
+    def to_roles(self) -> elib.Roles:
+        '''Returns the roles with a role for each group of the inventory
+
+        In enos, we have a strong binding between enoslib roles and
+        kolla-ansible groups.  We need for instance to know hosts of the
+        'enos/registry' group.
+        '''
+        roles = self._roles.copy()
+        for group, hostnames in self.group_hosts.items():
+            roles.update({group: [self.hosts[h] for h in hostnames
+                                  if h in self.hosts]})
+        return roles
+
+    def to_ini(self) -> str:
+        'Serializes the inventory in the INI format'
+        lines = []
+        host_lines: Dict[str, str] = {}
+        for role, role_hosts in self._roles.items():
+            lines.append(f'[{role}]')
+            for host in role_hosts:
+                if host.alias not in host_lines:
+                    host_lines[host.alias] = _host_line(host)
+                lines.append(host_lines[host.alias])
+
+        # Generate mandatory groups that are empty
+        lines.append('')
+        lines.extend(f'[{group}]' for group in self._mandatory_groups
+                     if group not in self._roles)
+
+        return '\n'.join(lines) + '\n' + self._base_text
+
+    def write(self, dest: str):
+        'Writes the inventory in the INI format at `dest`'
+        with open(dest, 'w') as inventory:
+            inventory.write(self.to_ini())
+        LOGGER.info(f'Inventory file written to {dest}')
+
+
+# Utils
+
+def _host_line(host: elib.Host) -> str:
+    'Line of `host` with its variables in an INI inventory (as enoslib does)'
+    host_vars: Dict[str, Any] = {'ansible_host': host.address}
+    if host.user is not None:
+        host_vars['ansible_ssh_user'] = host.user
+    if host.port is not None:
+        host_vars['ansible_port'] = host.port
+    if host.keyfile is not None:
+        host_vars['ansible_ssh_private_key_file'] = host.keyfile
+
+    common_args = ['-o StrictHostKeyChecking=no',
+                   '-o UserKnownHostsFile=/dev/null']
+    if host.extra.get('forward_agent', False):
+        common_args.append('-o ForwardAgent=yes')
+    gateway = host.extra.get('gateway')
+    if gateway is not None:
+        proxy_cmd = ['ssh -W %h:%p',
+                     '-o StrictHostKeyChecking=no',
+                     '-o UserKnownHostsFile=/dev/null']
+        gateway_user = host.extra.get('gateway_user', host.user)
+        if gateway_user is not None:
+            proxy_cmd.append(f'-l {gateway_user}')
+        proxy_cmd.append(gateway)
+        common_args.append(f'-o ProxyCommand="{" ".join(proxy_cmd)}"')
+    host_vars['ansible_ssh_common_args'] = ' '.join(common_args)
+
+    host_vars.update({k: v for k, v in host.extra.items()
+                      if k not in ['gateway', 'gateway_user',
+                                   'forward_agent']})
+
+    def to_ini_value(value: Any) -> str:
+        if isinstance(value, list):
+            return '"[%s]"' % ','.join(f"'{v}'" for v in value)
+        return f"'{value}'"
+
+    return ' '.join([host.alias] + sorted(
+        f'{k}={to_ini_value(v)}' for k, v in host_vars.items()))
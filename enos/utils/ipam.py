@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+'''Allocation of IP addresses (e.g., VIPs) in the pool of a network.
+
+The allocator is stored in the env (under `ipam`).  It records named
+reservations so that a name (e.g., 'vip') always gets the same address, and
+addresses already in use on the testbed (see `addresses_in_use`) are never
+handed out.
+
+'''
+import ipaddress
+import logging
+from typing import Dict, Iterable, List, Set
+
+import enoslib as elib
+
+LOGGER = logging.getLogger(__name__)
+
+# Owner of an address in use by something else than a reservation
+_IN_USE = ''
+
+
+class IPAllocator(object):
+    '''Allocates addresses of a pool to named reservations.
+
+    Allocations and releases are O(1): addresses are taken from a cursor on
+    the pool, or from the addresses previously released.
+
+    Example:
+
+    .. code-block:: python
+
+      ipam = IPAllocator('192.168.42.0/24', '192.168.42.10', '192.168.42.20')
+      ipam.allocate('vip')               # '192.168.42.10'
+      ipam.allocate_block('fips', 4)     # ['192.168.42.11', ... '.14']
+      ipam.allocate('vip')               # '192.168.42.10' again
+      ipam.release('fips')
+
+    '''
+
+    # CIDR of the network of the pool
+    network: str
+
+    # Reservations: name -> addresses
+    reservations: Dict[str, List[str]]
+
+    def __init__(self, network: str, start: str, end: str):
+        '''
+        Args:
+            network: CIDR of the network of the pool.
+            start: First address of the pool.
+            end: Address after the last address of the pool.
+        '''
+        self.network = str(ipaddress.ip_network(network))
+        self.reservations = {}
+        self._start = int(ipaddress.ip_address(start))
+        self._end = int(ipaddress.ip_address(end))
+        self._cursor = self._start
+        self._released: List[int] = []
+        self._owners: Dict[int, str] = {}
+
+    @classmethod
+    def from_network(cls, network) -> 'IPAllocator':
+        'Allocator for the pool of free IPs of an enoslib network'
+        if not network.has_free_ips:
+            raise ValueError(f'The network {network.network} has no pool of '
+                             'free IPs')
+        return cls(network.network, network.pool_start, network.pool_end)
+
+    def allocate(self, name: str) -> str:
+        'Returns the address reserved for `name`, allocates it if need be'
+        return self.allocate_block(name, 1)[0]
+
+    def allocate_block(self, name: str, count: int) -> List[str]:
+        '''Returns the `count` addresses reserved for `name`.
+
+        Addresses are allocated if `name` has no reservation yet.  A block
+        is made of successive addresses, except for a single address that
+        may reuse a released one.
+
+        Raises:
+            ValueError: if `name` has a reservation of another size, or the
+              pool is exhausted.
+        '''
+        if name in self.reservations:
+            if len(self.reservations[name]) != count:
+                raise ValueError(
+                    f'{name} already has {len(self.reservations[name])} '
+                    f'addresses, release it first')
+            return self.reservations[name]
+
+        addresses = None
+        while count == 1 and self._released and addresses is None:
+            address = self._released.pop()
+            if address not in self._owners:
+                addresses = [address]
+
+        if addresses is None:
+            addresses = self._take_block(count)
+
+        for address in addresses:
+            self._owners[address] = name
+        self.reservations[name] = [str(ipaddress.ip_address(a))
+                                   for a in addresses]
+        LOGGER.debug(f'Allocated {self.reservations[name]} to {name}')
+        return self.reservations[name]
+
+    def release(self, name: str):
+        'Releases the addresses reserved for `name` (if any)'
+        for address in self.reservations.pop(name, []):
+            address_int = int(ipaddress.ip_address(address))
+            del self._owners[address_int]
+            self._released.append(address_int)
+
+    def exclude(self, addresses: Iterable[str]):
+        '''Never allocate `addresses` (e.g., they are in use on the testbed).
+
+        Addresses already reserved are kept by their reservation.
+        '''
+        for address in addresses:
+            address_int = int(ipaddress.ip_address(address))
+            if self._start <= address_int < self._end:
+                self._owners.setdefault(address_int, _IN_USE)
+
+    def _take_block(self, count: int) -> List[int]:
+        '''Take `count` successive free addresses after the cursor
+
+        Free addresses the cursor moves past without a complete block are
+        released, so that single addresses can still take them.
+        '''
+        block: List[int] = []
+        while len(block) < count:
+            if self._cursor >= self._end:
+                self._released.extend(block)
+                raise ValueError(f'No more free addresses in the pool of '
+                                 f'{self.network}')
+            if self._cursor in self._owners:
+                self._released.extend(block)
+                block = []
+            else:
+                block.append(self._cursor)
+            self._cursor += 1
+        return block
+
+
+def addresses_in_use(roles: elib.Roles, arp: bool = False) -> Set[str]:
+    '''Returns the addresses in use on the testbed.
+
+    Addresses come from the facts of hosts (see `elib.sync_info`, i.e., `ip
+    addr` of hosts).  With `arp`, the neighbours of hosts (`ip neigh`) are
+    also queried to find addresses in use by machines outside of the
+    testbed.
+    '''
+    in_use = set()
+    for host in roles.all():
+        in_use.add(host.address)
+        for device in host.net_devices:
+            in_use.update(str(address.ip.ip) for address in device.addresses)
+
+    if arp:
+        results = elib.run_command('ip neigh show', roles=roles,
+                                   task_name='Get neighbours of hosts')
+        for result in results:
+            in_use.update(line.split()[0]
+                          for line in result.stdout.splitlines()
+                          if line.strip() and 'FAILED' not in line)
+
+    return in_use
@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+'''Timings and progress of an ansible-playbook run from its output.
+
+kolla-ansible runs ansible-playbook with the default callback, which prints
+play and task headers and then one line per host result, e.g.,
+
+.. code-block:: text
+
+  PLAY [Apply role nova] ************************************************
+  TASK [nova : Copying over config.json files for services] *************
+  changed: [paravance-1.rennes.grid5000.fr] => (item=nova-api)
+  ok: [paravance-2.rennes.grid5000.fr]
+
+`PlayLog` is fed with these lines as they come, and records the duration of
+each task on each host: from the task header to the last result of the host
+(the last item of a loop).  No callback plugin has to be installed in the
+kolla-ansible virtual environment, and verbose outputs (`-v`) parse the
+same.
+
+'''
+import json
+import logging
+import re
+import shutil
+import sys
+import time
+from collections import defaultdict
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Optional, TextIO, Tuple
+
+LOGGER = logging.getLogger(__name__)
+
+# Play, task and handler headers, e.g., "TASK [nova : Check ...] *****"
+HEADER_RE = re.compile(r'^(PLAY|TASK|RUNNING HANDLER) \[(.*)\] \*+\s*$')
+
+# End of the play, e.g., "PLAY RECAP *****"
+RECAP_RE = re.compile(r'^PLAY RECAP \*+\s*$')
+
+# Result of a host, e.g., "changed: [host -> localhost] => (item=...)"
+RESULT_RE = re.compile(
+    r'^(ok|changed|skipping|failed|fatal|unreachable): \[([^\]]+)\]')
+
+# Status of a host with many results (loop), the worst wins
+STATUS_RANK = ['skipping', 'ok', 'changed', 'failed', 'unreachable']
+
+TaskTiming = NamedTuple('TaskTiming', [('play', str),
+                                       ('task', str),
+                                       ('host', str),
+                                       ('status', str),
+                                       ('duration', float)])
+
+
+class PlayLog(object):
+
+    def __init__(self, progress: Optional['Progress'] = None):
+        '''Parse the output of ansible-playbook into `TaskTiming`s
+
+        Feed it with each line of the output (`feed`), then `close` it.
+        `timings` holds the timing of each completed task on each host and
+        `failures` the lines of failed results.
+
+        '''
+        self.progress = progress
+        self.timings: List[TaskTiming] = []
+        self.failures: List[str] = []
+        self.play = ''
+        self.task = ''
+        self._task_start = 0.0
+        # host -> (status, time of its last result)
+        self._results: Dict[str, Tuple[str, float]] = {}
+
+    @property
+    def started(self) -> bool:
+        'Whether the output reached the first play'
+        return bool(self.play)
+
+    def feed(self, line: str, now: Optional[float] = None):
+        now = time.time() if now is None else now
+        line = line.rstrip('\n')
+
+        header = HEADER_RE.match(line)
+        if header or RECAP_RE.match(line):
+            self._end_task()
+
+        if header and header.group(1) == 'PLAY':
+            self.play = header.group(2)
+            self.task = ''
+        elif header:
+            self.task = header.group(2)
+            self._task_start = now
+        elif RECAP_RE.match(line):
+            self.task = ''
+
+        result = RESULT_RE.match(line)
+        if result and self.task:
+            status = 'failed' if result.group(1) == 'fatal' else result.group(1)
+            if status in ['failed', 'unreachable']:
+                self.failures.append(line)
+            # Remove the delegation, e.g., "host -> localhost"
+            host = result.group(2).split(' -> ')[0]
+            former, _ = self._results.get(host, ('skipping', now))
+            self._results[host] = (max(status, former, key=STATUS_RANK.index),
+                                   now)
+
+        if self.progress and (header or result):
+            self.progress.update(self)
+
+    def close(self):
+        self._end_task()
+        if self.progress:
+            self.progress.close()
+
+    def hosts_done(self) -> int:
+        'Number of hosts with a result for the current task'
+        return len(self._results)
+
+    def _end_task(self):
+        for host, (status, end) in sorted(self._results.items()):
+            self.timings.append(TaskTiming(
+                self.play, self.task, host, status,
+                round(end - self._task_start, 3)))
+        self._results = {}
+
+
+class Progress(object):
+
+    def __init__(self, out: TextIO = sys.stderr):
+        '''Compact live view of a `PlayLog`
+
+        A terminal gets a single status line that is rewritten on each
+        update.  Otherwise, plays are logged as they start.
+
+        '''
+        self.out = out
+        self.is_tty = out.isatty()
+        self.start = time.time()
+        self._play = ''
+
+    def update(self, playlog: PlayLog):
+        if playlog.play != self._play:
+            self._play = playlog.play
+            if not self.is_tty:
+                LOGGER.info(f'PLAY [{self._play}]')
+
+        if self.is_tty:
+            elapsed = int(time.time() - self.start)
+            line = (f'[{elapsed // 60:02d}:{elapsed % 60:02d}] '
+                    f'{playlog.task or playlog.play} '
+                    f'({playlog.hosts_done()} hosts, '
+                    f'{len(playlog.failures)} failures)')
+            columns = shutil.get_terminal_size().columns
+            self.out.write('\r\033[K' + line[:columns - 1])
+            self.out.flush()
+
+    def close(self):
+        if self.is_tty:
+            self.out.write('\r\033[K')
+            self.out.flush()
+
+
+def write_timings(path: Path, timings: List[TaskTiming]):
+    'Writes `timings` as a JSON list of objects'
+    with open(path, 'w') as f:
+        json.dump([t._asdict() for t in timings], f, indent=1)
+
+
+def role_durations(timings: List[TaskTiming]) -> List[Tuple[str, float]]:
+    '''Returns the time spent in each role, longest first
+
+    The time of a task is its longest duration on a host (hosts run a task
+    in parallel).  The role of a task is the prefix of its name (`<role> :
+    <task>`), or the play for tasks outside of roles.
+
+    '''
+    tasks: Dict[Tuple[str, str], float] = defaultdict(float)
+    for t in timings:
+        key = (t.play, t.task)
+        tasks[key] = max(tasks[key], t.duration)
+
+    roles: Dict[str, float] = defaultdict(float)
+    for (play, task), duration in tasks.items():
+        role = task.split(' : ')[0] if ' : ' in task else play
+        roles[role] += duration
+
+    return sorted(roles.items(), key=lambda r: r[1], reverse=True)
@@ -0,0 +1,359 @@
+# -*- coding: utf-8 -*-
+'''Journaled storage of the enos environment.
+
+enoslib stores an environment as a single pickle file that is entirely
+rewritten at the end of each command.  On large deployments, the `rsc` key
+holds thousands of hosts and re-serializing it for every command (even `enos
+info`) is slow.  Two overlapping commands also risk to overwrite each other's
+changes.
+
+This module stores an environment as:
+- a snapshot: the enoslib pickle file (`env`) of the whole environment;
+- a journal (`env.journal`): an append-only file of records `(key, value)`
+  (or `(key, None)` for a deleted key), that are replayed on top of the
+  snapshot when the environment is loaded.
+
+A `JournaledEnvironment` keeps track of the keys accessed since it has been
+loaded.  When dumped, it only pickles these keys, compares them with the
+digest of their stored value, and appends the ones that actually changed to
+the journal.  Once the journal gets bigger than the snapshot, it is compacted
+into a new snapshot.
+
+Readers take a shared lock on `env.lock`, and writers an exclusive one.
+Before appending, a writer first merges the records that other commands
+appended since it loaded the environment, so that concurrent commands lose
+none of their changes (the last writer of a key wins).
+
+'''
+import fcntl
+import hashlib
+import logging
+import os
+import pickle
+import struct
+import zlib
+from contextlib import contextmanager
+from pathlib import Path
+from typing import (Any, Dict, Iterable, Iterator, Optional, Set, Tuple,
+                    Union)
+
+from enoslib.constants import ENV_FILENAME
+from enoslib.task import Environment, get_or_create_env
+
+LOGGER = logging.getLogger(__name__)
+
+JOURNAL_FILENAME = f'{ENV_FILENAME}.journal'
+LOCK_FILENAME = f'{ENV_FILENAME}.lock'
+
+# Do not compact a journal smaller than that (in bytes)
+COMPACT_MIN_SIZE = 1024 * 1024
+
+# Records of the journal are prefixed with their length and crc32
+_RECORD_HEADER = struct.Struct('!II')
+
+# Identity of a file: (inode, modification time, size)
+FileId = Tuple[int, int, int]
+
+
+class JournaledEnvironment(Environment):
+    '''An enoslib Environment that only writes its changes on dump.
+
+    Use `load` to get the environment from an existing directory.
+    '''
+
+    # Digest of the stored value of each key
+    _digests: Dict[str, str]
+
+    # Keys read or written since the load (thus possibly modified)
+    _touched: Set[str]
+
+    # Identity of the snapshot and size of the journal at the time of the
+    # last load/dump, to find out changes made by other commands
+    _snapshot_id: Optional[FileId]
+    _journal_offset: int
+
+    def __init__(self, env_name: Path):
+        self._digests = {}
+        self._touched = set()
+        self._snapshot_id = None
+        self._journal_offset = 0
+        super().__init__(env_name)
+
+    def __getitem__(self, key):
+        # The value may be mutated in place by the caller
+        self._touched.add(key)
+        return super().__getitem__(key)
+
+    def __setitem__(self, key, value):
+        self._touched.add(key)
+        super().__setitem__(key, value)
+
+    def __delitem__(self, key):
+        self._touched.add(key)
+        super().__delitem__(key)
+
+    def __getstate__(self):
+        # Do not pickle the tracking of changes, except the digests that come
+        # along the snapshot
+        state = self.__dict__.copy()
+        for attr in ['_touched', '_snapshot_id', '_journal_offset']:
+            state.pop(attr, None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.__dict__.setdefault('_digests', {})
+        self._touched = set()
+        self._snapshot_id = None
+        self._journal_offset = 0
+
+    @classmethod
+    def load(cls, env_dir: Path) -> 'JournaledEnvironment':
+        '''Load the environment at `env_dir` (snapshot + journal).
+
+        Raises:
+            EnosFilePathError: if there is no environment at `env_dir`.
+        '''
+        env_dir = Path(env_dir)
+
+        # Do not call __init__ that creates the directory if it is missing
+        self = cls.__new__(cls)
+        self.__setstate__({'data': {}, 'env_name': env_dir.resolve()})
+        with _locked(env_dir, exclusive=False):
+            self._load_snapshot()
+            self._replay_journal(keep=set())
+
+        self._touched.clear()
+        LOGGER.debug(f'Loaded environment {self.env_name} '
+                     f'(journal at {self._journal_offset} bytes)')
+        return self
+
+    def dump(self):
+        '''Append the changes of this environment to its journal.
+
+        The journal is compacted into the snapshot when it gets too big.
+        '''
+        self.env_name.mkdir(parents=True, exist_ok=True)
+
+        # Find changed keys
+        changes: Dict[str, Tuple[str, Optional[bytes]]] = {}
+        for key in self._touched:
+            if key in self.data:
+                blob = pickle.dumps(self.data[key])
+                digest = hashlib.sha256(blob).hexdigest()
+                if self._digests.get(key) != digest:
+                    changes[key] = (digest, blob)
+            elif key in self._digests:
+                changes[key] = ('', None)
+        self._touched.clear()
+
+        if not changes:
+            LOGGER.debug(f'Nothing to dump in {self.env_name}')
+            return
+
+        LOGGER.debug(f'Dumping keys {list(changes)} in {self.env_name}')
+        with _locked(self.env_name, exclusive=True):
+            # Get changes from concurrent commands
+            if self._snapshot_id != _file_id(self._snapshot_path):
+                self._load_snapshot(keep=set(changes))
+                self._journal_offset = 0
+            self._replay_journal(keep=set(changes))
+
+            # Drop the torn end of the journal (e.g., of a command that
+            # crashed), since replays stop there and would miss ours
+            if self._journal_path.exists() and \
+               self._journal_path.stat().st_size > self._journal_offset:
+                LOGGER.warning(f'Truncate the corrupted end of '
+                               f'{self._journal_path}')
+                os.truncate(self._journal_path, self._journal_offset)
+
+            # Write ours
+            with open(self._journal_path, 'ab') as journal:
+                for key, (digest, blob) in changes.items():
+                    journal.write(_mk_record(key, digest, blob))
+                journal.flush()
+                os.fsync(journal.fileno())
+                self._journal_offset = journal.tell()
+
+            for key, (digest, blob) in changes.items():
+                if blob is None:
+                    self._digests.pop(key, None)
+                else:
+                    self._digests[key] = digest
+
+            if self._journal_offset > max(COMPACT_MIN_SIZE,
+                                          self._snapshot_id[2]
+                                          if self._snapshot_id else 0):
+                self._compact()
+
+    def _compact(self):
+        'Write the snapshot of this environment and empty the journal'
+        LOGGER.debug(f'Compacting the journal of {self.env_name}')
+        tmp_path = self._snapshot_path.with_suffix('.tmp')
+        with open(tmp_path, 'wb') as snapshot:
+            snapshot.write(self.dumps())
+            snapshot.flush()
+            os.fsync(snapshot.fileno())
+        os.replace(tmp_path, self._snapshot_path)
+
+        # Note: If we crash here, the journal is replayed on top of the new
+        # snapshot, which gives the same result.
+        os.truncate(self._journal_path, 0)
+        self._snapshot_id = _file_id(self._snapshot_path)
+        self._journal_offset = 0
+
+    def _load_snapshot(self, keep: Set[str] = set()):
+        'Load values from the snapshot, except for keys in `keep`'
+        snapshot = Environment.load_from_file(self._snapshot_path)
+        self._snapshot_id = _file_id(self._snapshot_path)
+        digests = getattr(snapshot, '_digests', {})
+
+        for key in set(self.data) - set(snapshot.data) - keep:
+            del self.data[key]
+            self._digests.pop(key, None)
+        for key, value in snapshot.data.items():
+            if key not in keep:
+                self.data[key] = value
+                if key in digests:
+                    self._digests[key] = digests[key]
+                else:
+                    # Legacy enoslib snapshot, the key is written on next dump
+                    self._digests.pop(key, None)
+
+    def _replay_journal(self, keep: Set[str]):
+        'Apply records of the journal not yet seen, except for keys in `keep`'
+        for key, digest, value, offset in _read_records(
+                self._journal_path, self._journal_offset):
+            self._journal_offset = offset
+            if key in keep:
+                continue
+            if digest:
+                self.data[key] = value
+                self._digests[key] = digest
+            else:
+                self.data.pop(key, None)
+                self._digests.pop(key, None)
+
+    @property
+    def _snapshot_path(self) -> Path:
+        return self.env_name / ENV_FILENAME
+
+    @property
+    def _journal_path(self) -> Path:
+        return self.env_name / JOURNAL_FILENAME
+
+
+def open_env(new: bool,
+             path: Optional[Union[Path, str]],
+             carry: Iterable[str] = ()) -> JournaledEnvironment:
+    '''Get a new or an existing environment.
+
+    Args:
+        new: Create a new environment at `path` (or in a new directory if
+          `path` is None) and link it to `current`.
+        path: Path to the environment directory.  Defaults to `current` for
+          an existing environment.
+        carry: Keys of the former environment (at `path`, or `current`) to
+          put in the new environment, e.g., state of the testbed that
+          outlives an environment.
+
+    Raises:
+        EnosFilePathError: if there is no environment at `path`.
+    '''
+    from enos.utils.constants import SYMLINK_NAME
+
+    if new:
+        carried = _former_values(Path(path or SYMLINK_NAME), carry)
+        env_dir = get_or_create_env(True, path).env_name
+        with _locked(env_dir, exclusive=True):
+            # Drop the journal of a former environment in that directory
+            if (env_dir / JOURNAL_FILENAME).exists():
+                os.truncate(env_dir / JOURNAL_FILENAME, 0)
+    else:
+        env_dir = Path(path or SYMLINK_NAME)
+
+    env = JournaledEnvironment.load(env_dir)
+    if new:
+        for key, value in carried.items():
+            env[key] = value
+    return env
+
+
+def env_id(env_dir: Path) -> Tuple[Optional[FileId], Optional[FileId]]:
+    'Identity of the files of the environment at `env_dir`'
+    env_dir = Path(env_dir)
+    return (_file_id(env_dir / ENV_FILENAME),
+            _file_id(env_dir / JOURNAL_FILENAME))
+
+
+# Utils
+
+def _former_values(env_dir: Path, keys: Iterable[str]) -> Dict[str, Any]:
+    'Values of `keys` in the environment at `env_dir` (if any)'
+    keys = list(keys)
+    if not keys or not (env_dir / ENV_FILENAME).exists():
+        return {}
+    former = JournaledEnvironment.load(env_dir)
+    return {key: former[key] for key in keys if key in former}
+
+
+@contextmanager
+def _locked(env_dir: Path, exclusive: bool) -> Iterator[None]:
+    'Lock the environment at `env_dir` for reading or writing'
+    # The environment directory may not exist yet, in that case the loading
+    # fails later on with a proper EnosFilePathError
+    if not Path(env_dir).is_dir():
+        yield
+        return
+
+    with open(Path(env_dir) / LOCK_FILENAME, 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def _file_id(path: Path) -> Optional[FileId]:
+    try:
+        stat = path.stat()
+        return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+    except FileNotFoundError:
+        return None
+
+
+def _mk_record(key: str, digest: str, blob: Optional[bytes]) -> bytes:
+    'Build a journal record.  A record without blob marks a deleted key.'
+    payload = pickle.dumps((key, digest, blob))
+    return _RECORD_HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+
+
+def _read_records(
+        journal_path: Path,
+        offset: int) -> Iterator[Tuple[str, str, Any, int]]:
+    '''Yield (key, digest, value, end offset) of records from `offset`.
+
+    Stop on the first truncated or corrupted record (e.g., a command that
+    crashed in the middle of a write).
+    '''
+    if not journal_path.exists():
+        return
+
+    with open(journal_path, 'rb') as journal:
+        journal.seek(offset)
+        while True:
+            header = journal.read(_RECORD_HEADER.size)
+            if not header:
+                return
+            if len(header) < _RECORD_HEADER.size:
+                break
+            length, crc = _RECORD_HEADER.unpack(header)
+            payload = journal.read(length)
+            if len(payload) < length or zlib.crc32(payload) != crc:
+                break
+
+            key, digest, blob = pickle.loads(payload)
+            value = pickle.loads(blob) if blob is not None else None
+            yield key, digest, value, journal.tell()
+
+    LOGGER.warning(f'Ignore the corrupted end of {journal_path}')
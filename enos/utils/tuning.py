@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+'''Performance tuning profiles of nodes.
+
+Benchmarks are noisy on nodes that run with default CPU governors,
+transparent hugepages, swappiness, conntrack limits, etc.  The `tuning` key
+of the configuration file names a profile for all nodes, or a profile per
+role:
+
+.. code-block:: yaml
+
+  tuning: performance
+
+  tuning:
+    compute: performance
+    control: latency
+
+A profile is either the name of a profile of `PROFILES` or a mapping with
+the same keys (see `DEFAULT`).  Profiles are applied in the baremetal step of
+`enos up` and recorded in the env (under `tuning`).
+
+'''
+import logging
+from typing import Any, Dict, List, Mapping, Tuple, Union
+
+import enoslib as elib
+
+LOGGER = logging.getLogger(__name__)
+
+# Settings of a profile.  None leaves the node as is.
+DEFAULT: Dict[str, Any] = {
+    # Kernel parameters
+    'sysctl': {},
+    # CPU frequency governor (e.g., performance, powersave)
+    'governor': None,
+    # Transparent hugepages (always, madvise, never)
+    'transparent_hugepage': None,
+    # Number of reserved hugepages
+    'hugepages': None,
+    # Run irqbalance (True) or stop it to keep the IRQ affinity (False)
+    'irqbalance': None,
+}
+
+PROFILES: Dict[str, Dict[str, Any]] = {
+    'default': DEFAULT,
+    'performance': dict(DEFAULT, **{
+        'sysctl': {
+            'vm.swappiness': 0,
+            'net.core.somaxconn': 4096,
+            'net.core.netdev_max_backlog': 16384,
+            'net.core.rmem_max': 16777216,
+            'net.core.wmem_max': 16777216,
+            'net.netfilter.nf_conntrack_max': 1048576,
+        },
+        'governor': 'performance',
+        'transparent_hugepage': 'madvise',
+        'irqbalance': True,
+    }),
+    'latency': dict(DEFAULT, **{
+        'sysctl': {
+            'vm.swappiness': 0,
+            'net.core.busy_poll': 50,
+            'net.core.busy_read': 50,
+            'net.ipv4.tcp_low_latency': 1,
+            'net.netfilter.nf_conntrack_max': 1048576,
+        },
+        'governor': 'performance',
+        'transparent_hugepage': 'never',
+        'irqbalance': False,
+    }),
+}
+
+ProfileConf = Union[str, Mapping[str, Any]]
+
+
+def get_profile(profile: ProfileConf) -> Tuple[str, Dict[str, Any]]:
+    '''Returns the name and settings of a profile
+
+    Raises:
+        ValueError: if the profile is unknown or has unknown settings.
+    '''
+    if isinstance(profile, str):
+        if profile not in PROFILES:
+            raise ValueError(f'Unknown tuning profile {profile}, use one of '
+                             f'{list(PROFILES)} or a mapping of settings')
+        return profile, PROFILES[profile]
+
+    unknown = set(profile) - set(DEFAULT)
+    if unknown:
+        raise ValueError(f'Unknown tuning settings {sorted(unknown)}, use '
+                         f'{list(DEFAULT)}')
+    return 'custom', dict(DEFAULT, **profile)
+
+
+def host_profiles(tuning: Union[ProfileConf, Mapping[str, ProfileConf]],
+                  roles: elib.Roles) -> Dict[str, Tuple[str, Dict[str, Any]]]:
+    '''Returns the profile of each host (by alias)
+
+    Args:
+        tuning: The `tuning` key of the configuration, a profile for all
+          hosts or a profile per role.  A host of several roles gets the
+          profile of its first role in `tuning`.
+        roles: Enoslib roles of the deployment.
+
+    A custom profile of a role is named `custom:<role>`.
+    '''
+    if isinstance(tuning, str) or set(tuning) <= set(DEFAULT):
+        tuning = {'all': tuning}
+
+    profiles: Dict[str, Tuple[str, Dict[str, Any]]] = {}
+    for role, profile in tuning.items():
+        name, settings = get_profile(profile)
+        if name == 'custom':
+            name = f'custom:{role}'
+        for host in roles[role] if role in roles else []:
+            profiles.setdefault(host.alias, (name, settings))
+
+    # Hosts of other roles are left as is
+    for host in roles.all():
+        profiles.setdefault(host.alias, ('default', DEFAULT))
+    return profiles
+
+
+def apply_profile(hosts: List[elib.Host], name: str,
+                  profile: Mapping[str, Any]):
+    'Applies the settings of `profile` on `hosts`'
+    LOGGER.info(f'Apply the {name} tuning profile on '
+                f'{[h.alias for h in hosts]}')
+    with elib.play_on(roles=hosts, gather_facts=False) as yml:
+        for key, value in profile['sysctl'].items():
+            yml.sysctl(
+                **title(f'Set {key} to {value}'),
+                name=key,
+                value=str(value),
+                sysctl_set=True,
+                state='present',
+                ignore_errors=True)
+
+        if profile['hugepages'] is not None:
+            yml.sysctl(
+                **title(f'Reserve {profile["hugepages"]} hugepages'),
+                name='vm.nr_hugepages',
+                value=str(profile['hugepages']),
+                sysctl_set=True,
+                state='present')
+
+        # Virtual machines have no cpufreq
+        if profile['governor'] is not None:
+            yml.shell(
+                'for gov in /sys/devices/system/cpu/cpu*/cpufreq/'
+                'scaling_governor; do '
+                f'[ -e "$gov" ] && echo {profile["governor"]} > "$gov"; '
+                'done; true',
+                **title(f'Set the CPU governor to {profile["governor"]}'))
+
+        if profile['transparent_hugepage'] is not None:
+            yml.shell(
+                f'echo {profile["transparent_hugepage"]} '
+                '> /sys/kernel/mm/transparent_hugepage/enabled',
+                **title('Set transparent hugepages to '
+                        f'{profile["transparent_hugepage"]}'),
+                ignore_errors=True)
+
+        if profile['irqbalance'] is not None:
+            yml.systemd(
+                **title('Start irqbalance' if profile['irqbalance']
+                        else 'Stop irqbalance to keep the IRQ affinity'),
+                name='irqbalance',
+                state='started' if profile['irqbalance'] else 'stopped',
+                ignore_errors=True)
+
+
+# Utils
+
+def title(title: str) -> Dict[str, str]:
+    "A title for an ansible yaml commands"
+    return {"task_name": "Tuning : " + title}
@@ -1,10 +1,12 @@
 import operator
+import tempfile
 import unittest
 
 import mock
 
-from enos.provider.g5k import (_build_enoslib_conf, _count_common_interfaces,
-                               _get_sites)
+from enos.provider.g5k import (PROVISION_MARKER, _build_enoslib_conf,
+                               _count_common_interfaces, _get_sites,
+                               _provision)
 
 PROVIDER = {'type': 'g5k',
             'job_name': 'enos-test'}
@@ -17,6 +19,14 @@ CLUSTERS_SITES = {"paravance": "rennes", "grisou": "nancy"}
 
 class TestGenEnoslibRoles(unittest.TestCase):
 
+    def setUp(self):
+        # Do not use the cache of reference API lookups of the user
+        self._tmp = tempfile.TemporaryDirectory()
+        patcher = mock.patch('enos.utils.constants.CACHE_DIR', self._tmp.name)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(self._tmp.cleanup)
+
     @mock.patch("enoslib.infra.enos_g5k.g5k_api_utils.get_clusters_interfaces",
                 return_value=INTERFACES)
     def test_count_common_interfaces(self, mock_get_clusters_interfaces):
@@ -29,6 +39,22 @@ class TestGenEnoslibRoles(unittest.TestCase):
         result = _get_sites(["paravance", "grisou"])
         self.assertEqual(2, len(result))
 
+        # Second lookup hits the cache
+        mock_get_clusters_sites.reset_mock()
+        result = _get_sites(["paravance", "grisou"])
+        self.assertEqual(2, len(result))
+        mock_get_clusters_sites.assert_not_called()
+
+    @mock.patch("enos.provider.g5k.run_command")
+    def test_provision(self, mock_run_command):
+        _provision(['host-0', 'host-1'])
+        self.assertEqual(
+            1, mock_run_command.call_count,
+            msg='Provisioning should cost a single round-trip')
+        script = mock_run_command.call_args[0][0]
+        self.assertIn(PROVISION_MARKER, script)
+        self.assertTrue(mock_run_command.call_args[1]['raw'])
+
     @mock.patch("enos.provider.g5k._get_sites", return_value={"site1"})
     @mock.patch("enos.provider.g5k._count_common_interfaces", return_value=2)
     def test_with_resources(
@@ -1,5 +1,12 @@
-from enos.provider.enos_vagrant import _build_enoslib_conf
+from enos.provider.enos_vagrant import (DEFAULT_CONFIG, Enos_vagrant,
+                                        _build_enoslib_conf)
+from enos.utils.errors import EnosCannotScale
+import enoslib.infra.enos_vagrant.provider as enoslib_vagrant
+import mock
 import operator
+import os
+import re
+import tempfile
 import unittest
 
 
@@ -69,3 +76,56 @@ class TestGenEnoslibRoles(unittest.TestCase):
 
         self.assertEqual(11, len(machines))
 
+
+class TestScaleConfig(unittest.TestCase):
+
+    def setUp(self):
+        # Enoslib writes the Vagrantfile in the cwd
+        self._tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self._tmp.cleanup)
+        cwd = os.getcwd()
+        os.chdir(self._tmp.name)
+        self.addCleanup(os.chdir, cwd)
+
+        patcher = mock.patch.object(enoslib_vagrant.vagrant, 'Vagrant')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.provider = Enos_vagrant()
+        self.config = {'provider': dict(DEFAULT_CONFIG),
+                       'resources': {'medium': {'network': 1,
+                                                'compute': 1}}}
+
+    def machines(self, config):
+        "Name and IPs of the machines of the Vagrantfile of `config`"
+        self.provider.init(config)
+        with open('Vagrantfile') as vagrantfile:
+            defines = re.split(r'config.vm.define ', vagrantfile.read())[1:]
+        return {re.match(r'"([^"]+)"', d).group(1):
+                re.findall(r'ip: "([^"]+)"', d) for d in defines}
+
+    def scale(self, config, count):
+        return self.provider.scale_config(
+            config, config['resources'], 'compute', count)
+
+    def test_keep_names_and_ips(self):
+        former = self.machines(self.config)
+        config = self.scale(self.config, 1)
+        scaled = self.machines(config)
+        self.assertEqual(former, {name: ips for name, ips in scaled.items()
+                                  if name in former})
+        self.assertEqual(len(former) + 1, len(scaled))
+
+        # Scale again (from the recorded machines)
+        rescaled = self.machines(self.scale(config, 2))
+        self.assertEqual(scaled, {name: ips for name, ips in rescaled.items()
+                                  if name in scaled})
+        self.assertEqual(len(scaled) + 2, len(rescaled))
+        self.assertEqual(len(rescaled),
+                         len({ip for ips in rescaled.values() for ip in ips})
+                         // 2, msg='IPs should be unique')
+
+    def test_unknown_role(self):
+        with self.assertRaises(EnosCannotScale):
+            self.provider.scale_config(
+                self.config, self.config['resources'], 'storage', 1)
@@ -0,0 +1,273 @@
+import tempfile
+import threading
+import unittest
+from pathlib import Path
+
+import mock
+
+from enos.services import kolla
+from enos.services.kolla import KollaAnsible
+
+
+class TestKollaAnsiblePull(unittest.TestCase):
+
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self._tmp.cleanup)
+        self.config_dir = Path(self._tmp.name)
+
+    @mock.patch('enos.services.kolla._install_venv',
+                side_effect=lambda pkg, venv: venv)
+    def test_pull(self, install_venv):
+        venv = KollaAnsible.pull('kolla-ansible~=12.0', self.config_dir)
+        install_venv.assert_called_once_with('kolla-ansible~=12.0', venv)
+        self.assertEqual(self.config_dir.resolve(), venv.parent)
+
+    def test_pull_waits_for_background(self):
+        release = threading.Event()
+
+        def install_venv(pkg, venv):
+            release.wait()
+            return venv
+
+        with mock.patch('enos.services.kolla._install_venv',
+                        side_effect=install_venv) as install:
+            KollaAnsible.pull_in_background('kolla-ansible~=12.0',
+                                            self.config_dir)
+            KollaAnsible.pull_in_background('kolla-ansible~=12.0',
+                                            self.config_dir)
+            release.set()
+            venv = KollaAnsible.pull('kolla-ansible~=12.0', self.config_dir)
+
+        self.assertEqual(1, install.call_count,
+                         msg='The background installation should be reused')
+        self.assertEqual(kolla._venv_path('kolla-ansible~=12.0',
+                                          self.config_dir), venv)
+        self.assertEqual({}, kolla._PULLS)
+
+    @mock.patch('enos.services.kolla._install_venv',
+                side_effect=Exception('pip failed'))
+    def test_pull_background_failure(self, install_venv):
+        KollaAnsible.pull_in_background('kolla-ansible~=12.0',
+                                        self.config_dir)
+        with self.assertRaisesRegex(Exception, 'pip failed'):
+            KollaAnsible.pull('kolla-ansible~=12.0', self.config_dir)
+
+
+class TestKollaAnsibleVenvCache(unittest.TestCase):
+
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self._tmp.cleanup)
+        self.tmp = Path(self._tmp.name)
+        patcher = mock.patch('enos.utils.constants.CACHE_DIR',
+                             str(self.tmp / 'cache'))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        # Stub of pip that only creates the venv directory
+        patcher = mock.patch(
+            'enos.services.kolla._pip_install',
+            side_effect=lambda reqs, venv, log: venv.mkdir(parents=True,
+                                                           exist_ok=True))
+        self.pip_install = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def pull(self, pip_package, env_name):
+        (self.tmp / env_name).mkdir(exist_ok=True)
+        return KollaAnsible.pull(pip_package, self.tmp / env_name)
+
+    def test_venv_is_shared(self):
+        venv1 = self.pull('kolla-ansible~=12.0', 'env1')
+        venv2 = self.pull('kolla-ansible~=12.0', 'env2')
+
+        self.pip_install.assert_called_once()
+        self.assertTrue(venv1.is_symlink())
+        self.assertTrue(venv2.is_symlink())
+        self.assertEqual(venv1.resolve(), venv2.resolve())
+        self.assertEqual(self.tmp / 'cache' / 'venvs',
+                         venv1.resolve().parent)
+
+    def test_venv_by_package(self):
+        venv1 = self.pull('kolla-ansible~=12.0', 'env1')
+        venv2 = self.pull('kolla-ansible~=13.0', 'env1')
+
+        self.assertEqual(2, self.pip_install.call_count)
+        self.assertNotEqual(venv1.resolve(), venv2.resolve())
+
+    def test_editable_venv_is_not_shared(self):
+        venv = self.pull(f'-e {self.tmp}', 'env1')
+
+        self.pip_install.assert_called_once()
+        self.assertFalse(venv.is_symlink())
+        self.assertEqual(self.tmp / 'env1', venv.parent)
+
+
+class TestPipInstall(unittest.TestCase):
+
+    @mock.patch('enos.utils.constants.WHEELHOUSE', '/wheels')
+    @mock.patch('enos.services.kolla.subprocess.run')
+    def test_wheelhouse(self, run):
+        with tempfile.TemporaryDirectory() as tmp:
+            kolla._pip_install(['influxdb'], Path(tmp) / 'venv',
+                               Path(tmp) / 'venv.log')
+
+        pip_cmd = run.call_args[0][0]
+        self.assertEqual(['--no-index', '--find-links', '/wheels',
+                          'influxdb'], pip_cmd[-4:])
+
+
+GLOBALS = {
+    'kolla_internal_vip_address': '10.0.0.1',
+    'keystone_admin_password': 'demo',
+    'keystone_internal_url': 'http://{{ kolla_internal_vip_address }}:5000',
+    'openstack_auth': {
+        'auth_url': '{{ keystone_internal_url }}',
+        'username': 'admin',
+        'password': '{{ keystone_admin_password }}',
+    },
+}
+
+
+class TestOpenstackAuth(unittest.TestCase):
+
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self._tmp.cleanup)
+        self.config_dir = Path(self._tmp.name)
+
+        self.kolla = KollaAnsible.__new__(KollaAnsible)
+        self.kolla.venv_path = self.config_dir / 'venv'
+
+        patcher = mock.patch.dict(kolla._OPENSTACK_AUTHS, clear=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_resolve(self):
+        self.assertEqual(
+            {'auth_url': 'http://10.0.0.1:5000', 'username': 'admin',
+             'password': 'demo'},
+            self.kolla._resolve_openstack_auth(self.config_dir, GLOBALS))
+
+    def test_resolve_is_memoized(self):
+        self.kolla._resolve_openstack_auth(self.config_dir, GLOBALS)
+        kolla._OPENSTACK_AUTHS.clear()   # e.g., a new enos command
+
+        with mock.patch.object(KollaAnsible, '_render_openstack_auth') as r:
+            openstack_auth = self.kolla._resolve_openstack_auth(
+                self.config_dir, GLOBALS)
+            r.assert_not_called()
+        self.assertEqual('http://10.0.0.1:5000', openstack_auth['auth_url'])
+
+        with mock.patch.object(KollaAnsible, '_render_openstack_auth',
+                               return_value={}) as r:
+            self.kolla._resolve_openstack_auth(
+                self.config_dir, dict(GLOBALS, keystone_admin_password='x'))
+            r.assert_called_once()
+
+    @mock.patch.object(KollaAnsible, '_play_openstack_auth',
+                       return_value={'username': 'admin'})
+    def test_resolve_falls_back_on_ansible(self, play):
+        globals_values = dict(GLOBALS, openstack_auth={'url': '{{ nope }}'})
+        self.assertEqual(
+            {'username': 'admin'},
+            self.kolla._resolve_openstack_auth(self.config_dir,
+                                               globals_values))
+        play.assert_called_once()
+
+
+class TestReferencedGlobals(unittest.TestCase):
+
+    def setUp(self):
+        self.kolla = KollaAnsible.__new__(KollaAnsible)
+        self.kolla.globals_values = dict(
+            GLOBALS, ansible_become='yes', unused='{{ keystone_admin_user }}')
+
+    def test_referenced_globals(self):
+        tasks = [
+            {'name': 'Gather facts', 'setup': ''},
+            {'name': 'Use auth', 'debug': {'msg': '{{ openstack_auth }}'},
+             'when': 'kolla_internal_vip_address is defined'},
+        ]
+        self.assertCountEqual(
+            ['openstack_auth', 'keystone_internal_url',
+             'kolla_internal_vip_address', 'keystone_admin_password',
+             'ansible_become'],
+            self.kolla.referenced_globals(tasks))
+
+    def test_no_referenced_globals(self):
+        tasks = [{'shell': 'ip addr flush {{ neutron_external_interface }}'}]
+        self.assertEqual({'ansible_become': 'yes'},
+                         self.kolla.referenced_globals(tasks))
+
+    def test_unparsable_template(self):
+        tasks = [{'shell': 'echo {{ broken'}]
+        self.assertEqual(self.kolla.globals_values,
+                         self.kolla.referenced_globals(tasks))
+
+    @mock.patch.object(kolla.elib, 'play_on')
+    def test_play_on(self, play_on):
+        yml = mock.Mock(kwargs={}, _tasks=[{'debug': '{{ keystone_url }}'}])
+        play_on.return_value.__enter__.return_value = yml
+        extra_vars = {'keystone_url': 'http://{{ kolla_internal_vip_address }}'}
+        with self.kolla.play_on(roles=[], extra_vars=extra_vars):
+            pass
+
+        play_on.assert_called_once_with(roles=[], extra_vars=extra_vars)
+        self.assertEqual(dict(extra_vars, ansible_become='yes',
+                              kolla_internal_vip_address='10.0.0.1'),
+                         yml.kwargs['extra_vars'])
+
+    @mock.patch.object(kolla.elib, 'play_on')
+    def test_play_on_without_tasks(self, play_on):
+        # Enoslib makes a task of any unknown attribute
+        yml = mock.Mock(spec=['kwargs'], kwargs={})
+        play_on.return_value.__enter__.return_value = yml
+        with self.kolla.play_on(roles=[], extra_vars={'unused': 'x'}):
+            pass
+
+        self.assertEqual(dict(self.kolla.globals_values, unused='x'),
+                         yml.kwargs['extra_vars'])
+
+
+FAKE_KOLLA = '''#!/bin/sh
+echo "PLAY [Apply role nova] ****"
+echo "TASK [nova : Check containers] ****"
+echo "ok: [enos-0]"
+echo "PLAY RECAP ****"
+exit ${FAKE_KOLLA_RC:-0}
+'''
+
+
+class TestExecuteAndLog(unittest.TestCase):
+
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self._tmp.cleanup)
+        tmp = Path(self._tmp.name)
+        (tmp / 'venv' / 'bin').mkdir(parents=True)
+        (tmp / 'venv' / 'bin' / 'activate').write_text('')
+        (tmp / 'venv' / 'bin' / 'kolla-ansible').write_text(FAKE_KOLLA)
+        (tmp / 'venv' / 'bin' / 'kolla-ansible').chmod(0o755)
+        self.log_dir = tmp / kolla.LOG_DIR
+        self.kolla = KollaAnsible.__new__(KollaAnsible)
+        self.kolla.venv_path = tmp / 'venv'
+        self.kolla.kolla_args = []
+
+    def test_logs_and_timings(self):
+        self.kolla.execute(['deploy'], self.log_dir)
+
+        log, = self.log_dir.glob('*-deploy.log')
+        self.assertIn('ok: [enos-0]', log.read_text())
+        timings, = self.log_dir.glob('*-deploy.json')
+        self.assertIn('nova : Check containers', timings.read_text())
+
+    @mock.patch.dict('os.environ', {'FAKE_KOLLA_RC': '2'})
+    def test_failure(self):
+        with self.assertRaises(kolla.subprocess.CalledProcessError):
+            self.kolla.execute(['deploy'], self.log_dir)
+        self.assertEqual(1, len(list(self.log_dir.glob('*-deploy.json'))))
+
+
+if __name__ == '__main__':
+    unittest.main()
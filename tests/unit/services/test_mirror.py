@@ -0,0 +1,35 @@
+import unittest
+
+import enoslib as elib
+import mock
+
+from enos.services import PackageMirror
+
+
+class TestPackageMirror(unittest.TestCase):
+
+    def setUp(self):
+        self.mirror = PackageMirror(elib.Host('10.0.0.1', alias='enos-0'))
+
+    def test_urls(self):
+        self.assertEqual('http://10.0.0.1:3142', self.mirror.apt_proxy)
+        self.assertEqual('http://10.0.0.1:3141/root/pypi/+simple/',
+                         self.mirror.pip_index)
+
+    @mock.patch('enoslib.play_on')
+    def test_configure(self, play_on):
+        hosts = [elib.Host('10.0.0.2', alias='enos-1')]
+        self.mirror.configure(hosts)
+        play_on.assert_called_once_with(roles=hosts, gather_facts=False)
+
+        yml = play_on.return_value.__enter__.return_value
+        contents = {c.kwargs['dest']: c.kwargs['content']
+                    for c in yml.copy.call_args_list}
+        self.assertIn('http://10.0.0.1:3142',
+                      contents['/etc/apt/apt.conf.d/01enos-proxy'])
+        self.assertIn('index-url = http://10.0.0.1:3141/root/pypi/+simple/',
+                      contents['/etc/pip.conf'])
+
+
+if __name__ == '__main__':
+    unittest.main()
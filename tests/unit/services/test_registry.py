@@ -0,0 +1,94 @@
+import tempfile
+import unittest
+from pathlib import Path
+
+import enoslib as elib
+import mock
+import yaml
+
+from enos.services import registry
+from enos.services.registry import RegistryMirrors
+
+HOSTS = [elib.Host(f'10.0.{c}.{i}', alias=f'{cluster}-{i}.rennes.grid5000.fr')
+         for c, cluster in enumerate(['paravance', 'parasilo'])
+         for i in range(1, 4)]
+
+
+class TestRegistryMirrors(unittest.TestCase):
+
+    def test_group_per_cluster(self):
+        groups = registry.group_hosts(HOSTS, 'cluster')
+        self.assertEqual(['parasilo', 'paravance'], sorted(groups))
+        self.assertEqual(3, len(groups['paravance']))
+
+    def test_group_per_n_hosts(self):
+        groups = registry.group_hosts(HOSTS + HOSTS[:2], 4)
+        self.assertEqual([4, 2], [len(hosts) for hosts in groups.values()])
+
+    def test_group_per_unknown(self):
+        with self.assertRaises(ValueError):
+            registry.group_hosts(HOSTS, 'rack')
+        with self.assertRaises(ValueError):
+            registry.group_hosts(HOSTS, 0)
+
+    def test_mirror_urls(self):
+        # The root registry is in the paravance cluster
+        mirrors = RegistryMirrors(HOSTS, '10.0.0.2', 5000, 'cluster')
+        urls = mirrors.mirror_urls()
+        self.assertEqual('http://10.0.0.2:5000',
+                         urls['paravance-1.rennes.grid5000.fr'])
+        self.assertEqual('http://10.0.1.1:5000',
+                         urls['parasilo-3.rennes.grid5000.fr'])
+        self.assertEqual('http://10.0.0.2:5000', mirrors.root_url)
+
+    def test_host_vars(self):
+        mirrors = RegistryMirrors(HOSTS, '10.0.0.2', 5000, 'cluster')
+        with tempfile.TemporaryDirectory() as inventory_dir:
+            mirrors.write_host_vars(inventory_dir)
+            host_vars = (Path(inventory_dir) / 'host_vars'
+                         / 'parasilo-2.rennes.grid5000.fr'
+                         / registry.HOST_VARS_FILE)
+            self.assertEqual({registry.MIRROR_VAR: 'http://10.0.1.1:5000'},
+                             yaml.safe_load(host_vars.read_text()))
+
+            RegistryMirrors.remove_host_vars(inventory_dir)
+            self.assertFalse(host_vars.exists())
+
+    def test_add_hosts_per_cluster(self):
+        mirrors = RegistryMirrors(HOSTS[1:], '10.0.0.2', 5000, 'cluster')
+        former = dict(mirrors.mirrors)
+        new = elib.Host('10.0.2.1', alias='parapide-1.rennes.grid5000.fr')
+        self.assertEqual(['parapide'], mirrors.add_hosts([HOSTS[0], new]))
+
+        self.assertEqual(dict(former, parapide=new), mirrors.mirrors)
+        self.assertIn(HOSTS[0], mirrors.groups['paravance'])
+        self.assertEqual([new], mirrors.groups['parapide'])
+
+    def test_add_hosts_per_n_hosts(self):
+        # The group of paravance hosts is completed first
+        mirrors = RegistryMirrors(HOSTS[:3], '10.0.9.9', 5000, 4)
+        self.assertEqual(['group-1'], mirrors.add_hosts(HOSTS))
+        self.assertEqual([4, 2], [len(hosts) for hosts
+                                  in mirrors.groups.values()])
+        self.assertIn(HOSTS[3], mirrors.groups['group-0'])
+        self.assertIs(HOSTS[4], mirrors.mirrors['group-1'])
+
+    def test_deploy_groups(self):
+        mirrors = RegistryMirrors(HOSTS, '10.0.0.2', 5000, 'cluster')
+        with mock.patch.object(registry.elib, 'play_on') as play_on:
+            mirrors.deploy(['paravance'])
+            self.assertFalse(play_on.called,
+                             msg='The root registry is the paravance mirror')
+            mirrors.deploy(['parasilo'])
+            self.assertEqual([mirrors.mirrors['parasilo']],
+                             play_on.call_args[1]['roles'])
+
+    def test_bundle_name(self):
+        self.assertEqual('registry-centos-wallaby.tar.gz',
+                         registry.bundle_name({
+                             'kolla_base_distro': 'centos',
+                             'openstack_release': 'wallaby'}))
+
+
+if __name__ == '__main__':
+    unittest.main()
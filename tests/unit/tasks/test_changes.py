@@ -0,0 +1,89 @@
+import tempfile
+import unittest
+from pathlib import Path
+
+from enos.tasks import changes
+
+INVENTORY = '''\
+[control]
+enos-0
+[compute]
+enos-1
+enos-2
+[network]
+enos-3
+[loadbalancer:children]
+network
+[nova:children]
+control
+[nova-compute:children]
+compute
+[heat:children]
+control
+'''
+
+
+class TestChanges(unittest.TestCase):
+
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.inventory = Path(self._tmp.name) / 'multinode'
+        self.inventory.write_text(INVENTORY)
+        self.overrides = Path(self._tmp.name) / 'config'
+        self.overrides.mkdir()
+        self.globals = {'kolla_internal_vip_address': '10.0.0.2',
+                        'enable_heat': 'yes',
+                        'nova_compute_virt_type': 'kvm',
+                        'resultdir': '/tmp/result'}
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def snapshot(self):
+        return changes.snapshot(
+            self.globals, str(self.inventory), self.overrides)
+
+    def test_nothing_changed(self):
+        applied = self.snapshot()
+        self.globals['resultdir'] = '/tmp/other'
+        self.assertEqual(changes.Changes([], []),
+                         changes.diff(applied, self.snapshot()))
+
+    def test_global_of_service(self):
+        applied = self.snapshot()
+        self.globals['nova_compute_virt_type'] = 'qemu'
+        self.assertEqual(
+            changes.Changes(['nova'],
+                            ['enos-0', 'enos-1', 'enos-2', 'enos-3']),
+            changes.diff(applied, self.snapshot()))
+
+    def test_enable_service(self):
+        # The load balancer gets the haproxy configuration of heat
+        applied = self.snapshot()
+        self.globals['enable_heat'] = 'no'
+        self.assertEqual(changes.Changes(['heat'], ['enos-0', 'enos-3']),
+                         changes.diff(applied, self.snapshot()))
+
+    def test_global_of_all_services(self):
+        applied = self.snapshot()
+        self.globals['kolla_internal_vip_address'] = '10.0.0.3'
+        self.assertIsNone(changes.diff(applied, self.snapshot()))
+
+    def test_inventory_group(self):
+        applied = self.snapshot()
+        self.inventory.write_text(
+            INVENTORY.replace('[heat:children]\ncontrol',
+                              '[heat:children]\ncompute'))
+        self.assertEqual(changes.Changes(['heat'],
+                                         ['enos-1', 'enos-2', 'enos-3']),
+                         changes.diff(applied, self.snapshot()))
+
+    def test_config_override(self):
+        applied = self.snapshot()
+        (self.overrides / 'heat.conf').write_text('[DEFAULT]\ndebug=True\n')
+        self.assertEqual(changes.Changes(['heat'], ['enos-0', 'enos-3']),
+                         changes.diff(applied, self.snapshot()))
+
+        applied = self.snapshot()
+        (self.overrides / 'global.conf').write_text('[DEFAULT]\n')
+        self.assertIsNone(changes.diff(applied, self.snapshot()))
@@ -0,0 +1,126 @@
+import tempfile
+import unittest
+from pathlib import Path
+
+import mock
+
+from enos.services import KollaAnsible
+from enos.tasks import parallel
+
+# Excerpt of the kolla-ansible defaults (ansible/group_vars/all.yml)
+KOLLA_DEFAULTS = {
+    'om_rpc_transport': 'rabbit',
+    'om_notify_transport': 'rabbit',
+    'neutron_plugin_agent': 'openvswitch',
+    'cloudkitty_storage_backend': 'influxdb',
+    'enable_openstack_core': 'yes',
+    'enable_glance': '{{ enable_openstack_core | bool }}',
+    'enable_keystone': '{{ enable_openstack_core | bool }}',
+    'enable_neutron': '{{ enable_openstack_core | bool }}',
+    'enable_nova': '{{ enable_openstack_core | bool }}',
+    'enable_rabbitmq': "{{ 'yes' if om_rpc_transport == 'rabbit' "
+                       "or om_notify_transport == 'rabbit' else 'no' }}",
+    'enable_cinder': 'no',
+    'enable_cinder_backend_iscsi': '{{ enable_cinder_backend_lvm | bool }}',
+    'enable_cinder_backend_lvm': 'no',
+    'enable_cloudkitty': 'no',
+    'enable_grafana': 'no',
+    'enable_heat': '{{ enable_openstack_core | bool }}',
+    'enable_horizon': '{{ enable_openstack_core | bool }}',
+    'enable_influxdb': "{{ enable_monasca | bool or "
+                       "(enable_cloudkitty | bool and "
+                       "cloudkitty_storage_backend == 'influxdb') }}",
+    'enable_ironic': 'no',
+    'enable_iscsid': '{{ (enable_cinder | bool and '
+                     'enable_cinder_backend_iscsi | bool) or '
+                     'enable_ironic | bool }}',
+    'enable_monasca': 'no',
+    'enable_openvswitch': "{{ enable_neutron | bool and "
+                          "neutron_plugin_agent != 'linuxbridge' }}",
+    'enable_ovn': "{{ enable_neutron | bool and "
+                  "neutron_plugin_agent == 'ovn' }}",
+    'enable_placement': '{{ enable_nova | bool or enable_zun | bool }}',
+    'enable_zun': 'no',
+}
+
+# kolla-ansible that runs a play for the roles of its `--tags`/`--skip-tags`
+FAKE_KOLLA = '''#!/bin/sh
+echo "PLAY [Apply roles $3] ****"
+echo "TASK [Check containers] ****"
+echo "ok: [enos-0]"
+echo "PLAY RECAP ****"
+'''
+
+
+class TestParallel(unittest.TestCase):
+
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self._tmp.cleanup)
+        self.log_dir = Path(self._tmp.name) / 'kolla-logs'
+        self.stages = parallel.Plan(['mariadb', 'keystone'],
+                                    [['glance', 'nova'], ['heat']])
+
+    def test_plan(self):
+        stages = parallel.plan(dict(KOLLA_DEFAULTS))
+        self.assertEqual(parallel.INFRA_TAGS, stages.infra)
+        self.assertEqual([['glance', 'placement', 'nova', 'neutron'],
+                          ['heat'], ['horizon']], stages.groups)
+
+    def test_plan_overrides(self):
+        stages = parallel.plan(dict(KOLLA_DEFAULTS, enable_openstack_core='no',
+                                    enable_cinder='yes', enable_heat=True))
+        self.assertEqual([['cinder'], ['heat']], stages.groups)
+
+    def test_plan_unrendered(self):
+        stages = parallel.plan(dict(KOLLA_DEFAULTS,
+                                    enable_heat='{{ undefined_var | bool }}'))
+        self.assertIn(['heat'], stages.groups)
+
+    def test_run(self):
+        kolla = mock.Mock()
+        parallel.run(kolla, ['deploy'], self.log_dir, 2, self.stages)
+
+        cmds = [c[0][0][1] for c in kolla.execute.call_args_list]
+        self.assertEqual('--tags mariadb,keystone', cmds[0])
+        self.assertCountEqual(['--tags glance,nova', '--tags heat'],
+                              cmds[1:3])
+        self.assertEqual('--skip-tags mariadb,keystone,glance,nova,heat',
+                         cmds[3])
+        self.assertEqual(1, len(list(self.log_dir.glob('*-parallel.log'))))
+
+    def test_run_failure(self):
+        def execute(cmd, log_dir, name, **kwargs):
+            if name == 'deploy-glance':
+                raise Exception('glance failed')
+
+        kolla = mock.Mock()
+        kolla.execute.side_effect = execute
+        with self.assertRaisesRegex(Exception, 'glance failed'):
+            parallel.run(kolla, ['deploy'], self.log_dir, 2, self.stages)
+
+        names = [c[0][2] for c in kolla.execute.call_args_list]
+        self.assertCountEqual(
+            ['deploy-mariadb', 'deploy-glance', 'deploy-heat'], names,
+            msg='Other groups should complete, and the rest should not run')
+
+    @mock.patch('enos.services.kolla.playlog.Progress')
+    def test_run_kolla(self, progress):
+        tmp = Path(self._tmp.name)
+        (tmp / 'venv' / 'bin').mkdir(parents=True)
+        (tmp / 'venv' / 'bin' / 'activate').write_text('')
+        (tmp / 'venv' / 'bin' / 'kolla-ansible').write_text(FAKE_KOLLA)
+        (tmp / 'venv' / 'bin' / 'kolla-ansible').chmod(0o755)
+        kolla = KollaAnsible.__new__(KollaAnsible)
+        kolla.venv_path = tmp / 'venv'
+        kolla.kolla_args = []
+
+        parallel.run(kolla, ['deploy'], self.log_dir, 2, self.stages)
+
+        self.assertEqual(2, progress.call_count,
+                         msg='Only the sequential stages draw a progress')
+        merged, = self.log_dir.glob('*-parallel.log')
+        for roles in ['mariadb,keystone', 'glance,nova', 'heat',
+                      'mariadb,keystone,glance,nova,heat']:
+            self.assertIn(f'PLAY [Apply roles {roles}]', merged.read_text())
+        self.assertEqual(4, len(list(self.log_dir.glob('*-deploy-*.json'))))
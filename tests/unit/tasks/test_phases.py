@@ -0,0 +1,80 @@
+import tempfile
+import unittest
+from pathlib import Path
+
+from enos.tasks import phases
+
+CONFIG = {
+    'provider': {'type': 'g5k'},
+    'resources': {'paravance': {'compute': 1, 'network': 1, 'control': 1}},
+    'kolla-ansible': 'kolla-ansible~=12.0',
+    'kolla': {'enable_heat': 'no'},
+}
+
+
+class TestPhases(unittest.TestCase):
+
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.inventory = Path(self._tmp.name) / 'multinode'
+        self.inventory.write_text('[control]\nenos-0\n')
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def deployed_env(self, config):
+        env = {'inventory': str(self.inventory)}
+        phases.mark_done(env, 'up', phases.up_fingerprint(config, False))
+        phases.mark_done(env, 'os', phases.os_fingerprint(
+            config, env['inventory'], False))
+        phases.mark_done(env, 'init', phases.init_fingerprint(
+            env['phases']['os'], False))
+        return env
+
+    def test_fresh_env(self):
+        self.assertEqual({'up': True, 'os': True, 'init': True},
+                         phases.plan(None, CONFIG, False))
+        self.assertEqual({'up': True, 'os': True, 'init': True},
+                         phases.plan({}, CONFIG, False))
+
+    def test_nothing_changed(self):
+        env = self.deployed_env(CONFIG)
+        self.assertEqual({'up': False, 'os': False, 'init': False},
+                         phases.plan(env, CONFIG, False))
+
+    def test_kolla_globals_changed(self):
+        env = self.deployed_env(CONFIG)
+        config = dict(CONFIG, kolla={'enable_heat': 'yes'})
+        self.assertEqual({'up': False, 'os': True, 'init': True},
+                         phases.plan(env, config, False))
+
+    def test_resources_changed(self):
+        env = self.deployed_env(CONFIG)
+        config = dict(CONFIG, resources={'paravance': {'compute': 2}})
+        self.assertEqual({'up': True, 'os': True, 'init': True},
+                         phases.plan(env, config, False))
+
+    def test_inventory_changed(self):
+        env = self.deployed_env(CONFIG)
+        self.inventory.write_text('[control]\nenos-1\n')
+        self.assertEqual({'up': False, 'os': True, 'init': True},
+                         phases.plan(env, CONFIG, False))
+
+    def test_pull_only(self):
+        env = self.deployed_env(CONFIG)
+        self.assertEqual({'up': True, 'os': True, 'init': True},
+                         phases.plan(env, CONFIG, True))
+
+    def test_mark_done_forgets_following_phases(self):
+        env = self.deployed_env(CONFIG)
+        phases.mark_done(env, 'up', 'new-fp')
+        self.assertEqual({'up': 'new-fp'}, env['phases'])
+
+    def test_forget(self):
+        env = self.deployed_env(CONFIG)
+        phases.forget(env, 'os')
+        self.assertEqual(['up'], list(env['phases']))
+
+
+if __name__ == '__main__':
+    unittest.main()
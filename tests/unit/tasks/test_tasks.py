@@ -1,9 +1,26 @@
+import importlib
+import json
+import os
 import tempfile
 import unittest
 from pathlib import Path
 
+import enoslib as elib
+import mock
+
 import enos.tasks as tasks
-from enos.utils.errors import EnosUnknownProvider
+from enos.provider.enos_vagrant import Enos_vagrant
+from enos.services import KollaAnsible
+from enos.tasks.up import (CARRIED_KEYS, UP_STEPS, UpArgs,
+                           docker_daemon_profile, get_ipam,
+                           mk_kolla_docker_custom_config)
+from enos.utils import facts, store
+from enos.utils.ipam import IPAllocator
+from enos.utils.errors import (EnosCannotScale, EnosUnknownProvider,
+                               EnosUnknownStep, MissingEnvState)
+
+# `enos.tasks.up` is the function, get the module
+up_module = importlib.import_module('enos.tasks.up')
 
 PROVIDERS = [
     'g5k', 'vagrant:virtualbox', 'vagrant:libvirt',
@@ -44,5 +61,432 @@ class TestNewTask(unittest.TestCase):
             tasks.new('unexist', output_path)
 
 
+class FakeEnv(dict):
+    env_name = Path('env-dir')
+
+    def dump(self):
+        pass
+
+
+class TestUpTask(unittest.TestCase):
+    def setUp(self):
+        # Replace steps of `up` with mocks
+        self.steps = {name: mock.Mock() for name in UP_STEPS}
+        patcher = mock.patch.dict(UP_STEPS, self.steps)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        patcher = mock.patch.object(KollaAnsible, 'pull_in_background')
+        self.pull_in_background = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def up(self, env, config={'provider': {'type': 'g5k'}}, **kwargs):
+        tasks.up(env, config, False, False, None, **kwargs)
+
+    def called_steps(self):
+        return [name for name, step in self.steps.items() if step.called]
+
+    def test_up_runs_all_steps(self):
+        env = FakeEnv()
+        self.up(env)
+        self.pull_in_background.assert_called_once()
+        self.assertEqual(list(UP_STEPS), self.called_steps())
+        self.assertEqual(list(UP_STEPS), env['up-steps']['done'])
+        self.assertIn('up', env['phases'])
+
+    def test_resume(self):
+        env = FakeEnv()
+        self.steps['docker'].side_effect = Exception('docker failed')
+        with self.assertRaises(Exception):
+            self.up(env)
+        self.assertEqual(['provider', 'sync_info', 'inventory'],
+                         env['up-steps']['done'])
+        self.assertNotIn('phases', env)
+
+        for step in self.steps.values():
+            step.reset_mock(side_effect=True)
+        self.up(env, config=None, resume=True)
+        self.assertEqual(list(UP_STEPS)[3:], self.called_steps())
+        self.assertIn('up', env['phases'])
+
+    def test_only(self):
+        env = FakeEnv()
+        self.up(env)
+        for step in self.steps.values():
+            step.reset_mock()
+
+        self.pull_in_background.reset_mock()
+        self.up(env, config=None, only='docker')
+        self.assertEqual(['docker'], self.called_steps())
+        self.pull_in_background.assert_not_called()
+
+    def test_only_unknown_step(self):
+        with self.assertRaises(EnosUnknownStep):
+            self.up(FakeEnv(), config=None, only='nope')
+
+    def test_resume_without_former_up(self):
+        with self.assertRaises(MissingEnvState):
+            self.up(FakeEnv(), config=None, resume=True)
+
+
+class TestDockerDaemon(unittest.TestCase):
+
+    def setUp(self):
+        self.docker = mock.Mock(registry_opts={'type': 'internal',
+                                               'ip': '10.0.0.1',
+                                               'port': 5000})
+
+    def test_default_profile(self):
+        config = mk_kolla_docker_custom_config(
+            self.docker, daemon=docker_daemon_profile({}))
+        self.assertFalse(config['debug'])
+        self.assertEqual(['http://10.0.0.1:5000'], config['registry-mirrors'])
+
+    def test_custom_profile(self):
+        daemon = docker_daemon_profile({'docker_daemon': {
+            'debug': True,
+            'max-concurrent-downloads': 3,
+            'data-root': '/tmp/docker'}})
+        self.assertEqual('/tmp/docker', daemon['data-root'])
+
+        config = mk_kolla_docker_custom_config(self.docker, daemon=daemon)
+        self.assertTrue(config['debug'])
+        self.assertEqual(3, config['max-concurrent-downloads'])
+        self.assertEqual('json-file', config['log-driver'])
+        self.assertNotIn('data-root', config)
+
+
+class TestDockerStep(unittest.TestCase):
+
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self._tmp.cleanup)
+        self.hosts = [elib.Host(f'10.0.0.{i}', alias=f'enos-{i}')
+                      for i in range(4)]
+        self.env = FakeEnv(
+            config={'registry': {'type': 'external', 'ip': '10.0.0.9',
+                                 'port': 5000}},
+            rsc=elib.Roles({'all': self.hosts}),
+            inventory=str(Path(self._tmp.name) / 'multinode'))
+
+        # Docker services are mocks with their options as attributes
+        self.dockers = []
+        for name, patch in [
+                ('Docker', {'side_effect': self.mk_docker}),
+                ('ensure_python3', {}), ('play_on', {})]:
+            patcher = mock.patch.object(up_module.elib, name, **patch)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def mk_docker(self, **kwargs):
+        self.dockers.append(mock.Mock(**kwargs))
+        return self.dockers[-1]
+
+    def docker(self, limit=None):
+        UP_STEPS['docker'](self.env, UpArgs(False, False, None, None, limit))
+        return [d for d in self.dockers if d.deploy.called]
+
+    def test_all_hosts(self):
+        deployed, = self.docker()
+        self.assertCountEqual(self.hosts, deployed.agent)
+        self.assertIs(deployed, self.env['docker'])
+
+    def test_limit(self):
+        deployed, = self.docker(limit=['enos-3'])
+        self.assertEqual([self.hosts[3]], deployed.agent)
+        self.assertCountEqual(self.hosts, self.env['docker'].agent,
+                              msg='The recorded Docker should span all hosts')
+
+    def test_limit_mirrors(self):
+        mirrors = mock.Mock()
+        self.env['registry-mirrors'] = mirrors
+        self.env['config']['registry']['mirror_per'] = 2
+        with mock.patch.object(up_module, 'RegistryMirrors') as new_mirrors:
+            self.docker(limit=['enos-3'])
+        self.assertFalse(new_mirrors.called,
+                         msg='Former hosts should keep their mirror')
+        mirrors.add_hosts.assert_called_once_with([self.hosts[3]])
+        mirrors.deploy.assert_called_once_with(
+            mirrors.add_hosts.return_value)
+        self.assertIs(mirrors, self.env['registry-mirrors'])
+
+
+class TestSyncInfo(unittest.TestCase):
+
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self._tmp.cleanup)
+        self.hosts = [elib.Host(f'10.0.0.{i}', alias=f'enos-{i}')
+                      for i in range(3)]
+        self.env = FakeEnv(networks={},
+                           rsc=elib.Roles({'all': self.hosts,
+                                           'compute': self.hosts[1:]}))
+        self.env.env_name = Path(self._tmp.name)
+
+        for name, patch in [('sync_info', {'side_effect': self.sync_info}),
+                            ('set_network_interfaces', {})]:
+            target = up_module.elib if name == 'sync_info' else up_module
+            patcher = mock.patch.object(target, name, **patch)
+            self.addCleanup(patcher.stop)
+            setattr(self, name, patcher.start())
+
+    def sync_info(self, hosts, networks):
+        return [elib.Host(h.address, alias=h.alias, extra={'synced': True})
+                for h in hosts]
+
+    def cache_facts(self, alias):
+        cache_dir = facts.fact_cache_dir(self.env.env_name)
+        cache_dir.mkdir(exist_ok=True)
+        (cache_dir / alias).write_text(json.dumps({
+            'ansible_interfaces': ['eth0'],
+            'ansible_eth0': {'device': 'eth0', 'type': 'ether',
+                             'ipv4': {'address': '10.0.0.1',
+                                      'netmask': '255.255.255.0'}}}))
+
+    def sync(self, limit=None):
+        UP_STEPS['sync_info'](self.env,
+                              UpArgs(False, False, None, None, limit))
+        return {h.alias: h for h in self.env['rsc'].all()}
+
+    def test_no_cache(self):
+        synced = self.sync()
+        self.assertEqual(
+            ['enos-0', 'enos-1', 'enos-2'],
+            sorted(h.alias for h in self.sync_info.call_args[0][0]))
+        self.assertTrue(all(h.extra.get('synced') for h in synced.values()))
+
+    def test_cached_facts(self):
+        self.cache_facts('enos-1')
+        synced = self.sync()
+        self.assertEqual(
+            ['enos-0', 'enos-2'],
+            sorted(h.alias for h in self.sync_info.call_args[0][0]))
+        self.assertEqual(['eth0'], [d.name for d in
+                                    synced['enos-1'].net_devices])
+        self.assertEqual(set(), self.hosts[1].net_devices,
+                         msg='Former hosts should not be mutated')
+        self.assertEqual(['enos-1', 'enos-2'],
+                         sorted(h.alias for h in self.env['rsc']['compute']))
+
+    def test_all_cached_and_limit(self):
+        self.cache_facts('enos-1')
+        self.sync(limit=['enos-1'])
+        self.assertFalse(self.sync_info.called)
+
+
+class TestGetIpam(unittest.TestCase):
+
+    @mock.patch.object(up_module, 'get_vip_pool')
+    @mock.patch.object(up_module, 'addresses_in_use')
+    def test_vips_of_former_env(self, addresses_in_use, get_vip_pool):
+        get_vip_pool.return_value = mock.Mock(
+            network='10.0.0.0/24', has_free_ips=True,
+            pool_start='10.0.0.10', pool_end='10.0.0.100')
+        former = IPAllocator('10.0.0.0/24', '10.0.0.10', '10.0.0.100')
+        vip = former.allocate('vip')
+
+        # The VIP is held by keepalived of the former deployment
+        addresses_in_use.return_value = {vip}
+        env = FakeEnv(config={}, rsc={}, ipam=former)
+        self.assertEqual(vip, get_ipam(env, {}).allocate('vip'))
+
+        env = FakeEnv(config={}, rsc={})
+        self.assertNotEqual(vip, get_ipam(env, {}).allocate('vip'),
+                            msg='Without the former env, the VIP is in use')
+
+
+class TestBootstrap(unittest.TestCase):
+
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self._tmp.cleanup)
+        self.inventory = Path(self._tmp.name) / 'multinode'
+        self.write_inventory(['enos-1'])
+        self.kolla = mock.MagicMock(
+            globals_values={'docker_registry': 'x:5000'})
+        self.env = FakeEnv(config={}, inventory=str(self.inventory))
+        self.env['kolla-ansible'] = self.kolla
+
+        # Hosts of the inventory answer with their boot id
+        self.boot_ids = {}
+        patcher = mock.patch.object(up_module.elib, 'run_command',
+                                    side_effect=self.run_command)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def write_inventory(self, computes):
+        self.inventory.write_text(
+            '[control]\nenos-0\n[compute]\n' + '\n'.join(computes)
+            + '\n[baremetal:children]\ncontrol\ncompute\n')
+
+    def run_command(self, cmd, **kwargs):
+        hosts = ['enos-0'] + [
+            line for line in self.inventory.read_text().splitlines()
+            if line.startswith('enos-') and line != 'enos-0']
+        return [mock.Mock(host=h, stdout=self.boot_ids.get(h, 'boot-0\n'))
+                for h in hosts]
+
+    def bootstrap(self, is_force_deploy=False):
+        self.kolla.execute.reset_mock()
+        UP_STEPS['bootstrap'](self.env,
+                              UpArgs(is_force_deploy, False, None, None, None))
+        if not self.kolla.execute.called:
+            return None
+        return [arg for arg in self.kolla.execute.call_args[0][0]
+                if arg.startswith('--limit')]
+
+    def test_new_hosts(self):
+        self.assertEqual([], self.bootstrap(), msg='All hosts, no limit')
+        self.assertIsNone(self.bootstrap(), msg='No new host')
+
+        self.write_inventory(['enos-1', 'enos-2', 'enos-3'])
+        self.assertEqual(['--limit enos-2,enos-3'], self.bootstrap())
+        self.assertEqual([], self.bootstrap(is_force_deploy=True))
+
+    def test_etc_hosts_of_former_hosts(self):
+        self.bootstrap()
+        self.assertFalse(self.kolla.play_on.called)
+
+        self.write_inventory(['enos-1', 'enos-2'])
+        self.bootstrap()
+        self.assertEqual('baremetal',
+                         self.kolla.play_on.call_args[1]['pattern_hosts'])
+        yml = self.kolla.play_on.return_value.__enter__.return_value
+        self.assertEqual('/etc/hosts',
+                         yml.blockinfile.call_args[1]['dest'])
+
+    def test_changed_globals(self):
+        self.bootstrap()
+        self.kolla.globals_values['kolla_internal_vip_address'] = '10.0.0.2'
+        self.assertIsNone(self.bootstrap())
+        self.kolla.globals_values['docker_registry'] = 'y:5000'
+        self.assertEqual([], self.bootstrap())
+
+    def test_rebooted_hosts(self):
+        self.write_inventory(['enos-1', 'enos-2'])
+        self.bootstrap()
+        # enos-2 is redeployed under the same name
+        self.boot_ids['enos-2'] = 'boot-1\n'
+        self.assertEqual(['--limit enos-2'], self.bootstrap())
+
+    def test_fresh_env(self):
+        # `enos up` opens a new env each time, the bootstrapped hosts of the
+        # former one remain
+        cwd = os.getcwd()
+        os.chdir(self._tmp.name)
+        self.addCleanup(os.chdir, cwd)
+        patcher = mock.patch('enos.utils.constants.SYMLINK_NAME',
+                             str(Path(self._tmp.name) / 'current'))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        for computes, limit in [(['enos-1'], []),
+                                (['enos-1'], None),
+                                (['enos-1', 'enos-2'], ['--limit enos-2'])]:
+            self.write_inventory(computes)
+            self.env = store.open_env(True, None, carry=CARRIED_KEYS)
+            self.env['config'] = {}
+            self.env['inventory'] = str(self.inventory)
+            self.env['kolla-ansible'] = self.kolla
+            self.assertEqual(limit, self.bootstrap())
+            del self.env['kolla-ansible']  # A mock does not pickle
+            self.env.dump()
+
+
+class TestInstallOs(unittest.TestCase):
+
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self._tmp.cleanup)
+        inventory = Path(self._tmp.name) / 'multinode'
+        inventory.write_text('[control]\nenos-0\n[nova:children]\ncontrol\n')
+        self.env = FakeEnv(config={}, inventory=str(inventory))
+        self.env['kolla-ansible'] = mock.Mock(
+            globals_values={'enable_nova': 'yes'})
+
+        patcher = mock.patch.object(tasks, 'kolla_ansible')
+        self.kolla_ansible = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def install_os(self, is_pull_only=False, changed_only=False):
+        self.kolla_ansible.reset_mock()
+        tasks.install_os(self.env, False, is_pull_only, None, changed_only)
+        if not self.kolla_ansible.called:
+            return None
+        return self.kolla_ansible.call_args[0][1]
+
+    def test_changed_only(self):
+        self.assertEqual(['deploy'], self.install_os(changed_only=True))
+        self.assertIsNone(self.install_os(changed_only=True))
+
+    def test_changed_only_after_pull(self):
+        self.assertEqual(['pull'], self.install_os(is_pull_only=True))
+        self.assertNotIn('os-applied', self.env)
+        self.assertEqual(['deploy'], self.install_os(changed_only=True),
+                         msg='A pull does not deploy anything')
+
+    def test_changed_only_with_tags_or_parallel(self):
+        with self.assertRaises(ValueError):
+            tasks.install_os(self.env, False, False, 'nova', True)
+        with self.assertRaises(ValueError):
+            tasks.install_os(self.env, False, False, None, True, 4)
+        self.assertFalse(self.kolla_ansible.called)
+
+
+class TestScale(unittest.TestCase):
+
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self._tmp.cleanup)
+        inventory = Path(self._tmp.name) / 'multinode'
+        inventory.write_text('[compute]\nenos-1\n')
+
+        self.former = elib.Host('10.0.0.1', alias='enos-1')
+        self.env = FakeEnv(
+            config={'provider': {'type': 'vagrant'},
+                    'resources': {'medium': {'compute': 1}}},
+            rsc=elib.Roles({'compute': [self.former]}),
+            inventory=str(inventory))
+        self.env['kolla-ansible'] = mock.Mock(globals_values={})
+
+        # The vagrant provider, without the creation of machines
+        self.provider = Enos_vagrant()
+        self.steps = {name: mock.Mock() for name in UP_STEPS}
+        for patcher in [mock.patch.dict(UP_STEPS, self.steps),
+                        mock.patch('enos.tasks.tune_ansible'),
+                        mock.patch('enos.tasks.make_provider',
+                                   return_value=self.provider),
+                        mock.patch.object(self.provider, 'init')]:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.kolla = self.env['kolla-ansible']
+
+    def test_scale(self):
+        self.provider.init.return_value = (elib.Roles({'compute': [
+            elib.Host('10.0.0.1', alias='enos-1'),
+            elib.Host('10.0.0.2', alias='enos-2')]}), [])
+        tasks.scale(self.env, 'compute', 1)
+
+        config = self.provider.init.call_args[0][0]
+        self.assertEqual({'medium': {'compute': 2}}, config['resources'])
+        self.assertEqual([1, 1], [m['number'] for m in
+                                  config['provider']['resources']['machines']],
+                         msg='The new host should be in a new group')
+        self.assertIs(self.former, self.env['rsc']['compute'][0],
+                      msg='Former hosts should keep their description')
+        args = self.steps['bootstrap'].call_args[0][1]
+        self.assertEqual(['enos-2'], args.limit)
+        self.assertFalse(self.steps['provider'].called)
+        self.assertEqual(['deploy', '--limit enos-2'],
+                         self.kolla.execute.call_args[0][0])
+
+    def test_provider_cannot_extend(self):
+        self.provider.init.return_value = (
+            elib.Roles({'compute': [self.former]}), [])
+        with self.assertRaises(EnosCannotScale):
+            tasks.scale(self.env, 'compute', 1)
+        self.assertFalse(self.kolla.execute.called)
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,58 @@
+import os
+import tempfile
+import unittest
+from pathlib import Path
+
+import mock
+from ansible import constants as ansible_constants
+
+from enos.utils import ansible_config
+
+
+class TestAnsibleConfig(unittest.TestCase):
+
+    def test_forks(self):
+        def forks(host_count, cpu_count):
+            settings = ansible_config.tune(host_count, cpu_count=cpu_count)
+            return settings['defaults']['forks']
+
+        self.assertEqual(5, forks(3, 4))
+        self.assertEqual(30, forks(30, 4))
+        self.assertEqual(40, forks(300, 4))
+
+    def test_overrides(self):
+        settings = ansible_config.tune(
+            300, {'forks': 100, 'strategy': 'free'}, cpu_count=4)
+        self.assertEqual({'forks': 100, 'strategy': 'free'},
+                         settings['defaults'])
+        self.assertEqual({'pipelining': True}, settings['ssh_connection'],
+                         msg='SSH arguments of the user should remain')
+
+        settings = ansible_config.tune(3, {'ssh_args': '-o Foo=yes'})
+        self.assertEqual('-o Foo=yes', settings['ssh_connection']['ssh_args'])
+
+    @mock.patch.dict(os.environ)
+    @mock.patch.multiple(ansible_constants,
+                         DEFAULT_FORKS=5, DEFAULT_STRATEGY='linear')
+    def test_write_and_apply(self):
+        with tempfile.TemporaryDirectory() as env_dir:
+            # Nothing to apply without ansible.cfg
+            ansible_config.apply(Path(env_dir))
+            self.assertEqual(5, ansible_constants.DEFAULT_FORKS)
+
+            settings = ansible_config.tune(
+                300, {'strategy': 'free'}, cpu_count=4)
+            path = ansible_config.write(Path(env_dir), settings)
+            ansible_config.apply(Path(env_dir))
+
+            self.assertTrue(path.is_file())
+            self.assertNotIn('ANSIBLE_CONFIG', os.environ)
+            self.assertNotIn('ANSIBLE_SSH_ARGS', os.environ)
+            self.assertEqual('40', os.environ['ANSIBLE_FORKS'])
+            self.assertEqual('True', os.environ['ANSIBLE_PIPELINING'])
+            self.assertEqual(40, ansible_constants.DEFAULT_FORKS)
+            self.assertEqual('free', ansible_constants.DEFAULT_STRATEGY)
+
+
+if __name__ == '__main__':
+    unittest.main()
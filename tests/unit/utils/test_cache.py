@@ -0,0 +1,60 @@
+import os
+import tempfile
+import time
+import unittest
+
+import mock
+
+from enos.utils import cache
+
+
+class TestCache(unittest.TestCase):
+
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        patcher = mock.patch('enos.utils.constants.CACHE_DIR', self._tmp.name)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(self._tmp.cleanup)
+
+        # Stub of the API
+        self.fetch = mock.Mock(
+            side_effect=lambda keys: {k: f'{k}-value' for k in keys})
+
+    def test_lookup_is_cached(self):
+        values = cache.cached_lookup('ns', ['a', 'b'], self.fetch, ttl=60)
+        self.assertEqual({'a': 'a-value', 'b': 'b-value'}, values)
+        self.fetch.assert_called_once_with(['a', 'b'])
+
+        self.fetch.reset_mock()
+        values = cache.cached_lookup('ns', ['a', 'b'], self.fetch, ttl=60)
+        self.assertEqual({'a': 'a-value', 'b': 'b-value'}, values)
+        self.fetch.assert_not_called()
+
+    def test_only_missing_keys_are_fetched(self):
+        cache.cached_lookup('ns', ['a'], self.fetch, ttl=60)
+        self.fetch.reset_mock()
+        cache.cached_lookup('ns', ['a', 'b'], self.fetch, ttl=60)
+        self.fetch.assert_called_once_with(['b'])
+
+    def test_expired_entry_is_fetched(self):
+        cache.cached_lookup('ns', ['a'], self.fetch, ttl=60)
+        path = cache._path('ns', 'a')
+        old = time.time() - 120
+        os.utime(path, (old, old))
+
+        self.fetch.reset_mock()
+        cache.cached_lookup('ns', ['a'], self.fetch, ttl=60)
+        self.fetch.assert_called_once_with(['a'])
+
+    def test_entries_and_purge(self):
+        cache.cached_lookup('ns', ['a', 'b'], self.fetch, ttl=60)
+        self.assertEqual([('ns', 'a'), ('ns', 'b')],
+                         [(e.namespace, e.key) for e in cache.entries()])
+
+        cache.purge()
+        self.assertEqual([], cache.entries())
+
+
+if __name__ == '__main__':
+    unittest.main()
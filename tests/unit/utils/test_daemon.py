@@ -0,0 +1,106 @@
+import os
+import socket
+import tempfile
+import unittest
+from collections import OrderedDict
+from pathlib import Path
+
+import mock
+
+from enos.utils import daemon
+
+
+class TestWireProtocol(unittest.TestCase):
+
+    def setUp(self):
+        self.client, self.server = socket.socketpair(socket.AF_UNIX)
+
+    def tearDown(self):
+        self.client.close()
+        self.server.close()
+
+    def test_message_roundtrip(self):
+        msg = {'argv': ['info', '-e', 'env'], 'environ': {'K': 'V' * 10000}}
+        daemon._send_msg(self.client, msg)
+        self.assertEqual((msg, []), daemon._recv_msg(self.server))
+
+    def test_message_with_fds(self):
+        with tempfile.TemporaryFile() as f:
+            f.write(b'enos')
+            f.flush()
+            daemon._send_msg(self.client, {'exit': 0},
+                             fds=[f.fileno(), f.fileno(), f.fileno()])
+            msg, fds = daemon._recv_msg(self.server)
+
+        self.assertEqual({'exit': 0}, msg)
+        self.assertEqual(3, len(fds))
+        # Received fds point to the same file
+        os.lseek(fds[0], 0, os.SEEK_SET)
+        self.assertEqual(b'enos', os.read(fds[0], 4))
+        for fd in fds:
+            os.close(fd)
+
+    def test_eof(self):
+        self.client.close()
+        self.assertEqual((None, []), daemon._recv_msg(self.server))
+
+
+class TestIsRunning(unittest.TestCase):
+
+    def test_no_socket(self):
+        self.assertFalse(daemon.is_running(''))
+        self.assertFalse(daemon.is_running('/an/unexisting/socket'))
+
+    def test_stale_socket(self):
+        with tempfile.TemporaryDirectory() as dirname:
+            path = os.path.join(dirname, 'enos.sock')
+            with socket.socket(socket.AF_UNIX) as sock:
+                sock.bind(path)
+            self.assertFalse(daemon.is_running(path))
+
+
+class TestLoadEnv(unittest.TestCase):
+
+    def setUp(self):
+        patcher = mock.patch.object(daemon, '_ENVS', OrderedDict())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        # Environments are their directory, and their id is a version
+        self.versions = {}
+        patcher = mock.patch('enos.utils.store.env_id',
+                             side_effect=self.versions.get)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = mock.patch(
+            'enos.utils.store.JournaledEnvironment.load',
+            side_effect=lambda env_dir: (env_dir, self.versions[env_dir]))
+        self.load = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def load_env(self, name, version=0):
+        env_dir = Path(f'/envs/{name}')
+        self.versions[env_dir] = version
+        return daemon.load_env(env_dir)
+
+    def test_reuse_and_reload(self):
+        env = self.load_env('a')
+        self.assertIs(env, self.load_env('a'))
+        self.assertEqual(1, self.load.call_count)
+
+        self.assertEqual(1, self.load_env('a', version=1)[1])
+        self.assertEqual(1, len(daemon._ENVS),
+                         msg='The stale environment should be dropped')
+
+    def test_bounded(self):
+        for name in 'abc':
+            self.load_env(name)
+        self.load_env('a')  # Most recently used
+        self.load_env('d')
+        self.assertEqual(daemon._MAX_ENVS, len(daemon._ENVS))
+        self.assertEqual(['/envs/c', '/envs/a', '/envs/d'],
+                         [str(d) for d in daemon._ENVS])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,6 +1,7 @@
 import unittest
 import enos.utils.extra as xenos
-from enos.utils.errors import (EnosFilePathError, EnosUnknownProvider)
+from enos.utils.errors import (EnosCannotScale, EnosFilePathError,
+                               EnosUnknownProvider)
 import enos.utils.constants as C
 import contextlib
 import os
@@ -139,5 +140,68 @@ def working_directory(path):
         os.chdir(prev_cwd)
 
 
+class TestSetNetworkInterfaces(unittest.TestCase):
+
+    def setUp(self):
+        from enoslib.objects import DefaultNetwork, IPAddress, NetDevice
+        import enoslib as elib
+
+        self.int_net = DefaultNetwork('192.168.42.0/24')
+        self.ext_net = DefaultNetwork('192.168.43.0/24')
+        self.networks = {C.NETWORK_INTERFACE: [self.int_net],
+                         C.API_INTERFACE: [],
+                         C.NEUTRON_EXTERNAL_INTERFACE: [self.ext_net]}
+
+        self.hosts = []
+        for i in range(3):
+            host = elib.Host(f'10.0.0.{i}', alias=f'enos-{i}')
+            host.net_devices = {
+                NetDevice('eth1', {IPAddress(f'192.168.42.{i}/24',
+                                             self.int_net)}),
+                NetDevice('eth2', {IPAddress(f'192.168.43.{i}/24',
+                                             self.ext_net)})}
+            self.hosts.append(host)
+        self.roles = elib.Roles({'control': self.hosts})
+
+    def test_index_interfaces(self):
+        index = xenos.index_interfaces(self.roles)
+        self.assertEqual({'enos-0', 'enos-1', 'enos-2'},
+                         set(index['192.168.42.0/24']))
+        self.assertEqual('eth2', index['192.168.43.0/24']['enos-1'][1])
+
+    def test_set_network_interfaces(self):
+        xenos.set_network_interfaces(
+            self.roles, self.networks,
+            [C.NETWORK_INTERFACE, C.API_INTERFACE,
+             C.NEUTRON_EXTERNAL_INTERFACE])
+        for host in self.hosts:
+            self.assertEqual('eth1', host.extra[C.NETWORK_INTERFACE])
+            self.assertEqual('eth2', host.extra[C.NEUTRON_EXTERNAL_INTERFACE])
+            self.assertNotIn(C.API_INTERFACE, host.extra)
+
+    def test_missing_network_interface(self):
+        self.hosts[2].net_devices = set()
+        with self.assertRaises(ValueError):
+            xenos.set_network_interfaces(
+                self.roles, self.networks, [C.NETWORK_INTERFACE])
+
+
+class TestAddResources(unittest.TestCase):
+
+    def test_add_resources(self):
+        resources = {'paravance': {'control': 1, 'compute': 2},
+                     'parasilo': {'compute': 1}}
+        self.assertEqual(
+            {'paravance': {'control': 1, 'compute': 5},
+             'parasilo': {'compute': 1}},
+            xenos.add_resources(resources, 'compute', 3))
+        self.assertEqual(2, resources['paravance']['compute'],
+                         msg='The resources should not be modified')
+
+    def test_unknown_role(self):
+        with self.assertRaises(EnosCannotScale):
+            xenos.add_resources({'paravance': {'control': 1}}, 'compute', 1)
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,69 @@
+import os
+import tempfile
+import unittest
+from pathlib import Path
+
+import mock
+from ansible import constants as ansible_constants
+
+from enos.utils import facts
+
+
+@mock.patch.dict(os.environ)
+@mock.patch.multiple(ansible_constants,
+                     CACHE_PLUGIN='memory',
+                     CACHE_PLUGIN_CONNECTION=None,
+                     CACHE_PLUGIN_TIMEOUT=86400,
+                     DEFAULT_GATHERING='implicit')
+class TestFactCache(unittest.TestCase):
+
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self._tmp.cleanup)
+        self.env_dir = Path(self._tmp.name)
+
+    def test_enable(self):
+        facts.enable_fact_cache(self.env_dir, ttl=60)
+        self.assertEqual('jsonfile', ansible_constants.CACHE_PLUGIN)
+        self.assertEqual('smart', ansible_constants.DEFAULT_GATHERING)
+        self.assertEqual(str((self.env_dir / 'facts').resolve()),
+                         os.environ['ANSIBLE_CACHE_PLUGIN_CONNECTION'])
+        self.assertEqual('60', os.environ['ANSIBLE_CACHE_PLUGIN_TIMEOUT'])
+
+    def test_disable(self):
+        facts.enable_fact_cache(self.env_dir, ttl=0)
+        self.assertEqual('memory', ansible_constants.CACHE_PLUGIN)
+        self.assertNotIn('ANSIBLE_CACHE_PLUGIN', os.environ)
+
+    def test_entries_and_refresh(self):
+        self.assertEqual([], facts.entries(self.env_dir))
+
+        facts.fact_cache_dir(self.env_dir).mkdir()
+        (facts.fact_cache_dir(self.env_dir) / 'enos-0').write_text('{}')
+        self.assertEqual(['enos-0'],
+                         [e.host for e in facts.entries(self.env_dir)])
+
+        facts.refresh(self.env_dir)
+        self.assertEqual([], facts.entries(self.env_dir))
+
+    def test_cached_facts(self):
+        self.assertEqual({}, facts.cached_facts(self.env_dir, ['enos-0']))
+
+        cache_dir = facts.fact_cache_dir(self.env_dir)
+        cache_dir.mkdir()
+        (cache_dir / 'enos-0').write_text('{"ansible_hostname": "enos-0"}')
+        (cache_dir / 'enos-1').write_text('{"ansible_hostname": "enos-1"}')
+        (cache_dir / 'enos-2').write_text('{"ansible_host')  # Torn write
+        self.assertEqual(
+            {'enos-0': {'ansible_hostname': 'enos-0'}},
+            facts.cached_facts(self.env_dir, ['enos-0', 'enos-2', 'enos-3']))
+
+        # Expired, or disabled cache
+        old = (cache_dir / 'enos-0').stat().st_mtime - 120
+        os.utime(cache_dir / 'enos-0', (old, old))
+        self.assertEqual({}, facts.cached_facts(self.env_dir, ['enos-0'], 60))
+        self.assertEqual({}, facts.cached_facts(self.env_dir, ['enos-1'], 0))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,61 @@
+import os
+import tempfile
+import unittest
+
+import enoslib as elib
+from enoslib.enos_inventory import EnosInventory
+
+import enos.utils.constants as C
+from enos.utils.extra import KOLLA_MANDATORY_GROUPS
+from enos.utils.inventory import Inventory
+
+BASE_INVENTORY = os.path.join(C.RSCS_DIR, 'inventory.sample')
+
+
+class TestInventory(unittest.TestCase):
+
+    def setUp(self):
+        self.hosts = [
+            elib.Host(f'10.0.0.{i}', alias=f'enos-{i}', user='root',
+                      extra={'network_interface': 'eth1'})
+            for i in range(4)]
+        self.roles = elib.Roles({
+            'control': self.hosts[0:1],
+            'network': self.hosts[1:2],
+            'compute': self.hosts[2:4],
+        })
+        self.inventory = Inventory(
+            self.roles, BASE_INVENTORY, KOLLA_MANDATORY_GROUPS)
+
+    def test_same_groups_as_ansible(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'multinode')
+            self.inventory.write(path)
+            ansible_inventory = EnosInventory(sources=path)
+
+            for group in ansible_inventory.list_groups():
+                self.assertCountEqual(
+                    [h.get_name() for h in ansible_inventory.get_hosts(group)],
+                    self.inventory.group_hosts.get(group, []),
+                    msg=f'Hosts of {group} differ from Ansible ones')
+
+            host = ansible_inventory.get_host('enos-2')
+            self.assertEqual('10.0.0.2', host.vars['ansible_host'])
+            self.assertEqual('eth1', host.vars['network_interface'])
+
+    def test_indexes(self):
+        self.assertEqual(['enos-0'],
+                         self.inventory.group_hosts['enos/registry'])
+        self.assertEqual([], self.inventory.group_hosts['storage'])
+        self.assertIn('collectd', self.inventory.host_groups['enos-3'])
+        self.assertNotIn('collectd', self.inventory.host_groups['enos-0'])
+
+    def test_to_roles(self):
+        roles = self.inventory.to_roles()
+        self.assertCountEqual(self.hosts[0:1], roles['enos/registry'])
+        self.assertCountEqual(self.hosts[2:4], roles['compute'])
+        self.assertCountEqual(self.hosts, roles['baremetal'])
+
+
+if __name__ == '__main__':
+    unittest.main()
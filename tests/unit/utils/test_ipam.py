@@ -0,0 +1,103 @@
+import pickle
+import unittest
+
+import enoslib as elib
+from enoslib.objects import DefaultNetwork, IPAddress, NetDevice
+
+from enos.utils.ipam import IPAllocator, addresses_in_use
+
+
+class TestIPAllocator(unittest.TestCase):
+
+    def setUp(self):
+        self.ipam = IPAllocator(
+            '192.168.42.0/24', '192.168.42.10', '192.168.42.20')
+
+    def test_allocate(self):
+        self.assertEqual('192.168.42.10', self.ipam.allocate('vip'))
+        self.assertEqual('192.168.42.11', self.ipam.allocate('influx_vip'))
+        self.assertEqual({'vip': ['192.168.42.10'],
+                          'influx_vip': ['192.168.42.11']},
+                         self.ipam.reservations)
+
+    def test_allocate_is_stable(self):
+        vip = self.ipam.allocate('vip')
+        self.ipam.allocate('influx_vip')
+        self.assertEqual(vip, self.ipam.allocate('vip'))
+
+        # Still stable once the env is saved and loaded
+        ipam = pickle.loads(pickle.dumps(self.ipam))
+        self.assertEqual(vip, ipam.allocate('vip'))
+        self.assertEqual('192.168.42.12', ipam.allocate('grafana_vip'))
+
+    def test_allocate_block(self):
+        self.ipam.allocate('vip')
+        self.ipam.exclude(['192.168.42.12'])
+        self.assertEqual(['192.168.42.13', '192.168.42.14', '192.168.42.15'],
+                         self.ipam.allocate_block('fips', 3))
+        # The address skipped by the block is not lost
+        self.assertEqual('192.168.42.11', self.ipam.allocate('other'))
+        self.assertEqual('192.168.42.16', self.ipam.allocate('another'))
+        with self.assertRaises(ValueError):
+            self.ipam.allocate_block('fips', 2)
+
+    def test_allocate_block_exhausted(self):
+        self.ipam.exclude(['192.168.42.15'])
+        self.ipam.allocate_block('fips', 4)
+        with self.assertRaises(ValueError):
+            self.ipam.allocate_block('more_fips', 8)
+        self.assertEqual(5, len({self.ipam.allocate(f'vip{i}')
+                                 for i in range(5)}),
+                         msg='Every other address remains available')
+        with self.assertRaises(ValueError):
+            self.ipam.allocate('vip5')
+
+    def test_release(self):
+        self.ipam.allocate('vip')
+        influx_vip = self.ipam.allocate('influx_vip')
+        self.ipam.release('influx_vip')
+        self.assertNotIn('influx_vip', self.ipam.reservations)
+        self.assertEqual(influx_vip, self.ipam.allocate('grafana_vip'))
+
+    def test_exclude(self):
+        vip = self.ipam.allocate('vip')
+        self.ipam.exclude([vip, '192.168.42.11', '10.0.0.1'])
+        self.assertEqual(vip, self.ipam.allocate('vip'))
+        self.assertEqual('192.168.42.12', self.ipam.allocate('influx_vip'))
+
+        # A released address excluded meanwhile is not reused
+        self.ipam.release('influx_vip')
+        self.ipam.exclude(['192.168.42.12'])
+        self.assertEqual('192.168.42.13', self.ipam.allocate('grafana_vip'))
+
+    def test_exhausted(self):
+        self.ipam.allocate_block('fips', 10)
+        with self.assertRaises(ValueError):
+            self.ipam.allocate('vip')
+
+    def test_from_network(self):
+        network = DefaultNetwork('192.168.42.0/24',
+                                 ip_start='192.168.42.10',
+                                 ip_end='192.168.42.20')
+        ipam = IPAllocator.from_network(network)
+        self.assertEqual('192.168.42.0/24', ipam.network)
+        self.assertEqual('192.168.42.10', ipam.allocate('vip'))
+
+        with self.assertRaises(ValueError):
+            IPAllocator.from_network(DefaultNetwork('192.168.43.0/24'))
+
+
+class TestAddressesInUse(unittest.TestCase):
+
+    def test_addresses_in_use(self):
+        network = DefaultNetwork('192.168.42.0/24')
+        host = elib.Host('10.0.0.1', alias='enos-0')
+        host.net_devices = {
+            NetDevice('eth1', {IPAddress('192.168.42.10/24', network)})}
+        roles = elib.Roles({'control': [host]})
+        self.assertEqual({'10.0.0.1', '192.168.42.10'},
+                         addresses_in_use(roles))
+
+
+if __name__ == '__main__':
+    unittest.main()
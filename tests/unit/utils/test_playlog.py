@@ -0,0 +1,53 @@
+import unittest
+
+from enos.utils import playlog
+from enos.utils.playlog import PlayLog, TaskTiming
+
+OUTPUT = '''\
+Deploying Playbooks : ansible-playbook -i multinode site.yml
+PLAY [Apply role nova] *********************************************
+TASK [nova : Copying over config.json files for services] **********
+changed: [enos-0] => (item=nova-api)
+changed: [enos-1 -> localhost] => (item=nova-api)
+ok: [enos-0] => (item=nova-scheduler)
+RUNNING HANDLER [nova : Restart nova-api container] ****************
+fatal: [enos-1]: FAILED! => {"changed": false}
+PLAY RECAP *********************************************************
+enos-0 : ok=2    changed=1    unreachable=0    failed=0
+'''
+
+
+class TestPlayLog(unittest.TestCase):
+
+    def feed(self, output):
+        plays = PlayLog()
+        for now, line in enumerate(output.splitlines(keepends=True)):
+            plays.feed(line, now=float(now))
+        plays.close()
+        return plays
+
+    def test_timings(self):
+        plays = self.feed(OUTPUT)
+        task = 'nova : Copying over config.json files for services'
+        handler = 'nova : Restart nova-api container'
+        self.assertEqual([
+            TaskTiming('Apply role nova', task, 'enos-0', 'changed', 3.0),
+            TaskTiming('Apply role nova', task, 'enos-1', 'changed', 2.0),
+            TaskTiming('Apply role nova', handler, 'enos-1', 'failed', 1.0),
+        ], plays.timings)
+        self.assertEqual([OUTPUT.splitlines()[7]], plays.failures)
+
+    def test_no_play(self):
+        plays = self.feed('Usage: kolla-ansible -i INVENTORY ACTION\n')
+        self.assertFalse(plays.started)
+        self.assertEqual([], plays.timings)
+
+    def test_role_durations(self):
+        timings = [
+            TaskTiming('Apply role nova', 'nova : a', 'enos-0', 'ok', 3.0),
+            TaskTiming('Apply role nova', 'nova : a', 'enos-1', 'ok', 5.0),
+            TaskTiming('Apply role nova', 'nova : b', 'enos-0', 'ok', 1.0),
+            TaskTiming('Gather facts', 'Gather facts', 'enos-0', 'ok', 10.0),
+        ]
+        self.assertEqual([('Gather facts', 10.0), ('nova', 6.0)],
+                         playlog.role_durations(timings))
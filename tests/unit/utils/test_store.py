@@ -0,0 +1,136 @@
+import os
+import pickle
+import tempfile
+import unittest
+from pathlib import Path
+
+import mock
+
+from enos.utils import store
+
+
+class TestJournaledEnvironment(unittest.TestCase):
+
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        # Creating an environment links it to `current` in the cwd
+        self._cwd = os.getcwd()
+        os.chdir(self._tmp.name)
+        self.env_dir = Path(self._tmp.name) / 'env-dir'
+        env = store.open_env(True, self.env_dir)
+        env['config'] = {'provider': 'g5k'}
+        env['rsc'] = ['host-0', 'host-1']
+        env.dump()
+
+    def tearDown(self):
+        os.chdir(self._cwd)
+        self._tmp.cleanup()
+
+    def journal_keys(self):
+        return [key for key, _, _, _ in store._read_records(
+            self.env_dir / store.JOURNAL_FILENAME, 0)]
+
+    def test_load(self):
+        env = store.JournaledEnvironment.load(self.env_dir)
+        self.assertEqual({'provider': 'g5k'}, env['config'])
+        self.assertEqual(['host-0', 'host-1'], env['rsc'])
+        self.assertEqual(self.env_dir.resolve(), env.env_name)
+
+    def test_only_changes_are_written(self):
+        env = store.JournaledEnvironment.load(self.env_dir)
+        env['config'].update(vip='10.0.0.1')   # in place mutation
+        env['rsc']                             # read only
+        env.dump()
+
+        self.assertEqual('config', self.journal_keys()[-1])
+        self.assertEqual(
+            1, self.journal_keys().count('rsc'),
+            msg='A key that did not change should not be written again')
+        self.assertEqual(
+            '10.0.0.1',
+            store.JournaledEnvironment.load(self.env_dir)['config']['vip'])
+
+    def test_read_only_does_not_write(self):
+        size = (self.env_dir / store.JOURNAL_FILENAME).stat().st_size
+        env = store.JournaledEnvironment.load(self.env_dir)
+        _ = env.data, env['config'], 'rsc' in env
+        env.dump()
+        self.assertEqual(
+            size, (self.env_dir / store.JOURNAL_FILENAME).stat().st_size)
+
+    def test_delete(self):
+        env = store.JournaledEnvironment.load(self.env_dir)
+        del env['rsc']
+        env.dump()
+        self.assertNotIn('rsc', store.JournaledEnvironment.load(self.env_dir))
+
+    def test_concurrent_writers(self):
+        env1 = store.JournaledEnvironment.load(self.env_dir)
+        env2 = store.JournaledEnvironment.load(self.env_dir)
+        env1['rally'] = 'rally'
+        env1.dump()
+        env2['shaker'] = 'shaker'
+        env2.dump()
+
+        env = store.JournaledEnvironment.load(self.env_dir)
+        self.assertEqual('rally', env['rally'])
+        self.assertEqual('shaker', env['shaker'])
+        self.assertEqual('rally', env2['rally'])
+
+    def test_compaction(self):
+        with mock.patch.object(store, 'COMPACT_MIN_SIZE', 0):
+            env = store.JournaledEnvironment.load(self.env_dir)
+            env['rsc'] = ['host-%s' % i for i in range(1000)]
+            env.dump()
+
+        self.assertEqual(
+            0, (self.env_dir / store.JOURNAL_FILENAME).stat().st_size)
+        env = store.JournaledEnvironment.load(self.env_dir)
+        self.assertEqual(1000, len(env['rsc']))
+        self.assertEqual({'provider': 'g5k'}, env['config'])
+
+    def test_corrupted_journal_tail(self):
+        with open(self.env_dir / store.JOURNAL_FILENAME, 'ab') as journal:
+            record = store._mk_record(
+                'config', 'digest', pickle.dumps({'broken': True}))
+            journal.write(record[:-3])
+
+        env = store.JournaledEnvironment.load(self.env_dir)
+        self.assertEqual({'provider': 'g5k'}, env['config'])
+
+    def test_dump_after_corrupted_journal_tail(self):
+        env = store.JournaledEnvironment.load(self.env_dir)
+        with open(self.env_dir / store.JOURNAL_FILENAME, 'ab') as journal:
+            record = store._mk_record(
+                'config', 'digest', pickle.dumps({'broken': True}))
+            journal.write(record[:-3])
+
+        env['inventory'] = 'multinode'
+        env.dump()
+        env = store.JournaledEnvironment.load(self.env_dir)
+        self.assertEqual('multinode', env['inventory'])
+        self.assertEqual({'provider': 'g5k'}, env['config'])
+
+    def test_new_drops_former_journal(self):
+        env = store.open_env(True, self.env_dir)
+        self.assertNotIn('rsc', env)
+
+    def test_new_carries_keys(self):
+        env = store.open_env(True, self.env_dir, carry=['rsc', 'ipam'])
+        self.assertEqual(['host-0', 'host-1'], env['rsc'])
+        self.assertEqual({}, env['config'])
+        self.assertNotIn('ipam', env)
+        env.dump()
+
+        env = store.JournaledEnvironment.load(self.env_dir)
+        self.assertEqual(['host-0', 'host-1'], env['rsc'])
+
+    def test_load_unexisting(self):
+        from enoslib.errors import EnosFilePathError
+        with self.assertRaises(EnosFilePathError):
+            store.JournaledEnvironment.load(Path(self._tmp.name) / 'nope')
+        self.assertFalse((Path(self._tmp.name) / 'nope').exists())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,49 @@
+import unittest
+
+import enoslib as elib
+
+from enos.utils import tuning
+
+
+class TestTuning(unittest.TestCase):
+
+    def setUp(self):
+        self.control = elib.Host('10.0.0.1', alias='enos-0')
+        self.compute = elib.Host('10.0.0.2', alias='enos-1')
+        self.network = elib.Host('10.0.0.3', alias='enos-2')
+        self.roles = elib.Roles({
+            'control': [self.control],
+            'compute': [self.compute],
+            'network': [self.network],
+            'all': [self.control, self.compute, self.network]})
+
+    def test_profile_for_all(self):
+        profiles = tuning.host_profiles('performance', self.roles)
+        self.assertEqual({'performance'},
+                         {name for name, _ in profiles.values()})
+        self.assertEqual('performance', profiles['enos-0'][1]['governor'])
+
+    def test_profile_per_role(self):
+        profiles = tuning.host_profiles(
+            {'compute': 'performance', 'control': {'hugepages': 512}},
+            self.roles)
+        self.assertEqual('performance', profiles['enos-1'][0])
+        self.assertEqual(('custom:control', 512),
+                         (profiles['enos-0'][0],
+                          profiles['enos-0'][1]['hugepages']))
+        self.assertEqual('default', profiles['enos-2'][0])
+
+    def test_custom_profile_for_all(self):
+        profiles = tuning.host_profiles({'governor': 'powersave'}, self.roles)
+        self.assertEqual('powersave', profiles['enos-2'][1]['governor'])
+        self.assertIsNone(profiles['enos-2'][1]['hugepages'])
+
+    def test_unknown_profile(self):
+        with self.assertRaises(ValueError):
+            tuning.host_profiles('turbo', self.roles)
+        with self.assertRaises(ValueError):
+            tuning.host_profiles({'compute': {'turbo': True}}, self.roles)
+
+
+if __name__ == '__main__':
+    unittest.main()